@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import logging
+import mmap
+import os
+import sys
+import threading
+import time
+
+import pygame
+
+class AlarmTone:
+    """
+    Local alarm sound played with pygame.mixer. The MP3/WAV file is decoded once
+    into a raw PCM file in the asset cache (in the mixer format), at alarm time the
+    PCM file is memory-mapped and streamed to a mixer channel in slices of chunk
+    seconds, so the mixer only copies the slice it plays next.
+    Without a cache directory the decoded samples are kept in memory.
+    """
+
+    def __init__(self, file_name, cache=None, frequency=44100, channels=2, buffer=1024, chunk=0.5, logger=None, on_audio=None):
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger(__name__)
+        self.file_name = file_name
+        self.cache = cache
+        self.frequency = frequency
+        self.channels = channels
+        self.buffer = buffer
+        self.chunk = chunk
+        # on_audio(seconds since play) like the stream players
+        self.on_audio = on_audio
+        self.pcm_file = None
+        self.samples = None
+        self.map = None
+        self.sound = None
+        self.channel = None
+        # streaming state: next byte in the mapping, slice size and remaining loops
+        self.offset = 0
+        self.chunk_size = None
+        self.loops = 0
+        self.level = None
+        self.stopped = threading.Event()
+        # held while queueing a slice, so nothing is queued after stop() returned
+        self.lock = threading.RLock()
+        self.thread = None
+        self.decode_time = None
+        self.load_time = None
+        self.audio_time = None
+
+    def init_mixer(self):
+        """
+        Initialize the pygame mixer on demand (only the display is initialized at startup).
+        """
+        if pygame.mixer.get_init() is None:
+            pygame.mixer.init(self.frequency, -16, self.channels, self.buffer)
+            self.log.info('mixer {0}'.format(pygame.mixer.get_init()))
+        return pygame.mixer.get_init()
+
+    def prepare(self):
+        """
+        Decode the sound file into the PCM cache unless it is there already.
+        Returns False if the file cannot be decoded.
+        """
+        if not self.pcm_file is None or not self.samples is None:
+            return True
+        try:
+            format = self.init_mixer()
+        except pygame.error as e:
+            self.log.error('no audio output for the alarm tone: {0}'.format(e))
+            return False
+        pcm_file = None
+        if not self.cache is None and not self.cache.directory is None:
+            pcm_file = self.cache.path(self.cache.key(self.file_name, 'pcm', format), '.pcm')
+            if os.path.exists(pcm_file):
+                self.pcm_file = pcm_file
+                return True
+        start = time.perf_counter()
+        try:
+            samples = pygame.mixer.Sound(self.file_name).get_raw()
+        except (pygame.error, OSError) as e:
+            self.log.error('decoding alarm tone {0} failed: {1}'.format(self.file_name, e))
+            return False
+        self.decode_time = time.perf_counter() - start
+        self.log.info('alarm tone {0} decoded in {1:.3f}s ({2} bytes)'.format(self.file_name, self.decode_time, len(samples)))
+        if pcm_file is None:
+            self.samples = samples
+            return True
+        self.cache.write(pcm_file, samples)
+        self.pcm_file = pcm_file
+        return True
+
+    def open(self):
+        """
+        Map the PCM file (or create the mixer sound from the samples kept in memory).
+        """
+        if not self.sound is None or not self.map is None:
+            return True
+        if not self.prepare():
+            return False
+        if self.samples is None:
+            try:
+                with open(self.pcm_file, 'rb') as f:
+                    self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError) as e:
+                self.log.error('mapping {0} failed: {1}'.format(self.pcm_file, e))
+                self.pcm_file = None
+                return False
+            frequency, size, channels = pygame.mixer.get_init()
+            frame = abs(size) // 8 * channels
+            self.chunk_size = max(1, int(frequency * self.chunk)) * frame
+        else:
+            self.sound = pygame.mixer.Sound(buffer=self.samples)
+        return True
+
+    def play(self, loops=-1):
+        """
+        Start the tone (repeated until stop() by default), returns False without audio.
+        """
+        self.load_time = time.time()
+        self.audio_time = None
+        if not self.open():
+            return False
+        self.stop()
+        if self.map is None:
+            self.channel = self.sound.play(loops=loops)
+        else:
+            self.offset = 0
+            self.loops = loops
+            self.channel = self.next_chunk().play()
+        if self.channel is None:
+            self.log.error('no free mixer channel for the alarm tone')
+            return False
+        if not self.map is None:
+            if not self.level is None:
+                self.channel.set_volume(self.level)
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self.feed, name='alarm-tone', daemon=True)
+            self.thread.start()
+        self.audio_time = time.time()
+        self.log.info('alarm tone after {0:.3f}s'.format(self.audio_time - self.load_time))
+        if not self.on_audio is None:
+            self.on_audio(self.audio_time - self.load_time)
+        return True
+
+    def next_chunk(self):
+        """
+        Create a mixer sound from the next slice of the mapping, None after the last loop.
+        """
+        if self.offset >= len(self.map):
+            if self.loops == 0:
+                return None
+            if self.loops > 0:
+                self.loops -= 1
+            self.offset = 0
+        end = min(self.offset + self.chunk_size, len(self.map))
+        with memoryview(self.map) as view, view[self.offset:end] as part:
+            sound = pygame.mixer.Sound(buffer=part)
+        self.offset = end
+        return sound
+
+    def feed(self):
+        """
+        Keep the next slice queued on the channel until the tone ends or stop() is called.
+        """
+        step = self.chunk / 4
+        while not self.stopped.wait(step):
+            with self.lock:
+                if self.stopped.is_set():
+                    break
+                if self.channel.get_queue() is None:
+                    sound = self.next_chunk()
+                    if sound is None:
+                        break
+                    self.channel.queue(sound)
+        self.log.debug('alarm tone queue finished at byte %s', self.offset)
+
+    def running(self):
+        return not self.thread is None and self.thread.is_alive()
+
+    def playing(self):
+        return not self.channel is None and (self.channel.get_busy() or self.running())
+
+    def volume(self, percent):
+        """
+        Set the tone volume relative to the mixer volume in percent.
+        """
+        self.level = max(0.0, min(1.0, percent / 100.0))
+        if not self.sound is None:
+            self.sound.set_volume(self.level)
+        elif not self.channel is None:
+            self.channel.set_volume(self.level)
+
+    def stop(self, timeout=1.0):
+        with self.lock:
+            self.stopped.set()
+        if not self.thread is None and not self.thread is threading.current_thread():
+            self.thread.join(timeout)
+        self.thread = None
+        if not self.channel is None:
+            self.channel.stop()
+            self.channel = None
+
+    def close(self):
+        """
+        Stop and release the sound and the mapping.
+        """
+        self.stop()
+        self.sound = None
+        if not self.map is None:
+            self.map.close()
+            self.map = None
+
+if __name__ == '__main__':
+    import argparse
+
+    from asset_cache import AssetCache
+
+    self = os.path.basename(sys.argv[0])
+    myName = os.path.splitext(self)[0]
+    log = logging.getLogger(myName)
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+    parser = argparse.ArgumentParser(description='alarm tone decode and start times')
+    parser.add_argument('-d', '--debug', action='store_true', help='debug execution')
+    parser.add_argument('--cache', default='~/.cache/alarmclock', help='cache directory')
+    parser.add_argument('-t', '--time', type=float, default=3.0, help='playback time in seconds')
+    parser.add_argument('file', help='MP3 or WAV file')
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.debug:
+        log.setLevel(logging.DEBUG)
+    else:
+        log.setLevel(logging.INFO)
+    start = time.perf_counter()
+    pygame.mixer.init(44100, -16, 2, 1024)
+    sound = pygame.mixer.Sound(args.file)
+    sound.play()
+    print('decode and play {0:8.3f} ms'.format((time.perf_counter() - start) * 1000))
+    pygame.mixer.stop()
+    tone = AlarmTone(args.file, AssetCache(args.cache, logger=log), logger=log)
+    tone.prepare()
+    start = time.perf_counter()
+    tone.play()
+    print('cached tone     {0:8.3f} ms'.format((time.perf_counter() - start) * 1000))
+    time.sleep(args.time)
+    tone.close()
+    pygame.mixer.quit()
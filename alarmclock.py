@@ -1,24 +1,37 @@
 #!/usr/bin/env python3
 
-import calendar
+import collections
 import copy
 import datetime
 import enum
+import heapq
 import logging
-import multiprocessing 
 import os
-import re
-import signal
-import subprocess
 import sys
+import threading
+import time
+
+# process start, before pygame and the clock modules are loaded (startup timing)
+STARTED = time.perf_counter()
 
 import pygame
 from pygame.locals import *
-import psutil
-import requests
 
+import metrics
+from alarm_tone import *
+from alarms import *
+from asset_cache import *
+from digit_atlas import *
 from iobroker import *
+from mixer import *
+from player import *
 from pygame_ui import *
+from splitflap import *
+from state_store import *
+from stream_health import *
+
+# posted by the alarm trigger thread after an alarm was fired
+ALARM_EVENT = USEREVENT + 3
 
 class ClockState(enum.Enum):
     RUN = 1
@@ -30,8 +43,21 @@ class AlarmClock(PygameUi):
     Alarmclock for Raspberry Pi 7" touch screen display
     """
 
-    def __init__(self, size=(800,480), config=None, iobroker=None, logger=None) :
-        PygameUi.__init__(self, size, logger)
+    def __init__(self, size=(800,480), config=None, iobroker=None, logger=None, time_source=None, backlight=None, mixer=None, player=None) :
+        # the time is shown as soon as the display is up, icons, ioBroker and audio are set up afterwards
+        # backlight, mixer and player are opened here unless they are passed in (e.g. fakes for simulations)
+        startup = metrics.Stopwatch('startup_seconds', start=STARTED)
+        startup.lap('imports')
+        if backlight is None:
+            PygameUi.__init__(self, size, logger, lazy=True)
+        else:
+            PygameUi.__init__(self, size, logger, backlight=backlight, lazy=True)
+        startup.lap('display')
+
+        # current local time, replaced by a simulated clock for benchmarks
+        if time_source is None:
+            time_source = datetime.datetime.now
+        self.time_source = time_source
 
         self.alarm_volume = [ 50, 90 ]
         self.alarm_length = [ 60, 300 ] # volume rise period, total alarm length in seconds
@@ -40,34 +66,154 @@ class AlarmClock(PygameUi):
 
         self.config_file_name = config
         self.config = self.read_config(config)
+        if 'backlight' in self.config and backlight is None:
+            self.backlight.close()
+            self.backlight = Backlight(self.config['backlight'], logger=self.log)
+        self.sunrise = self.config.get('sunrise', 360) # morning backlight fade duration in seconds
 
-        self.iobroker = None
-        if not iobroker is None:
-            (host, ip) = iobroker.split(':')
-            self.iobroker = IoBroker(host, int(ip), logger=self.log, get_objects=False)
+        # settings changed on the touch screen, e.g. "state": { "file": "alarmclock-state.json", "interval": 60 }
+        self.state_store = self.open_state_store(self.config.get('state', {}))
+        state = self.state_store.load()
+        if state.get('station') in self.config.get('streams', {}):
+            self.current_radio = state['station']
 
         self.rotated_display = True
         self.default_color = (255, 255, 255)
         self.night_color = (48, 48, 48)
         self.alarm_color = (192, 0, 0)
         self.bg_color = (0, 0, 0)
+
+        # pre-rendered digits and scaled icons, e.g. "cache": "~/.cache/alarmclock" (null to disable)
+        self.cache = AssetCache(self.config.get('cache', '~/.cache/alarmclock'), logger=self.log)
+        self.time_bg_color = (round(self.default_color[0] * 0.04), round(self.default_color[1] * 0.04), round(self.default_color[2] * 0.04))
+        self.digits = DigitAtlas(('font/gluqlo.ttf', round(self.h * 0.64)), self.time_bg_color, logger=self.log, cache=self.cache)
+        self.flipper = None
+        self.shown_time = None
+        self.show_time()
+        self.set_brightness(state.get('brightness', self.config['brightness']))
+        startup.lap('time')
+        self.digits.sheet(self.shown_time[1])
+        startup.lap('atlas')
+
+        self.load_assets()
+        startup.lap('assets')
+
+        # configured alarms and the daily 'clock' alarm set from ioBroker or the touch UI
+        self.alarms = AlarmScheduler(logger=self.log)
+        self.alarms.load(self.config.get('alarms', []), self.time_source())
+        self.current_alarm = None
+        self.next_alarm = self.alarms.label()
+        self.alarm_trigger = AlarmTrigger(self.alarms, self.fire_alarm, logger=self.log, clock=self.time_source)
+
+        self.iobroker = None
+        self.fetcher = None
+        self.alarm_subscription = None
+        self.alarm_id = self.config.get('alarm_id', '0_userdata.0.og1.sz.alarm')
+        if not iobroker is None:
+            (host, ip) = iobroker.split(':')
+            self.iobroker = IoBroker(host, int(ip), logger=self.log, get_objects=False, clock=lambda: self.time_source().timestamp())
+            self.fetcher = IoBrokerWorker(self.iobroker, logger=self.log, on_update=self.post_data_event)
+            self.alarm_subscription = IoBrokerSubscription(self.iobroker, [ self.alarm_id ], self.on_alarm_change, logger=self.log, stream=self.config.get('alarm_stream', False))
+            # temperatures are polled every minute from the cache, refreshed every 5 minutes
+            # and not shown if the sensor did not report for 20 minutes
+            for id in self.config.get('temperatures', []):
+                self.iobroker.cache.set_policy(id, ttl=300, max_age=1200)
+        # days without rule alarms from the ioBroker ical table, fetched every "interval" seconds
+        self.calendar = self.config.get('calendar')
+        self.calendar_digest = None
+        self.calendar_due = None
+
         self.ui_event = {}
         self.state = ClockState.RUN
 
         self.radio_streams = []
         self.play_start = None
+        self.wakeups = []
 
-        self.play_process = None
-        self.get_volume_cmd = 'amixer get \'PCM,0\''
-        self.set_volume_cmd = 'amixer set \'PCM,0\' {0}%'
-
-        self.time_font = pygame.font.Font('font/gluqlo.ttf', round(self.h * 0.64))
-
-        self.menu['bottom'].append({ 'name': 'station', 'label': self.config['current_stream'], 'pos': (0.08, 0.925), 'color': self.default_color, 'align':'lc' })
-        self.menu['bottom'].append({ 'name': 'alarm', 'label': self.next_alarm, 'pos': (0.925, 0.925), 'color': self.alarm_color, 'align':'rc' })
-        self.menu['edit'].append(self.menu['bottom'][-1])
+        self.playing = False
+        if not player is None:
+            self.player = player
+        elif self.system.startswith('arm') or 'player' in self.config:
+            self.player = Mpg123Player(self.config.get('player', 'mpg123'), logger=self.log, on_audio=self.on_audio)
+        else:
+            self.player = FakePlayer(logger=self.log, on_audio=self.on_audio)
+        # the alarm stream is opened paused "prewarm" seconds before the alarm (0 to disable),
+        # "alarm_fallback" (local file) is played if there is no audio "audio_deadline" seconds after the alarm
+        self.prewarm = self.config.get('prewarm', 30)
+        self.audio_deadline = self.config.get('audio_deadline', 8)
+        self.prewarmed = None
+        self.prewarm_wakeup = None
+        self.alarm_audio = None
+        # player, tone and playing/prewarmed/alarm state are changed by the main loop and the alarm trigger thread
+        self.audio_lock = threading.RLock()
+        self.audio_delays = collections.deque(maxlen=100)
+        # opt-in stream health checks, e.g. "probe": { "interval": 600, "workers": 4, "timeout": 10 }
+        self.prober = None
+        if 'probe' in self.config:
+            probe = self.config['probe']
+            self.prober = StreamProber(self.config['streams'], interval=probe.get('interval', 600), workers=probe.get('workers', 4), timeout=probe.get('timeout', 10), logger=self.log)
+        # local alarm sound through pygame.mixer, e.g. "alarm_tone": "sounds/bell.mp3",
+        # used as first fallback or always with "alarm_sound": "tone"
+        self.tone = None
+        if self.config.get('alarm_tone'):
+            self.tone = AlarmTone(self.config['alarm_tone'], cache=self.cache, logger=self.log, on_audio=self.on_audio)
+        if not mixer is None:
+            self.mixer = mixer
+        else:
+            self.mixer = open_mixer(self.config.get('mixer', 'PCM,0'), fake=not self.system.startswith('arm'), logger=self.log)
+        self.volume_ramp = None
+
+        # opt-in instrumentation, e.g. "metrics": { "port": 9105, "file": "/tmp/alarmclock-stats.json", "interval": 60 }
+        self.metrics_server = None
+        self.stats_writer = None
+
+        # optional split-flap transition at minute changes, e.g. "flip": { "fps": 20, "duration": 0.5 }
+        if self.config.get('flip'):
+            flip = self.config['flip']
+            self.flipper = SplitFlap(self.digits, fps=flip.get('fps', 20), duration=flip.get('duration', 0.5), logger=self.log)
+
+        self.add_menu_element('bottom', { 'name': 'station', 'label': self.current_radio, 'pos': (0.08, 0.925), 'color': self.default_color, 'align':'lc' })
+        self.add_menu_element('bottom', { 'name': 'alarm', 'label': self.next_alarm, 'pos': (0.925, 0.925), 'color': self.alarm_color, 'align':'rc' })
+        self.add_menu_element('edit', self.menu['bottom'][-1])
+        if not state.get('alarm') is None:
+            # a manually set alarm wins over the alarm from ioBroker
+            self.set_clock_alarm(state['alarm'])
+            self.manual_alarm = True
+        startup.lap('setup')
+        self.startup = startup
+        self.log.info('startup %s', startup.summary())
+
+    def show_time(self):
+        """
+        Show the current time, the first frame after a (re)start.
+        The digits are rendered with the font, the sprite sheet is built after the time is shown.
+        """
+        now = self.time_source()
+        color = self.default_color
+        if now.hour >= 22 or now.hour <= 6:
+            color = self.night_color
+        self.digits.direct = True
+        self.render_time(now.strftime('%-H:%M'), color)
+        self.digits.direct = False
+        self.update_display()
+
+    def open_state_store(self, config):
+        """
+        Open the state file, by default next to the config file.
+        """
+        file_name = config.get('file')
+        if file_name is None and not self.config_file_name is None:
+            file_name = os.path.splitext(self.config_file_name)[0] + '-state.json'
+        return StateStore(file_name, config.get('interval', 60), clock=lambda: self.time_source().timestamp(), logger=self.log)
 
-        self.set_brightness(self.config['brightness'])
+    def remember(self, key, value):
+        """
+        Store a changed setting, the main loop wakes up when the state file is due to be written.
+        """
+        self.state_store.set(key, value)
+        due = self.state_store.due()
+        if not due is None:
+            self.schedule_wakeup(datetime.datetime.fromtimestamp(due))
 
     def read_config(self, file_name):
         config = {}
@@ -89,68 +235,150 @@ class AlarmClock(PygameUi):
             json.dump(self.config, f)
 
     def set_volume(self, value):
-        if not self.system.startswith('arm'):
-            return
-        self.log.info('set_volume({0})'.format(value))
-        current_volume = self.get_volume()
-        if value == current_volume:
-            return
-        os.system(self.set_volume_cmd.format(value))
+        self.log.info('set_volume(%s)', value)
+        self.mixer.set_volume(value)
 
     def get_volume(self):
-        value = 0
-        if not self.system.startswith('arm'):
-            return value
-        with subprocess.Popen(self.get_volume_cmd, shell=True, stdout=subprocess.PIPE).stdout as f:
-            for line in f.readlines():
-                m = re.search('(\d+)%', line.decode('utf-8'))
-                if m:
-                    value = int(m.group(1))
-        return value
-
-    def render_time(self, time, color, menu=None):
-        """
-        Draw the current time in the center part.
-        """
-        self.log.info('render time {0}'.format(time))
-        c = (self.default_color[0] * 0.04, self.default_color[1] * 0.04, self.default_color[2] * 0.04)
-        self.screen.fill(c, (0.075 * self.w, 0.18 * self.h, 0.85 * self.w, 0.64 * self.h))
+        return self.mixer.get_volume()
+
+    def start_volume_ramp(self):
+        """
+        Raise the volume from alarm_volume[0] to alarm_volume[1] during the alarm rise period.
+        """
+        self.stop_volume_ramp()
+        self.volume_ramp = VolumeRamp(self.mixer, self.alarm_volume[0], self.alarm_volume[1], self.alarm_length[0], curve=self.config.get('alarm_curve', 'linear'), logger=self.log)
+        self.volume_ramp.start()
+
+    def stop_volume_ramp(self):
+        if not self.volume_ramp is None:
+            self.volume_ramp.stop()
+            self.volume_ramp = None
+
+    def set_clock_alarm(self, alarm):
+        """
+        Set the daily alarm time ('H:MM') or remove it ('-:--' or None).
+        """
+        if alarm is None or alarm == '-:--':
+            self.alarms.remove('clock')
+        else:
+            # set by hand or in ioBroker for the next morning, the calendar does not move it
+            self.alarms.add(Alarm('clock', alarm, 'daily', calendar_skip=False), self.time_source())
+        self.update_alarm_label()
+
+    def update_alarm_label(self):
+        """
+        Show the next alarm of the scheduler in the bottom row.
+        """
+        self.next_alarm = self.alarms.label()
+        self.set_menu_label('bottom', 'alarm', self.next_alarm)
+
+    def fire_alarm(self, fire_time, alarm, latency):
+        """
+        Start an alarm (called in the alarm trigger thread, independent of the main loop).
+        """
+        with self.audio_lock:
+            if self.state == ClockState.RUN and not self.playing:
+                self.current_alarm = alarm
+                self.log.info('alarm %s %s play %s', alarm.name, fire_time.strftime('%a %-H:%M'), self.current_radio)
+                self.start_volume_ramp()
+                self.set_brightness(50)
+                source = 'stream'
+                if self.config.get('alarm_sound') == 'tone' and not self.tone is None:
+                    source = 'tone'
+                self.alarm_audio = { 'alarm': alarm.name, 'source': source, 'start': time.time(), 'deadline': self.time_source() + datetime.timedelta(seconds=self.audio_deadline), 'fallback': False }
+                if source == 'tone' and not self.play_tone():
+                    self.log.error('alarm tone failed, alarm {0} plays {1}'.format(alarm.name, self.current_radio))
+                    self.alarm_audio['source'] = 'stream'
+                    source = 'stream'
+                if source == 'stream':
+                    self.play()
+                self.play_start = self.time_source()
+                self.state = ClockState.ALARM
+            else:
+                self.log.info('alarm %s ignored in state %s', alarm.name, self.state)
+            pygame.event.post(pygame.event.Event(ALARM_EVENT, alarm=alarm.name))
+
+    def schedule_wakeup(self, when):
+        """
+        Wake up the main loop at the given time (in addition to the minute boundaries).
+        """
+        heapq.heappush(self.wakeups, when)
+
+    def next_wakeup(self, now):
+        """
+        Get the time of the next main loop iteration: the next scheduled job or the next minute boundary.
+        """
+        while len(self.wakeups) > 0 and self.wakeups[0] <= now:
+            heapq.heappop(self.wakeups)
+        result = now.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        if len(self.wakeups) > 0 and self.wakeups[0] < result:
+            result = self.wakeups[0]
+        return result
+
+    def flip_time(self, time, color):
+        """
+        Animate the change from the shown time to time with the split-flap renderer.
+        """
+        (shown, shown_color) = self.shown_time
+        cards = []
+        for (old, new, center) in zip(shown.split(':'), time.split(':'), [ 0.075 + 0.2, 0.925 - 0.2 ]):
+            if old == new:
+                continue
+            if not old in self.digits.rects or not new in self.digits.rects:
+                return
+            s_old = self.digits.size(old)
+            s_new = self.digits.size(new)
+            cards.append((round(center * self.w - s_old[0] / 2), round(center * self.w - s_new[0] / 2), round(0.5 * self.h - s_new[1] / 2), old, new))
+        overlay = [
+            (self.bg_color, pygame.Rect(0.075 * self.w, 0.495 * self.h, 0.85 * self.w, 0.01 * self.h)),
+            (self.bg_color, pygame.Rect(0.49 * self.w, 0.18 * self.h, 0.02 * self.w, 0.64 * self.h)),
+        ]
+        def update(rect):
+            self.mark_dirty(rect)
+            self.update_display()
+        self.flipper.animate(self.screen, cards, color, update, overlay)
+
+    @metrics.registry.timed('render_seconds', region='time')
+    def render_time(self, time, color, menu=None, animate=False):
+        """
+        Draw the current time in the center part, with a split-flap transition from the
+        previously shown time if animate is set (and enabled in the config).
+        """
+        self.log.info('render time %s', time)
+        color = tuple([ int(c) for c in color ])
+        if animate and menu is None and not self.flipper is None and not self.shown_time is None and self.shown_time[1] == color:
+            self.flip_time(time, color)
+        self.shown_time = (time, color)
+        rect = self.screen.fill(self.time_bg_color, (0.075 * self.w, 0.18 * self.h, 0.85 * self.w, 0.64 * self.h))
         [ hh, mm ] = time.split(':')
-        s = self.time_font.size(hh)
+        s = self.digits.size(hh)
         x = round((0.075 + 0.2) * self.w - s[0] / 2)
         y = round(0.5 * self.h - s[1] / 2)
         if not menu is None:
-            i = self.get_menu_element_index(menu, 'hour+')
-            if not i is None:
-                self.menu[menu][i]['rect'] = pygame.Rect(x, y, s[0], s[1] / 2)
-            i = self.get_menu_element_index(menu, 'hour-')
-            if not i is None:
-                self.menu[menu][i]['rect'] = pygame.Rect(x, y + s[1] / 2, s[0], s[1] / 2)
-            self.log.debug('hh p={0},{1},{2}'.format(x, y, s))
-        surface = self.time_font.render(hh, True, color)
-        self.screen.blit(surface, (x, y))
-        s = self.time_font.size(mm)
+            self.set_menu_rect(menu, 'hour+', (x, y, s[0], s[1] / 2))
+            self.set_menu_rect(menu, 'hour-', (x, y + s[1] / 2, s[0], s[1] / 2))
+            self.log.debug('hh p=%s,%s,%s', x, y, s)
+        self.digits.render(self.screen, hh, (x, y), color)
+        s = self.digits.size(mm)
         x = round((0.925 - 0.2) * self.w - s[0] / 2)
         y = round(0.5 * self.h - s[1] / 2)
         if not menu is None:
-            i = self.get_menu_element_index(menu, 'min+')
-            if not i is None:
-                self.menu[menu][i]['rect'] = pygame.Rect(x, y, s[0], s[1] / 2)
-            i = self.get_menu_element_index(menu, 'min-')
-            if not i is None:
-                self.menu[menu][i]['rect'] = pygame.Rect(x, y + s[1] / 2, s[0], s[1] / 2)
-            self.log.debug('mm p={0},{1},{2}'.format(x, y, s))
-        surface = self.time_font.render(mm, True, color)
-        self.screen.blit(surface, (x, y))
+            self.set_menu_rect(menu, 'min+', (x, y, s[0], s[1] / 2))
+            self.set_menu_rect(menu, 'min-', (x, y + s[1] / 2, s[0], s[1] / 2))
+            self.log.debug('mm p=%s,%s,%s', x, y, s)
+        self.digits.render(self.screen, mm, (x, y), color)
         self.screen.fill(self.bg_color, rect=(0.075 * self.w, 0.495 * self.h, 0.85 * self.w, 0.01 * self.h))
         self.screen.fill(self.bg_color, rect=(0.49 * self.w, 0.18 * self.h, 0.02 * self.w, 0.64 * self.h))
+        return self.mark_dirty(rect)
 
+    @metrics.registry.timed('render_seconds', region='temp')
     def render_temp(self, temp1, temp2, color):
         """
         Draw the current temperatures in top corners.
         """
-        self.log.info('render temp {} {}'.format(temp1, temp2))
+        self.log.info('render temp %s %s', temp1, temp2)
         y = round(0.1 * self.h)
+        rects = []
         if not temp1 is None:
             t1 = '-'
             try:
@@ -158,7 +386,7 @@ class AlarmClock(PygameUi):
             except:
                 pass
             s = self.text_font.size(t1)
-            self.screen.fill(self.bg_color, rect=(0, y - s[1] / 2, 0.175 * self.w, s[1]))
+            rects.append(self.screen.fill(self.bg_color, rect=(0, y - s[1] / 2, 0.175 * self.w, s[1])))
             self.render_text(0.025 * self.w, y, t1, color=color, align='lc')
         if not temp2 is None:
             t2 = '-'
@@ -167,103 +395,305 @@ class AlarmClock(PygameUi):
             except:
                 pass
             s = self.text_font.size(t2)
-            self.screen.fill(self.bg_color, rect=(0.825 * self.w, y - s[1] / 2, 0.175 * self.w, s[1]))
+            rects.append(self.screen.fill(self.bg_color, rect=(0.825 * self.w, y - s[1] / 2, 0.175 * self.w, s[1])))
             self.render_text(0.975 * self.w, y, t2, color=color, align='rc')
+        for rect in rects:
+            self.mark_dirty(rect)
+        return rects
 
     def get_temp(self, ids):
         """
         Get temperatures from ioBroker datapoints.
         """
         result = []
+        temps = self.iobroker.get_cached_values(ids)
         for id in ids:
             result.append('-')
-            try:
-                temp = self.iobroker.get_bulk_value(id, with_age=True)
-                if temp[0]['age'] < 1200:
-                    result[-1] = temp[0]['val']
-            except:
-                pass
+            if id in temps:
+                result[-1] = temps[id]['val']
         return result
 
     def render_alarm(self, alarm, color, menu=None):
         """
         Draw next alarm time in the bottom row below the time.
         """
-        self.log.info('render alarm {0}'.format(alarm))
-        self.render_time(alarm, color, menu)
+        self.log.info('render alarm %s', alarm)
+        return self.render_time(alarm, color, menu)
 
     def update_alarms(self, id='0_userdata.0.og1.sz.alarm'):
         """
         Update alarms from iobroker entry.
         """
-        alarm = self.iobroker.get_value(id)
+        alarm = self.iobroker.get_cached_values([ id ], with_age=False, stale_ok=False).get(id, {}).get('val')
+        return self.parse_alarm(id, alarm)
+
+    def parse_alarm(self, id, alarm):
+        """
+        Convert an iobroker alarm value ('07:00', 'active' or empty) to the displayed alarm time.
+        """
         if alarm and not alarm == 'active':
             if alarm[0] == '0':
                 alarm = alarm[1:]
-            log.info('new alarm from {} {}'.format(id, alarm))
+            self.log.info('new alarm from %s %s', id, alarm)
         else:
             alarm = '-:--'
         return alarm
 
+    def post_data_event(self, name):
+        """
+        Wake up the main loop after the ioBroker worker published new data.
+        """
+        pygame.event.post(pygame.event.Event(DATA_EVENT, name=name))
+
+    def on_alarm_change(self, id, value):
+        """
+        Subscription callback for the alarm datapoint (runs in the subscription thread).
+        """
+        self.fetcher.publish('alarm', self.parse_alarm(id, value.get('val')))
+
+    def skip_day(self, day):
+        """
+        Get the calendar event (holiday, vacation) which skips the rule alarms of a day or None.
+        Called by the alarm scheduler, also in the alarm trigger thread.
+        """
+        return self.iobroker.calendar.match(day, self.calendar.get('skip', []))
+
+    def check_calendar(self, now):
+        """
+        Fetch the calendar table if it is due.
+        """
+        if self.calendar is None or self.iobroker is None:
+            return
+        if not self.calendar_due is None and now < self.calendar_due:
+            return
+        self.calendar_due = now + datetime.timedelta(seconds=self.calendar.get('interval', 3600))
+        self.fetch('calendar', self.iobroker.update_calendar, self.calendar.get('id', 'ical.0.data.table'))
+
+    def fetch(self, name, func, *args):
+        """
+        Let the ioBroker worker fetch data in the background.
+        """
+        if self.fetcher is None:
+            return
+        self.fetcher.request(name, func, *args)
+
     def play(self):
         """
         Play current radio station.
         """
+        with self.audio_lock:
+            self.playing = True
+            self.prewarmed = None
+            self.player.load(self.stream_url(self.current_radio))
+
+    def stream_url(self, station):
+        """
+        Get the URL of a station, the fastest working mirror if the streams are probed.
+        """
+        if not self.prober is None:
+            return self.prober.url(station)
+        return stream_urls(self.config['streams'][station])[0]
 
-        if not self.system.startswith('arm'):
+    def next_station(self, station):
+        """
+        Get the station after the given one, skipping stations found dead by the prober.
+        """
+        stations = sorted(self.config['streams'].keys())
+        i = stations.index(station)
+        for n in range(1, len(stations) + 1):
+            candidate = stations[(i + n) % len(stations)]
+            if self.prober is None or self.prober.healthy(candidate):
+                return candidate
+            self.log.info('station %s skipped, stream not available', candidate)
+        return stations[(i + 1) % len(stations)]
+
+    def choose_alarm_station(self):
+        """
+        Switch to the fastest working station if the current station is dead before an alarm.
+        """
+        if self.prober is None or self.prober.healthy(self.current_radio):
+            return
+        station = self.prober.fastest()
+        if station is None:
+            self.log.warning('no working stream for the alarm')
             return
-        cmd = 'mpg123 {0}'.format(self.config['streams'][self.current_radio])
-        proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE) 
-        with proc.stdout as f:
-            while True:
-                line = f.readline()
-                if not line:
-                    break
-                self.log.info(line)
+        self.log.warning('station {0} not available, alarm plays {1}'.format(self.current_radio, station))
+        self.current_radio = station
+        self.set_menu_label('bottom', 'station', self.current_radio)
+
+    def play_tone(self):
+        """
+        Play the local alarm tone instead of the radio, returns False if the tone could not be started
+        (the player keeps running then).
+        """
+        with self.audio_lock:
+            if not self.tone.play():
+                return False
+            self.playing = True
+            self.prewarmed = None
+            self.player.stop()
+            return True
+
+    def check_prewarm(self, now):
+        """
+        Open the alarm stream paused shortly before the next alarm, so the connection
+        is up and audio is buffered when the alarm fires.
+        """
+        with self.audio_lock:
+            if self.prewarm <= 0 or self.playing:
+                return
+            t = self.alarms.peek()[0]
+            # at the alarm time the scheduler already shows the next alarm while the trigger
+            # thread starts the prewarmed stream, it is only dropped if the alarm was changed
+            # or removed before it was due or if it did not fire (ignored or missed)
+            if not self.prewarmed is None and t != self.prewarmed and (now < self.prewarmed or now >= self.prewarmed + datetime.timedelta(seconds=self.audio_deadline)):
+                self.log.info('prewarmed stream for %s not needed', self.prewarmed)
+                self.player.stop()
+                self.prewarmed = None
+            if t is None or t == self.prewarmed or self.state != ClockState.RUN:
+                return
+            start = t - datetime.timedelta(seconds=self.prewarm)
+            if now < start:
+                if start != self.prewarm_wakeup:
+                    self.schedule_wakeup(start)
+                    self.prewarm_wakeup = start
+                return
+            if now >= t:
+                return
+            if not self.tone is None:
+                # decoded (or mapped from the cache) before it is needed
+                self.tone.open()
+                if self.config.get('alarm_sound') == 'tone':
+                    self.prewarmed = t
+                    return
+            self.choose_alarm_station()
+            self.log.info('prewarm %s for alarm at %s', self.current_radio, t.strftime('%-H:%M'))
+            if self.player.preload(self.stream_url(self.current_radio)):
+                self.prewarmed = t
+
+    def on_audio(self, player_delay):
+        """
+        Player callback for the first audio after a load (may run in the player thread),
+        player_delay are the seconds since the player was started.
+        """
+        pending = self.alarm_audio
+        if pending is None:
+            return
+        self.alarm_audio = None
+        # the alarm delay also includes choosing the station and starting the player
+        delay = time.time() - pending['start']
+        self.log.info('alarm %s audio (%s) after %.2fs, %.2fs in the player', pending['alarm'], pending['source'], delay, player_delay)
+        metrics.registry.observe('alarm_audio_seconds', delay, source=pending['source'])
+        self.audio_delays.append({ 'alarm': pending['alarm'], 'source': pending['source'], 'delay': delay, 'player_delay': player_delay })
+
+    def check_audio(self, now):
+        """
+        Play the local alarm tone (or the alarm_fallback file) if the alarm sound did not start before the deadline.
+        """
+        with self.audio_lock:
+            pending = self.alarm_audio
+            if pending is None or pending['fallback'] or now < pending['deadline']:
+                return
+            if self.state != ClockState.ALARM:
+                self.alarm_audio = None
+                return
+            metrics.registry.inc('alarm_audio_failures_total')
+            pending['fallback'] = True
+            fallback = self.config.get('alarm_fallback')
+            if not self.tone is None and pending['source'] != 'tone':
+                self.log.warning('no audio {0}s after alarm {1}, playing the alarm tone'.format(self.audio_deadline, pending['alarm']))
+                pending['source'] = 'tone'
+                if self.play_tone():
+                    return
+                self.log.error('alarm tone for alarm {0} failed'.format(pending['alarm']))
+            if not fallback is None:
+                self.log.warning('no audio {0}s after alarm {1}, playing {2}'.format(self.audio_deadline, pending['alarm'], fallback))
+                pending['source'] = 'fallback'
+                if not self.tone is None:
+                    self.tone.stop()
+                self.player.load(fallback)
+            else:
+                self.log.error('no audio {0}s after alarm {1} and no fallback'.format(self.audio_deadline, pending['alarm']))
+                self.alarm_audio = None
 
     def stop(self):
         """
         Stop current playback.
         """
-
-        if not self.system.startswith('arm'):
-            return
-        mpg123_process = None
-        for proc in psutil.process_iter(['pid', 'name']):
-            if not 'mpg123' in proc.info['name']:
-                continue
-            mpg123_process = proc
-        if not mpg123_process is None:
-            self.log.info('playback process PID {0}'.format(mpg123_process.info['pid']))
-            mpg123_process.terminate()
+        with self.audio_lock:
+            self.playing = False
+            self.alarm_audio = None
+            self.stop_volume_ramp()
+            self.player.stop()
+            if not self.tone is None:
+                self.tone.stop()
+
+    def start_workers(self):
+        """
+        Start the ioBroker worker, the alarm subscription and the alarm trigger thread.
+        """
+        if not self.fetcher is None:
+            self.fetcher.start()
+            # alarm changes are pushed (or polled adaptively) by the subscription
+            self.alarm_subscription.start()
+        self.alarm_trigger.start()
+        if not self.prober is None:
+            self.prober.start()
+        config = self.config.get('metrics', {})
+        if 'port' in config:
+            try:
+                self.metrics_server = metrics.MetricsServer(config['port'], config.get('host', '127.0.0.1'), logger=self.log).start()
+            except OSError as e:
+                self.log.error('metrics endpoint on port {0} failed: {1}'.format(config['port'], e))
+        if 'file' in config:
+            self.stats_writer = metrics.StatsWriter(config['file'], config.get('interval', 60), logger=self.log)
+            self.stats_writer.start()
+
+    def stop_workers(self):
+        self.alarm_trigger.stop()
+        if not self.prober is None:
+            self.prober.stop()
+        if not self.fetcher is None:
+            self.alarm_subscription.stop()
+            self.fetcher.stop()
+        if not self.metrics_server is None:
+            self.metrics_server.stop()
+        if not self.stats_writer is None:
+            self.stats_writer.stop()
+            self.stats_writer.join()
+        self.state_store.close()
 
     def run(self):
 
         last_date = None
         last_time = None
         last_alarm = None
-        self.next_alarm = self.update_alarms()
         self.edit_alarm = None
         last_state = None
         last_radio = None
         last_menu = None
         last_temp = [ None, None ]
-        [ temp1, temp2 ] = self.get_temp(self.config['temperatures'])
+        [ temp1, temp2 ] = [ None, None ]
+        fetch_seq = {}
+        self.start_workers()
+        self.fetch('temperatures', self.get_temp, self.config['temperatures'])
+        self.check_calendar(self.time_source())
         current_menu = 'bottom'
-        keep_running = True
-        tick = 0
+        self.keep_running = True
+        last_minute = self.time_source().replace(second=0, microsecond=0)
+        events = []
 
-        while keep_running:
+        while self.keep_running:
 
-            now = datetime.datetime.now()
+            loop_start = time.perf_counter()
+            now = self.time_source()
             current_day = now.strftime('%a')
             is_weekend = current_day in ['Sa', 'So']
             current_time = now.strftime('%-H:%M')
-            if tick == 2:
-                if now.hour >= 6 and now.hour <= 23 and (now.minute == 23 or now.minute == 53):
-                    if not self.manual_alarm:
-                        self.next_alarm = self.update_alarms()
-                self.menu['bottom'][-1]['label'] = self.next_alarm
+            current_minute = now.replace(second=0, microsecond=0)
+            if current_minute != last_minute:
+                last_minute = current_minute
+                self.update_alarm_label()
                 if now.hour == 22 and now.minute == 13:
                     # turn dark at night
                     self.set_brightness(10)
@@ -272,63 +702,82 @@ class AlarmClock(PygameUi):
                 # turn bright for the day
                 elif ((is_weekend and now.hour == 7) or (not is_weekend and now.hour == 6)) and now.minute == 59:
                     self.set_brightness(15)
+                    self.set_brightness(50, self.sunrise)
                     self.render_bottom(current_menu)
                     last_date = None
-                elif (is_weekend and now.hour == 8) or (not is_weekend and now.hour == 7):
-                    if now.minute <= 5:
-                        self.set_brightness(20 + now.minute * 6)
-                        self.render_bottom(current_menu)
-                        last_date = None
-                if (now.minute % 5) == 0:
-                    [ temp1, temp2 ] = self.get_temp(self.config['temperatures'])
+                self.fetch('temperatures', self.get_temp, self.config['temperatures'])
+                self.check_calendar(now)
+
+            #
+            # results from the ioBroker worker
+            #
+            if not self.fetcher is None:
+                snapshot = self.fetcher.snapshot
+                for name in snapshot:
+                    if fetch_seq.get(name) == snapshot[name][0]:
+                        continue
+                    if name == 'alarm' and (self.manual_alarm or self.state == ClockState.EDIT):
+                        # kept until it can be applied (after editing or when the manual alarm is cleared)
+                        continue
+                    fetch_seq[name] = snapshot[name][0]
+                    if name == 'temperatures':
+                        [ temp1, temp2 ] = snapshot[name][1]
+                    elif name == 'alarm':
+                        self.set_clock_alarm(snapshot[name][1])
+                    elif name == 'calendar' and snapshot[name][1] != self.calendar_digest:
+                        # the table changed, holidays and vacations may move the next alarm
+                        self.calendar_digest = snapshot[name][1]
+                        self.alarms.set_skip_day(self.skip_day, now)
+                        self.update_alarm_label()
+                        self.log.info('calendar updated, next alarm %s', self.next_alarm)
 
             #
             # state handling
             #
-            if self.state == ClockState.RUN and self.play_process is None and self.next_alarm == current_time:
-                self.log.info('alarm {0} {1} play {2}'.format(current_day, current_time, self.current_radio))
-                self.set_volume(self.alarm_volume[0])
-                self.set_brightness(50)
-                self.play_process = multiprocessing.Process(target=self.play)
-                self.play_start = now
-                if self.system.startswith('arm'):
-                    self.play_process.start()
-                self.state = ClockState.ALARM
-                last_time = None
-            if self.state == ClockState.ALARM:
-                alarm_duration = now - self.play_start
-                if alarm_duration > datetime.timedelta(seconds=self.alarm_length[1]):
-                    self.log.info('alarm stop {0}'.format(current_time))
-                    self.stop()
-                    self.play_process = None
-                    self.play_start = None
-                    self.state = ClockState.RUN
-                    last_time = None
-                elif alarm_duration < datetime.timedelta(seconds=self.alarm_length[0]):
-                    volume = self.alarm_volume[0] + (self.alarm_volume[1] - self.alarm_volume[0]) * alarm_duration.total_seconds() / self.alarm_length[0]
-                    self.set_volume(volume)
-
-            for event in pygame.event.get():
+            with self.audio_lock:
+                if self.state == ClockState.ALARM and not self.play_start is None:
+                    alarm_duration = now - self.play_start
+                    if alarm_duration > datetime.timedelta(seconds=self.alarm_length[1]):
+                        self.log.info('alarm stop %s', current_time)
+                        self.stop()
+                        self.play_start = None
+                        self.state = ClockState.RUN
+                        last_time = None
+
+            for event in events:
                 # exit on any key press on non ARM systems (development mode)
                 if not self.system.startswith('arm') and event.type == pygame.KEYDOWN:
-                    keep_running = False
-                if not event.type is MOUSEBUTTONUP:
+                    self.keep_running = False
+                # SIGTERM/SIGINT, the settings are written before exit
+                if event.type == QUIT:
+                    self.keep_running = False
+                if event.type == ALARM_EVENT:
+                    # alarm fired by the trigger thread
+                    self.update_alarm_label()
+                    if self.state == ClockState.ALARM:
+                        self.schedule_wakeup(self.play_start + datetime.timedelta(seconds=self.alarm_length[1]))
+                        pending = self.alarm_audio
+                        if not pending is None:
+                            self.schedule_wakeup(pending['deadline'])
+                        last_time = None
                     continue
-                pos = pygame.mouse.get_pos()
+                if event.type != MOUSEBUTTONUP:
+                    continue
+                pos = event.pos
                 if self.rotated_display:
                     # 180 degrees rotated display
                     pos = (self.w - pos[0], self.h - pos[1])
                 elem = self.get_ui_action(pos, [ current_menu ])
                 if not elem is None:
-                    self.log.info('event {0} pos {1} elem {2}'.format(event.type, pos, elem))
+                    self.log.info('event %s pos %s elem %s', event.type, pos, elem)
                     if elem['name'] == 'alarm':
                         if self.state == ClockState.EDIT:
                             self.state = ClockState.RUN
                             current_menu = 'bottom'
                             last_menu = None
-                            self.next_alarm = self.edit_alarm
-                            self.menu['bottom'][-1]['label'] = self.next_alarm
+                            self.set_clock_alarm(self.edit_alarm)
                             self.manual_alarm = True
+                            self.remember('alarm', self.edit_alarm)
                             last_time = None
                             last_alarm = None
                         elif self.state == ClockState.RUN:
@@ -342,43 +791,52 @@ class AlarmClock(PygameUi):
                         elif self.state == ClockState.ALARM:
                             self.state = ClockState.RUN
                             last_time = None
-                        self.log.info('state {0}'.format(self.state))
+                        self.log.info('state %s', self.state)
                     elif elem['name'] == 'cancel':
                         if self.state == ClockState.EDIT:
                             self.state = ClockState.RUN
-                            self.next_alarm = '-:--'
-                            self.menu['bottom'][-1]['label'] = self.next_alarm
+                            self.set_clock_alarm(None)
                             last_alarm = None
                             last_time = None
                             current_menu = 'bottom'
                             self.manual_alarm = False
+                            self.remember('alarm', None)
+                            # the ioBroker alarm applies again
+                            fetch_seq.pop('alarm', None)
                     elif elem['label'] == 'play':
-                        if self.play_process == None:
+                        if not self.playing:
                             if self.state == ClockState.RUN:
-                                self.log.info('play {0}'.format(self.current_radio))
-                                self.play_process = multiprocessing.Process(target=self.play)
+                                self.log.info('play %s', self.current_radio)
+                                self.play()
                                 self.play_start = now
-                                self.play_process.start()
                         else:
-                            self.log.info('stop {0}'.format(self.current_radio))
-                            self.stop()
-                            self.play_process = None
-                            self.play_start = None
-                            if self.state == ClockState.ALARM:
-                                self.state = ClockState.RUN
+                            self.log.info('stop %s', self.current_radio)
+                            with self.audio_lock:
+                                self.stop()
+                                self.play_start = None
+                                stopped_alarm = self.state == ClockState.ALARM
+                                if stopped_alarm:
+                                    self.state = ClockState.RUN
+                            if stopped_alarm:
                                 self.manual_alarm = False
-                                self.next_alarm = '-:--'
+                                self.remember('alarm', None)
+                                fetch_seq.pop('alarm', None)
+                                if not self.current_alarm is None and self.current_alarm.name == 'clock':
+                                    self.set_clock_alarm(None)
                                 last_alarm = None
                                 last_time = None
                                 last_menu = None
                         last_radio = None
                     elif elem['label'] == 'radio':
                         if self.state == ClockState.RUN:
-                            stations = sorted(self.config['streams'].keys())
-                            i = stations.index(self.current_radio)
-                            i = (i + 1) % len(stations)
-                            self.current_radio = stations[i]
-                            self.log.info('new station {0}'.format(self.current_radio))
+                            self.current_radio = self.next_station(self.current_radio)
+                            self.log.info('new station %s', self.current_radio)
+                            self.set_menu_label('bottom', 'station', self.current_radio)
+                            self.remember('station', self.current_radio)
+                            last_menu = None
+                            if self.playing:
+                                # the player switches streams without restarting
+                                self.play()
                             last_radio = None
                     elif not elem['label'] is None:
                         if self.state == ClockState.EDIT:
@@ -396,7 +854,7 @@ class AlarmClock(PygameUi):
                                 else:
                                     mm = (mm - 1) % 60
                             self.edit_alarm = '{0}:{1:02d}'.format(hh, mm)
-                            self.log.info('edit_alarm {}'.format(self.edit_alarm))
+                            self.log.info('edit_alarm %s', self.edit_alarm)
                             last_alarm = None
                         else:
                             brightness = self.get_brightness()
@@ -404,18 +862,23 @@ class AlarmClock(PygameUi):
                             if elem['label'] == 'bright-' and brightness >= 20:
                                 brightness -= 10
                                 self.set_brightness(brightness)
+                                self.remember('brightness', brightness)
                             elif elem['label'] == 'bright+' and brightness <= 245:
                                 brightness += 10
                                 self.set_brightness(brightness)
+                                self.remember('brightness', brightness)
                             elif elem['label'] == 'vol-' and volume > 10:
-                                volume -= 10
+                                # the ramp may have written a step since the volume was read
+                                self.stop_volume_ramp()
+                                volume = self.get_volume() - 10
                                 self.set_volume(volume)
                             elif elem['label'] == 'vol+' and volume <= 150:
-                                volume += 10
+                                self.stop_volume_ramp()
+                                volume = self.get_volume() + 10
                                 self.set_volume(volume)
 
             if self.state != last_state:
-                self.log.info('state {} menu {}'.format(self.state, current_menu))
+                self.log.info('state %s menu %s', self.state, current_menu)
                 self.last_radio = None
             do_update = False
 
@@ -450,13 +913,13 @@ class AlarmClock(PygameUi):
                         c = (self.night_color[0], self.night_color[1], self.night_color[2])
                     if self.state == ClockState.ALARM:
                         c = (self.alarm_color[0], self.alarm_color[1], self.alarm_color[2])
-                    self.render_time(current_time, c)
+                    self.render_time(current_time, c, animate=not last_time is None)
                     do_update = True
                     last_time = current_time
 
                 if self.current_radio != last_radio:
                     c = (self.default_color[0], self.default_color[1], self.default_color[2])
-                    if self.play_process != None:
+                    if self.playing:
                         c = (0, self.default_color[1], self.default_color[2])
                     if self.state == ClockState.ALARM:
                         c = (self.alarm_color[0], self.alarm_color[1], self.alarm_color[2])
@@ -471,13 +934,24 @@ class AlarmClock(PygameUi):
                 self.render_bottom(current_menu)
                 last_menu = current_menu
 
-            if do_update:
-                pygame.display.update()
+            if do_update or len(self.dirty) > 0:
+                self.update_display()
 
             last_state = self.state
-            
-            self.clock.tick(1)
-            tick = (tick + 1) % 60
+            self.state_store.flush()
+            self.check_audio(self.time_source())
+            self.check_prewarm(self.time_source())
+
+            metrics.registry.observe('loop_seconds', time.perf_counter() - loop_start)
+
+            # sleep until the next minute, the next scheduled job or user input
+            if self.keep_running:
+                events = self.wait_events(self.next_wakeup(now) - self.time_source())
+
+        self.stop_workers()
+        self.player.quit()
+        if not self.tone is None:
+            self.tone.close()
     
 if __name__ == '__main__' :
     import argparse
@@ -491,9 +965,12 @@ if __name__ == '__main__' :
 
     parser = argparse.ArgumentParser(description='Raspberry Pi alarm clock')
     parser.add_argument('-c', '--config', default='alarmclock.json', help='config file')
-    parser.add_argument('-d', '--debug', action='store_false', help='debug execution')
+    parser.add_argument('-d', '--debug', action='store_true', help='debug execution')
     parser.add_argument('--iobroker', default='192.168.137.85:8082', help='iobroker IP address and port')
     parser.add_argument('-L', '--locale', default='de_DE.UTF-8', help='locale')
+    parser.add_argument('--log-file', default=None, help='buffer log records in memory and append them to this file')
+    parser.add_argument('--log-interval', type=float, default=300.0, help='seconds between log file writes (errors are written at once)')
+    parser.add_argument('--log-buffer', type=int, default=5000, help='log records kept in memory')
     parser.add_argument('-r', '--rotated', action='store_false', help='non rotated display (for debugging)')
     args = parser.parse_args(sys.argv[1:])
 
@@ -501,9 +978,18 @@ if __name__ == '__main__' :
         log.setLevel(logging.DEBUG)
     else:
         log.setLevel(logging.INFO)
+    async_logging = None
+    if not args.log_file is None:
+        from logbuffer import AsyncLogging
+        async_logging = AsyncLogging(args.log_file, capacity=args.log_buffer, interval=args.log_interval, console=args.debug).start()
     locale.setlocale(locale.LC_ALL, args.locale)
+    import calendar
     calendar.setfirstweekday(calendar.MONDAY)
  
     ui = AlarmClock(config=args.config, iobroker=args.iobroker, logger=log)
     ui.rotated_display = args.rotated
-    ui.run()
+    try:
+        ui.run()
+    finally:
+        if not async_logging is None:
+            async_logging.stop()
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import collections
+import datetime
+import heapq
+import logging
+import os
+import sys
+import threading
+import time
+
+WEEKDAYS = [ 'mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun' ]
+DAY_RULES = {
+    'daily': [ 0, 1, 2, 3, 4, 5, 6 ],
+    'weekdays': [ 0, 1, 2, 3, 4 ],
+    'weekend': [ 5, 6 ],
+}
+
+def parse_time(value):
+    """
+    Parse 'H:MM' into a datetime.time.
+    """
+    [ hh, mm ] = value.split(':')
+    return datetime.time(int(hh), int(mm))
+
+def parse_date(value):
+    return datetime.date.fromisoformat(value)
+
+class Alarm:
+    """
+    Alarm with a recurrence rule:
+    days      - 'daily', 'weekdays', 'weekend' or list of weekdays (0 = Monday or 'mon'...'sun')
+    dates     - additional single dates
+    skip      - dates without alarm
+    overrides - one-off alarm time per date (also on days without the rule)
+    calendar_skip - rule days can be skipped by the calendar of the scheduler (holidays, vacations)
+    """
+
+    def __init__(self, name, time, days=None, dates=None, skip=None, overrides=None, enabled=True, calendar_skip=True):
+        self.name = name
+        if isinstance(time, str):
+            time = parse_time(time)
+        self.time = time
+        if isinstance(days, str):
+            days = DAY_RULES[days]
+        self.days = set()
+        for day in days or []:
+            if isinstance(day, str):
+                day = WEEKDAYS.index(day.lower()[:3])
+            self.days.add(day)
+        self.dates = set([ parse_date(d) if isinstance(d, str) else d for d in dates or [] ])
+        self.skip = set([ parse_date(d) if isinstance(d, str) else d for d in skip or [] ])
+        self.overrides = {}
+        for (day, t) in (overrides or {}).items():
+            if isinstance(day, str):
+                day = parse_date(day)
+            if isinstance(t, str):
+                t = parse_time(t)
+            self.overrides[day] = t
+        self.enabled = enabled
+        self.calendar_skip = calendar_skip
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['name'], config['time'], config.get('days'), config.get('dates'), config.get('skip'), config.get('override'), config.get('enabled', True), config.get('calendar_skip', True))
+
+    def to_config(self):
+        config = { 'name': self.name, 'time': '{0}:{1:02d}'.format(self.time.hour, self.time.minute) }
+        if len(self.days) > 0:
+            config['days'] = sorted(self.days)
+        if len(self.dates) > 0:
+            config['dates'] = sorted([ d.isoformat() for d in self.dates ])
+        if len(self.skip) > 0:
+            config['skip'] = sorted([ d.isoformat() for d in self.skip ])
+        if len(self.overrides) > 0:
+            config['override'] = dict([ (d.isoformat(), '{0}:{1:02d}'.format(t.hour, t.minute)) for (d, t) in sorted(self.overrides.items()) ])
+        if not self.enabled:
+            config['enabled'] = False
+        if not self.calendar_skip:
+            config['calendar_skip'] = False
+        return config
+
+    def fire_time(self, day, skip_day=None):
+        """
+        Get the alarm time on a day or None.
+        skip_day(day) is checked for rule days only, single dates and overrides always fire.
+        """
+        if day in self.skip:
+            return None
+        if day in self.overrides:
+            return datetime.datetime.combine(day, self.overrides[day])
+        if day in self.dates:
+            return datetime.datetime.combine(day, self.time)
+        if day.weekday() in self.days:
+            if self.calendar_skip and not skip_day is None and skip_day(day):
+                return None
+            return datetime.datetime.combine(day, self.time)
+        return None
+
+    def next_fire(self, after, skip_day=None):
+        """
+        Get the first alarm time later than after (within a year) or None.
+        """
+        if not self.enabled:
+            return None
+        day = after.date()
+        for i in range(367):
+            t = self.fire_time(day + datetime.timedelta(days=i), skip_day)
+            if not t is None and t > after:
+                return t
+        return None
+
+    def __repr__(self):
+        return 'Alarm({0} {1})'.format(self.name, self.to_config())
+
+class AlarmScheduler:
+    """
+    Set of named alarms with a heap of their next fire times.
+    Changed or removed alarms leave outdated heap entries which are dropped lazily.
+    All methods are thread safe, waiters on the changed condition are notified
+    when alarms are added or removed.
+    """
+
+    def __init__(self, logger=None):
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger(__name__)
+        self.alarms = {}
+        self.versions = {}
+        self.heap = []
+        # skip_day(day) -> reason or None, days without rule alarms (see set_skip_day)
+        self.skip_day = None
+        self.changed = threading.Condition(threading.RLock())
+
+    def add(self, alarm, now=None):
+        """
+        Add or replace an alarm.
+        """
+        if now is None:
+            now = datetime.datetime.now()
+        with self.changed:
+            self.alarms[alarm.name] = alarm
+            self.versions[alarm.name] = self.versions.get(alarm.name, 0) + 1
+            self.schedule(alarm.name, now)
+            self.log.info('alarm %s next %s', alarm.name, self.alarm_time(alarm.name))
+            self.changed.notify_all()
+
+    def remove(self, name):
+        """
+        Remove an alarm, returns the removed alarm or None.
+        """
+        with self.changed:
+            if not name in self.alarms:
+                return None
+            self.versions[name] += 1
+            self.changed.notify_all()
+            return self.alarms.pop(name)
+
+    def get(self, name):
+        return self.alarms.get(name)
+
+    def set_skip_day(self, skip_day, now=None):
+        """
+        Set the check for days without rule alarms (e.g. holidays from a calendar)
+        and schedule all alarms again.
+        """
+        if now is None:
+            now = datetime.datetime.now()
+        with self.changed:
+            self.skip_day = skip_day
+            for name in self.alarms:
+                self.versions[name] += 1
+                self.schedule(name, now)
+            self.changed.notify_all()
+
+    def schedule(self, name, after):
+        t = self.alarms[name].next_fire(after, self.skip_day)
+        if not t is None:
+            heapq.heappush(self.heap, (t, name, self.versions[name]))
+
+    def valid(self, entry):
+        return entry[1] in self.alarms and self.versions[entry[1]] == entry[2]
+
+    def peek(self):
+        """
+        Get (time, alarm) of the next alarm or (None, None).
+        """
+        with self.changed:
+            while len(self.heap) > 0 and not self.valid(self.heap[0]):
+                heapq.heappop(self.heap)
+            if len(self.heap) == 0:
+                return (None, None)
+            return (self.heap[0][0], self.alarms[self.heap[0][1]])
+
+    def alarm_time(self, name):
+        """
+        Get the next fire time of a single alarm.
+        """
+        for entry in self.heap:
+            if entry[1] == name and self.valid(entry):
+                return entry[0]
+        return None
+
+    def due(self, now=None):
+        """
+        Pop all alarms with a fire time up to now and schedule their next occurrence.
+        Returns list of (fire time, alarm).
+        """
+        if now is None:
+            now = datetime.datetime.now()
+        result = []
+        with self.changed:
+            while True:
+                (t, alarm) = self.peek()
+                if t is None or t > now:
+                    break
+                heapq.heappop(self.heap)
+                result.append((t, alarm))
+                self.schedule(alarm.name, max(t, now))
+        return result
+
+    def label(self):
+        """
+        Get the next alarm time for display ('H:MM' or '-:--').
+        """
+        (t, alarm) = self.peek()
+        if t is None:
+            return '-:--'
+        return '{0}:{1:02d}'.format(t.hour, t.minute)
+
+    def load(self, configs, now=None):
+        for config in configs:
+            self.add(Alarm.from_config(config), now)
+
+    def to_config(self):
+        return [ alarm.to_config() for alarm in self.alarms.values() ]
+
+class AlarmTrigger(threading.Thread):
+    """
+    Thread firing the alarms of a scheduler independent of the UI main loop.
+    It sleeps until the next fire time (re-checking the wall clock at least every
+    max_wait seconds) and is woken when alarms change. Alarms found late (e.g. after
+    a suspended system or a clock change) are fired late, up to catch_up seconds.
+    callback(fire_time, alarm, latency) is called in this thread; the firing latency
+    of every alarm is kept in latencies.
+    """
+
+    def __init__(self, scheduler, callback, logger=None, catch_up=3600, max_wait=60, clock=None):
+        threading.Thread.__init__(self, name='alarm-trigger', daemon=True)
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger(__name__)
+        self.scheduler = scheduler
+        self.callback = callback
+        self.catch_up = catch_up
+        self.max_wait = max_wait
+        if clock is None:
+            clock = datetime.datetime.now
+        self.clock = clock
+        self.latencies = collections.deque(maxlen=100)
+        self.keep_running = True
+
+    def wait_due(self):
+        """
+        Wait until alarms are due, returns list of (fire time, alarm).
+        """
+        with self.scheduler.changed:
+            while self.keep_running:
+                now = self.clock()
+                due = self.scheduler.due(now)
+                if len(due) > 0:
+                    return due
+                t = self.scheduler.peek()[0]
+                timeout = self.max_wait
+                if not t is None:
+                    timeout = min(timeout, max(0.0, (t - now).total_seconds()))
+                self.scheduler.changed.wait(timeout)
+        return []
+
+    def fire(self, due):
+        """
+        Fire a list of (fire time, alarm), skipping alarms missed by more than catch_up seconds.
+        """
+        for (fire_time, alarm) in due:
+            latency = (self.clock() - fire_time).total_seconds()
+            if latency > self.catch_up:
+                self.log.warning('alarm {0} at {1} missed by {2:.0f}s, skipped'.format(alarm.name, fire_time, latency))
+                continue
+            if latency > 1.0:
+                self.log.warning('alarm {0} at {1} fired {2:.1f}s late'.format(alarm.name, fire_time, latency))
+            try:
+                self.callback(fire_time, alarm, latency)
+            except Exception as e:
+                self.log.error('alarm {0} callback failed: {1}'.format(alarm.name, e))
+            self.latencies.append({ 'alarm': alarm.name, 'time': fire_time.isoformat(), 'latency': latency })
+            self.log.info('alarm %s at %s latency %.3fs', alarm.name, fire_time, latency)
+
+    def run(self):
+        while self.keep_running:
+            self.fire(self.wait_due())
+
+    def stop(self):
+        with self.scheduler.changed:
+            self.keep_running = False
+            self.scheduler.changed.notify_all()
+
+if __name__ == '__main__':
+    import argparse
+    import random
+
+    self = os.path.basename(sys.argv[0])
+    myName = os.path.splitext(self)[0]
+    log = logging.getLogger(myName)
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+    parser = argparse.ArgumentParser(description='alarm scheduler benchmark')
+    parser.add_argument('-d', '--debug', action='store_true', help='debug execution')
+    parser.add_argument('-n', '--count', type=int, default=50, help='number of alarms')
+    parser.add_argument('--days', type=int, default=7, help='simulated days')
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.debug:
+        log.setLevel(logging.DEBUG)
+    else:
+        log.setLevel(logging.WARNING)
+    now = datetime.datetime.now().replace(second=0, microsecond=0)
+    scheduler = AlarmScheduler(logger=log)
+    for i in range(args.count):
+        rule = random.choice(list(DAY_RULES.keys()))
+        scheduler.add(Alarm('alarm{0}'.format(i), '{0}:{1:02d}'.format(random.randint(5, 9), random.randint(0, 59)), rule), now)
+    fired = 0
+    start = time.perf_counter()
+    for minute in range(args.days * 24 * 60):
+        fired += len(scheduler.due(now + datetime.timedelta(minutes=minute)))
+    elapsed = time.perf_counter() - start
+    print('{0} alarms, {1} fired in {2} days, {3:.1f} us per minute check'.format(args.count, fired, args.days, elapsed * 1e6 / (args.days * 24 * 60)))
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+
+import pygame
+
+# bump to invalidate all cache entries after a format change
+CACHE_VERSION = 1
+
+class AssetCache:
+    """
+    On-disk cache of pre-scaled images and pre-rendered surfaces.
+    Entries are keyed by the source file (path and mtime) and the target
+    parameters (size, color, ...), so changed sources are rendered again.
+    Surfaces are stored as raw pixel data, which loads faster than decoding
+    and scaling a PNG or rasterizing a TrueType font.
+    """
+
+    def __init__(self, directory='~/.cache/alarmclock', logger=None):
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger(__name__)
+        self.directory = None
+        self.hits = 0
+        self.misses = 0
+        if directory is None:
+            return
+        directory = os.path.expanduser(directory)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            self.directory = directory
+        except OSError as e:
+            self.log.warning('no asset cache in {0}: {1}'.format(directory, e))
+
+    def key(self, source, *params):
+        """
+        Get the cache key for a source file and target parameters.
+        """
+        if source is None:
+            stamp = pygame.version.ver
+        else:
+            source = os.path.abspath(source)
+            try:
+                stamp = os.stat(source).st_mtime_ns
+            except OSError:
+                stamp = None
+        text = repr((CACHE_VERSION, source, stamp, params))
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def path(self, key, extension):
+        return os.path.join(self.directory, key + extension)
+
+    def write(self, file_name, data):
+        """
+        Write a cache file atomically.
+        """
+        tmp = '{0}.{1}.tmp'.format(file_name, os.getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, file_name)
+        except OSError as e:
+            self.log.warning('writing {0} failed: {1}'.format(file_name, e))
+
+    def load_json(self, key):
+        if self.directory is None:
+            return None
+        try:
+            with open(self.path(key, '.json')) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def save_json(self, key, data):
+        if self.directory is None:
+            return
+        self.write(self.path(key, '.json'), json.dumps(data).encode('utf-8'))
+
+    def load_surface(self, key):
+        """
+        Get a cached surface or None.
+        """
+        if self.directory is None:
+            return None
+        try:
+            with open(self.path(key, '.surface'), 'rb') as f:
+                header = json.loads(f.readline().decode('utf-8'))
+                data = f.read()
+            surface = pygame.image.fromstring(data, tuple(header['size']), header['format'])
+        except (OSError, ValueError, KeyError, pygame.error):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return surface
+
+    def save_surface(self, key, surface):
+        if self.directory is None:
+            return
+        format = 'RGBA' if surface.get_flags() & pygame.SRCALPHA else 'RGB'
+        header = json.dumps({ 'size': surface.get_size(), 'format': format }) + '\n'
+        self.write(self.path(key, '.surface'), header.encode('utf-8') + pygame.image.tostring(surface, format))
+
+    def image(self, file_name, size=None):
+        """
+        Load an image scaled to size, from the cache if possible.
+        """
+        key = self.key(file_name, 'image', None if size is None else tuple(size))
+        surface = self.load_surface(key)
+        if surface is None:
+            surface = pygame.image.load(file_name)
+            if not size is None:
+                surface = pygame.transform.scale(surface, tuple(size))
+            self.save_surface(key, surface)
+        return surface
+
+    def clear(self):
+        """
+        Remove all cache entries.
+        """
+        if self.directory is None:
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith('.surface') or name.endswith('.json'):
+                os.remove(os.path.join(self.directory, name))
+
+if __name__ == '__main__':
+    import argparse
+    import glob
+
+    self = os.path.basename(sys.argv[0])
+    myName = os.path.splitext(self)[0]
+    log = logging.getLogger(myName)
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+    parser = argparse.ArgumentParser(description='asset cache load times')
+    parser.add_argument('-d', '--debug', action='store_true', help='debug execution')
+    parser.add_argument('--cache', default='~/.cache/alarmclock', help='cache directory')
+    parser.add_argument('--clear', action='store_true', help='clear the cache first')
+    parser.add_argument('-s', '--size', type=int, default=48, help='icon size')
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.debug:
+        log.setLevel(logging.DEBUG)
+    else:
+        log.setLevel(logging.INFO)
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.display.init()
+    cache = AssetCache(args.cache, logger=log)
+    if args.clear:
+        cache.clear()
+    icons = sorted(glob.glob('icons/*.png'))
+    for name in [ 'first', 'second' ]:
+        start = time.perf_counter()
+        for icon in icons:
+            cache.image(icon, (args.size, args.size))
+        print('{0:6} {1} icons in {2:.2f} ms'.format(name, len(icons), (time.perf_counter() - start) * 1000))
+    print('{0} hits, {1} misses'.format(cache.hits, cache.misses))
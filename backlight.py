@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import logging
+import os
+import sys
+import threading
+import time
+
+import metrics
+
+class Backlight:
+    """
+    Display backlight with sysfs files kept open and the current value cached.
+    Fades run in their own timer thread.
+    """
+
+    def __init__(self, path='/sys/class/backlight/rpi_backlight', logger=None):
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger(__name__)
+        self.path = path
+        self.fd = None
+        self.value = 0
+        self.writes = 0
+        self.lock = threading.Lock()
+        self.fade_thread = None
+        self.fade_stop = threading.Event()
+        self.max_value = 255
+        if path is None:
+            return
+        brightness = os.path.join(path, 'brightness')
+        if not os.path.exists(brightness):
+            self.log.info('no backlight control in {0}'.format(path))
+            return
+        self.fd = os.open(brightness, os.O_RDWR)
+        actual = os.path.join(path, 'actual_brightness')
+        if not os.path.exists(actual):
+            actual = brightness
+        with open(actual) as f:
+            self.value = int(f.read())
+        max_brightness = os.path.join(path, 'max_brightness')
+        if os.path.exists(max_brightness):
+            with open(max_brightness) as f:
+                self.max_value = int(f.read())
+        self.log.info('backlight {0} brightness {1}/{2}'.format(path, self.value, self.max_value))
+
+    def available(self):
+        return not self.fd is None
+
+    def get(self):
+        """
+        Get the current brightness (cached, not read from sysfs).
+        """
+        return self.value
+
+    def set(self, value):
+        """
+        Set the brightness, unchanged values are not written.
+        """
+        value = max(0, min(self.max_value, int(round(value))))
+        with self.lock:
+            if value == self.value:
+                return False
+            self.value = value
+            if self.fd is None:
+                return False
+            os.pwrite(self.fd, '{0}\n'.format(value).encode('ascii'), 0)
+            self.writes += 1
+        metrics.registry.inc('backlight_writes_total')
+        return True
+
+    def fade(self, target, duration, rate=25):
+        """
+        Fade from the current to the target brightness within duration seconds,
+        rate steps per second. A running fade is replaced.
+        """
+        self.stop_fade()
+        start = self.value
+        self.log.info('backlight fade %s -> %s in %ss', start, target, duration)
+        if duration <= 0:
+            self.set(target)
+            return
+        self.fade_stop = threading.Event()
+        self.fade_thread = threading.Thread(target=self.run_fade, args=(start, target, duration, rate, self.fade_stop), name='backlight-fade', daemon=True)
+        self.fade_thread.start()
+
+    def run_fade(self, start, target, duration, rate, stop):
+        t0 = time.monotonic()
+        while not stop.wait(1.0 / rate):
+            x = min(1.0, (time.monotonic() - t0) / duration)
+            self.set(start + (target - start) * x)
+            if x >= 1.0:
+                break
+
+    def stop_fade(self):
+        """
+        Stop a running fade at the current brightness.
+        """
+        self.fade_stop.set()
+        if not self.fade_thread is None and self.fade_thread is not threading.current_thread():
+            self.fade_thread.join()
+        self.fade_thread = None
+
+    def fading(self):
+        return not self.fade_thread is None and self.fade_thread.is_alive()
+
+    def close(self):
+        self.stop_fade()
+        if not self.fd is None:
+            os.close(self.fd)
+            self.fd = None
+
+class FakeBacklight(Backlight):
+    """
+    In-memory backlight for development systems and tests.
+    Fades are recorded and reach their target at once.
+    """
+
+    def __init__(self, value=50, logger=None):
+        Backlight.__init__(self, None, logger)
+        self.value = value
+        self.history = []
+        self.fades = []
+
+    def set(self, value):
+        value = max(0, min(self.max_value, int(round(value))))
+        if value == self.value:
+            return False
+        self.value = value
+        self.writes += 1
+        metrics.registry.inc('backlight_writes_total')
+        self.history.append((time.time(), value))
+        return True
+
+    def fade(self, target, duration, rate=25):
+        self.fades.append((self.value, target, duration))
+        self.set(target)
+
+if __name__ == '__main__':
+    import argparse
+
+    self = os.path.basename(sys.argv[0])
+    myName = os.path.splitext(self)[0]
+    log = logging.getLogger(myName)
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+    parser = argparse.ArgumentParser(description='backlight fade')
+    parser.add_argument('-d', '--debug', action='store_true', help='debug execution')
+    parser.add_argument('-p', '--path', default='/sys/class/backlight/rpi_backlight', help='sysfs backlight directory')
+    parser.add_argument('-t', '--time', type=float, default=10.0, help='fade duration in seconds')
+    parser.add_argument('-r', '--rate', type=float, default=25.0, help='steps per second')
+    parser.add_argument('target', type=int, help='target brightness')
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.debug:
+        log.setLevel(logging.DEBUG)
+    else:
+        log.setLevel(logging.INFO)
+    backlight = Backlight(args.path, logger=log)
+    backlight.fade(args.target, args.time, args.rate)
+    backlight.fade_thread.join()
+    print('{0} brightness writes, brightness {1}'.format(backlight.writes, backlight.get()))
+    backlight.close()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import bisect
+import collections
+import datetime
+import functools
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+
+# one parsed entry of the ioBroker ical table, start and end are naive local times (end exclusive)
+CalendarEvent = collections.namedtuple('CalendarEvent', [ 'start', 'end', 'calendar', 'cls', 'event' ])
+
+@functools.lru_cache(maxsize=4096)
+def parse_timestamp(value):
+    """
+    Convert an ical table timestamp ('2019-06-09T22:00:00.000Z') to naive local time.
+    Timestamps repeat a lot (all-day events), so the results are memoized.
+    """
+    t = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=datetime.timezone.utc)
+    return t.astimezone().replace(tzinfo=None)
+
+@functools.lru_cache(maxsize=1)
+def transliterate():
+    """
+    Get unidecode.unidecode or None if it is not installed (looked up once).
+    """
+    try:
+        import unidecode
+    except ImportError:
+        return None
+    return unidecode.unidecode
+
+def plain_text(text):
+    """
+    Event text with ASCII letters only (the clock font has no umlauts), if unidecode is installed.
+    """
+    func = transliterate()
+    if func is None:
+        return text
+    return func(text)
+
+class CalendarIndex:
+    """
+    Index of the ioBroker ical table ('ical.0.data.table').
+    The table is parsed again only if its content hash changed. The events of each
+    calendar are kept sorted by start time; together with the longest event duration
+    this finds the events overlapping a time range with two binary searches.
+    """
+
+    def __init__(self, logger=None):
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger(__name__)
+        self.digest = None
+        # calendar name -> (sorted start times, events in the same order, longest duration)
+        self.calendars = {}
+        self.entries = 0
+        self.updates = 0
+        self.parses = 0
+
+    def update(self, table):
+        """
+        Use a new ical table, returns True if the content changed (and was parsed).
+        """
+        self.updates += 1
+        digest = hashlib.sha1(json.dumps(table).encode('utf-8')).hexdigest()
+        if digest == self.digest:
+            return False
+        start = time.perf_counter()
+        events = collections.defaultdict(list)
+        for entry in table:
+            try:
+                begin = parse_timestamp(entry['_date'])
+                end = parse_timestamp(entry.get('_end') or entry['_date'])
+            except (KeyError, TypeError, ValueError) as e:
+                self.log.warning('invalid calendar entry {0}: {1}'.format(entry, e))
+                continue
+            calendar = entry.get('_calName')
+            events[calendar].append(CalendarEvent(begin, max(begin, end), calendar, entry.get('_class') or '', plain_text(entry.get('event') or '')))
+        calendars = {}
+        for (calendar, entries) in events.items():
+            entries.sort()
+            longest = max([ e.end - e.start for e in entries ])
+            calendars[calendar] = ([ e.start for e in entries ], entries, longest)
+        # readers in other threads see the old or the new index, never a mix
+        self.calendars = calendars
+        self.entries = sum([ len(entries) for entries in events.values() ])
+        self.digest = digest
+        self.parses += 1
+        self.log.info('calendar table parsed in %.3fs (%s entries, %s calendars)', time.perf_counter() - start, self.entries, len(calendars))
+        return True
+
+    def between(self, start, end, calendar=None, cls=None):
+        """
+        Get the events overlapping [start, end) sorted by start time,
+        optionally of one calendar and with a class ending in cls.
+        """
+        calendars = self.calendars
+        if calendar is None:
+            names = list(calendars.keys())
+        else:
+            names = [ calendar ]
+        result = []
+        for name in names:
+            if not name in calendars:
+                continue
+            (starts, entries, longest) = calendars[name]
+            # events starting before start - longest cannot reach into the range
+            first = bisect.bisect_left(starts, start - longest)
+            last = bisect.bisect_left(starts, end)
+            for event in entries[first:last]:
+                if event.end > start or event.start == start:
+                    if cls is None or event.cls.endswith(cls):
+                        result.append(event)
+        if calendar is None:
+            result.sort()
+        return result
+
+    def on(self, day, calendar=None, cls=None):
+        """
+        Get the events of a day.
+        """
+        start = datetime.datetime.combine(day, datetime.time())
+        return self.between(start, start + datetime.timedelta(days=1), calendar, cls)
+
+    def match(self, day, rules):
+        """
+        Get the first event of a day matching one of the rules or None.
+        A rule is a dictionary with 'calendar' and optionally 'class' (suffix of the event class)
+        and 'match' (part of the event text, case-insensitive).
+        """
+        for rule in rules:
+            for event in self.on(day, rule.get('calendar'), rule.get('class')):
+                if not 'match' in rule or rule['match'].lower() in event.event.lower():
+                    return event
+        return None
+
+    def legacy(self, calendar, cls=None, today=None):
+        """
+        Get the events of a calendar as dictionary of start time and event text,
+        with today as start time of ongoing events (the former IoBroker.get_calendar result,
+        timezone-aware local times).
+        """
+        if today is None:
+            today = datetime.date.today()
+        result = {}
+        (starts, entries, longest) = self.calendars.get(calendar, ([], [], None))
+        for event in entries:
+            if not cls is None and not event.cls.endswith(cls):
+                continue
+            t = event.start
+            if event.start.date() <= today and event.end.date() >= today:
+                t = datetime.datetime.combine(today, datetime.time())
+            result[t.astimezone()] = event.event
+        return result
+
+def synthetic_table(count=10000, start=None, calendars=('Familie', 'Feiertage', 'Arbeit')):
+    """
+    Build an ical table like the ioBroker adapter with count entries over about five years.
+    """
+    import random
+
+    if start is None:
+        start = datetime.datetime.now(datetime.timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0) - datetime.timedelta(days=365)
+    rnd = random.Random(42)
+    table = []
+    for i in range(count):
+        begin = start + datetime.timedelta(minutes=rnd.randrange(5 * 365 * 24 * 4) * 15)
+        if rnd.random() < 0.3:
+            begin = begin.replace(hour=0, minute=0)
+            end = begin + datetime.timedelta(days=rnd.choice([ 1, 1, 1, 2, 7, 14 ]))
+            event = rnd.choice([ 'Urlaub', 'Feiertag', 'Geburtstag' ])
+        else:
+            end = begin + datetime.timedelta(minutes=rnd.choice([ 30, 60, 90, 120 ]))
+            event = 'Termin {0}'.format(i)
+        calendar = rnd.choice(calendars)
+        table.append({
+            'date': begin.strftime('%d.%m.%Y %H:%M'),
+            'event': event,
+            '_class': 'ical_{0}'.format(calendar),
+            '_date': begin.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+            '_end': end.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+            '_calName': calendar,
+        })
+    return table
+
+def benchmark(count=10000, queries=1000):
+    """
+    Time parsing a synthetic table, the unchanged-table check and day queries
+    against a linear walk with parsing per call (the former get_calendar).
+    Returns times in seconds.
+    """
+    table = synthetic_table(count)
+    today = datetime.date.today()
+    days = [ today + datetime.timedelta(days=i % 365) for i in range(queries) ]
+    result = {}
+
+    start = time.perf_counter()
+    for day in days[:10]:
+        found = []
+        for entry in table:
+            if entry['_calName'] != 'Familie':
+                continue
+            begin = datetime.datetime.fromisoformat(entry['_date'].replace('Z', '+00:00')).astimezone()
+            end = datetime.datetime.fromisoformat(entry['_end'].replace('Z', '+00:00')).astimezone()
+            if begin.date() <= day and end.date() >= day:
+                found.append(entry)
+    result['walk'] = (time.perf_counter() - start) / 10
+
+    index = CalendarIndex()
+    parse_timestamp.cache_clear()
+    start = time.perf_counter()
+    index.update(table)
+    result['parse'] = time.perf_counter() - start
+    start = time.perf_counter()
+    index.update(table)
+    result['unchanged'] = time.perf_counter() - start
+    start = time.perf_counter()
+    for day in days:
+        index.on(day, 'Familie')
+    result['query'] = (time.perf_counter() - start) / queries
+    rules = [ { 'calendar': 'Feiertage' }, { 'calendar': 'Familie', 'match': 'urlaub' } ]
+    start = time.perf_counter()
+    skipped = len([ day for day in days if not index.match(day, rules) is None ])
+    result['match'] = (time.perf_counter() - start) / queries
+    result['skipped'] = skipped
+    return result
+
+if __name__ == '__main__':
+    import argparse
+
+    self = os.path.basename(sys.argv[0])
+    myName = os.path.splitext(self)[0]
+    log = logging.getLogger(myName)
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+    parser = argparse.ArgumentParser(description='calendar index benchmark on a synthetic ical table')
+    parser.add_argument('-d', '--debug', action='store_true', help='debug execution')
+    parser.add_argument('-n', '--count', type=int, default=10000, help='number of table entries')
+    parser.add_argument('-q', '--queries', type=int, default=1000, help='number of day queries')
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.debug:
+        log.setLevel(logging.DEBUG)
+    else:
+        log.setLevel(logging.INFO)
+    result = benchmark(args.count, args.queries)
+    print('walk and parse per query {0:10.3f} ms'.format(result['walk'] * 1000))
+    print('index build              {0:10.3f} ms'.format(result['parse'] * 1000))
+    print('unchanged table          {0:10.3f} ms'.format(result['unchanged'] * 1000))
+    print('indexed day query        {0:10.3f} ms'.format(result['query'] * 1000))
+    print('skip rule check          {0:10.3f} ms ({1} of {2} days skipped)'.format(result['match'] * 1000, result['skipped'], args.queries))
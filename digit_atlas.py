@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import logging
+import os
+import sys
+import time
+
+import pygame
+
+class DigitAtlas:
+    """
+    Pre-rendered sprite sheets with all hour (0 - 23) and minute (00 - 59)
+    strings of a font. The labels are rendered once into 8-bit palette indices,
+    the sheet of a color shares these indices and only has its own palette
+    (the anti-aliasing ramp from the background to the color).
+    font is a pygame font or a (font file, size) tuple. With an AssetCache the
+    layout is stored on disk. The sheets are built in memory (from the font about
+    as fast as reading them back, without writing megabytes to the SD card); with
+    direct set labels are rendered with the font, e.g. the first frame after a start.
+    """
+
+    def __init__(self, font, bg_color=(0, 0, 0), columns=10, logger=None, cache=None):
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger(__name__)
+        self.font_source = None
+        if isinstance(font, tuple):
+            self.font_source = font
+            font = None
+        self.font = font
+        self.cache = cache
+        self.bg_color = tuple(bg_color)
+        self.labels = []
+        for label in [ str(h) for h in range(24) ] + [ '{0:02d}'.format(m) for m in range(60) ]:
+            if not label in self.labels:
+                self.labels.append(label)
+        self.sizes = {}
+        self.rects = {}
+        self.glyphs = None
+        self.sheets = {}
+        self.direct = False
+        self.layout(columns)
+
+    def get_font(self):
+        """
+        Get the font, load it on first use.
+        """
+        if self.font is None:
+            self.font = pygame.font.Font(*self.font_source)
+        return self.font
+
+    def cache_key(self, *params):
+        if self.cache is None or self.font_source is None:
+            return None
+        return self.cache.key(self.font_source[0], self.font_source[1], self.labels, self.columns, *params)
+
+    def layout(self, columns):
+        """
+        Compute the position of every label on the sprite sheet.
+        All sheets share the same grid layout.
+        """
+        self.columns = columns
+        key = self.cache_key('layout')
+        if not key is None:
+            sizes = self.cache.load_json(key)
+            if not sizes is None:
+                self.sizes = dict([ (label, tuple(s)) for (label, s) in sizes.items() ])
+        if len(self.sizes) == 0:
+            for label in self.labels:
+                self.sizes[label] = self.get_font().size(label)
+            if not key is None:
+                self.cache.save_json(key, self.sizes)
+        cell_w = max([ s[0] for s in self.sizes.values() ])
+        cell_h = max([ s[1] for s in self.sizes.values() ])
+        for i, label in enumerate(self.labels):
+            s = self.sizes[label]
+            self.rects[label] = pygame.Rect((i % columns) * cell_w, (i // columns) * cell_h, s[0], s[1])
+        rows = (len(self.labels) + columns - 1) // columns
+        self.sheet_size = (min(columns, len(self.labels)) * cell_w, rows * cell_h)
+        self.log.debug('digit atlas {0} labels, sheet {1}'.format(len(self.labels), self.sheet_size))
+
+    def size(self, label):
+        """
+        Get the size of a label (same as font.size()).
+        """
+        if label in self.sizes:
+            return self.sizes[label]
+        return self.get_font().size(label)
+
+    def glyph_indices(self):
+        """
+        Get the palette indices of all labels, render them on first use.
+        Anti-aliased text with a background color is an 8-bit surface whose
+        indices do not depend on the text color.
+        """
+        if self.glyphs is None:
+            start = time.perf_counter()
+            reference = (255, 255, 255)
+            sheet = pygame.Surface(self.sheet_size, 0, 8)
+            sheet.set_palette(self.get_font().render(self.labels[0], True, reference, self.bg_color).get_palette())
+            sheet.fill(0)
+            for label in self.labels:
+                # same palette, the indices are copied unchanged
+                sheet.blit(self.get_font().render(label, True, reference, self.bg_color), self.rects[label])
+            self.glyphs = pygame.image.tostring(sheet, 'P')
+            self.log.info('digit atlas {0} rendered in {1:.3f}s ({2} bytes)'.format(self.sheet_size, time.perf_counter() - start, len(self.glyphs)))
+        return self.glyphs
+
+    def sheet(self, color):
+        """
+        Get the sprite sheet for a color, create it on first use.
+        """
+        key = tuple([ int(c) for c in color ])
+        if key in self.sheets:
+            return self.sheets[key]
+        sheet = pygame.image.frombuffer(self.glyph_indices(), self.sheet_size, 'P')
+        sheet.set_palette(self.get_font().render(self.labels[0], True, key, self.bg_color).get_palette())
+        self.sheets[key] = sheet
+        self.log.debug('digit atlas for color %s', key)
+        return sheet
+
+    def render(self, screen, label, pos, color):
+        """
+        Blit a label from the sprite sheet of the given color onto screen.
+        Labels not in the atlas are rendered with the font (all labels if direct is set).
+        """
+        if self.direct or not label in self.rects:
+            surface = self.get_font().render(label, True, color)
+            return screen.blit(surface, pos)
+        return screen.blit(self.sheet(color), pos, self.rects[label])
+
+    def clear(self):
+        """
+        Drop all sprite sheets (e.g. after a font change).
+        """
+        self.glyphs = None
+        self.sheets = {}
+
+def benchmark(font_file, height=480, count=200, logger=None):
+    """
+    Compare font rendering against atlas blitting for time strings.
+    Returns the average time per render_time() equivalent in seconds.
+    """
+    pygame.init()
+    screen = pygame.display.set_mode((round(height * 5 / 3), height))
+    font = pygame.font.Font(font_file, round(height * 0.64))
+    bg_color = (10, 10, 10)
+    color = (255, 255, 255)
+    atlas = DigitAtlas(font, bg_color, logger=logger)
+    atlas.sheet(color)
+    times = [ '{0}:{1:02d}'.format((i // 60) % 24, i % 60) for i in range(count) ]
+    start = time.perf_counter()
+    for t in times:
+        for label in t.split(':'):
+            screen.blit(font.render(label, True, color), (0, 0))
+    font_time = (time.perf_counter() - start) / count
+    start = time.perf_counter()
+    for t in times:
+        for label in t.split(':'):
+            atlas.render(screen, label, (0, 0), color)
+    atlas_time = (time.perf_counter() - start) / count
+    pygame.quit()
+    return { 'font': font_time, 'atlas': atlas_time }
+
+if __name__ == '__main__':
+    import argparse
+
+    self = os.path.basename(sys.argv[0])
+    myName = os.path.splitext(self)[0]
+    log = logging.getLogger(myName)
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+    parser = argparse.ArgumentParser(description='digit atlas benchmark')
+    parser.add_argument('-d', '--debug', action='store_true', help='debug execution')
+    parser.add_argument('-f', '--font', default='font/gluqlo.ttf', help='digit font')
+    parser.add_argument('-n', '--count', type=int, default=200, help='number of rendered times')
+    parser.add_argument('--height', type=int, default=480, help='screen height')
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.debug:
+        log.setLevel(logging.DEBUG)
+    else:
+        log.setLevel(logging.INFO)
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    result = benchmark(args.font, args.height, args.count, logger=log)
+    print('font  {0:8.3f} ms/render'.format(result['font'] * 1000))
+    print('atlas {0:8.3f} ms/render'.format(result['atlas'] * 1000))
+    print('speedup {0:.1f}x'.format(result['font'] / max(result['atlas'], 1e-9)))
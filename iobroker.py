@@ -5,8 +5,8 @@
 
 @description: access to iobroker via python
 
-   @requires: requests
-              ciso8601, pytz, tzlocal (for calendar functionality)
+   @requires: requests (keep-alive connections via requests.Session)
+              unidecode (optional, ASCII calendar event texts)
 
      @author: Alexander Fischer
 
@@ -14,92 +14,183 @@
 """
 
 # standard Python modules
+import collections
 import datetime
+import http.client
 import json
 import logging
 from operator import itemgetter
 import os
-import re
+import queue
+import socket
 import sys
+import threading
 import time
+import urllib.parse
 import uuid
 
 # additional modules
-import requests
+from calendar_index import CalendarIndex
+import metrics
+from object_catalog import ObjectCatalog
+
+class ValueCache(object):
+    """
+    Bounded LRU cache for ioBroker values with a policy per datapoint:
+    ttl     - seconds until a cached value has to be refreshed from ioBroker
+    max_age - values with an older ioBroker timestamp (seconds) are treated as invalid
+    """
+
+    def __init__(self, max_entries=256, default_ttl=60, default_max_age=None):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.default_max_age = default_max_age
+        self.entries = collections.OrderedDict()
+        self.policies = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def set_policy(self, object_id, ttl=None, max_age=None):
+        """
+        Set time to live and maximum value age for a datapoint.
+        """
+        if ttl is None:
+            ttl = self.default_ttl
+        self.policies[object_id] = (ttl, max_age)
+
+    def policy(self, object_id):
+        """
+        Get (ttl, max_age) for a datapoint.
+        """
+        return self.policies.get(object_id, (self.default_ttl, self.default_max_age))
+
+    def put(self, object_id, value, now=None):
+        """
+        Store a value, evict the least recently used entries beyond max_entries.
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            self.entries[object_id] = (now, value)
+            self.entries.move_to_end(object_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def lookup(self, object_id, now=None):
+        """
+        Get (value, fetch time, fresh) for a datapoint, (None, None, False) if not cached.
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            entry = self.entries.get(object_id)
+            if entry is None:
+                self.misses += 1
+                return (None, None, False)
+            self.entries.move_to_end(object_id)
+            fresh = now - entry[0] < self.policy(object_id)[0]
+            if fresh:
+                self.hits += 1
+            else:
+                self.stale_hits += 1
+        return (entry[1], entry[0], fresh)
+
+    def invalidate(self, object_id=None):
+        """
+        Remove one or all cached values.
+        """
+        with self.lock:
+            if object_id is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(object_id, None)
 
 class IoBroker(object):
     """
     A helper class to connect to an ioBroker instance
     """
 
-    def __init__(self, host, port, logger=None, get_objects=True):
+    def __init__(self, host, port, logger=None, get_objects=True, clock=None):
         """
         Initialize the ioBroker connection and get the available objects.
+        clock is the time source for cache and value ages (seconds since the epoch).
         """
         if logger:
             self.log = logger
         else:
             self.log = logging.getLogger(__name__)
+        if clock is None:
+            clock = time.time
+        self.clock = clock
+        # imported here, it is not needed to show the time after a (re)start
+        import requests
+
         self.host = host
         self.url = 'http://{0}:{1}/'.format(host, port)
+        # reuse TCP connections (keep-alive) instead of connecting for every datapoint
+        self.session = requests.Session()
+        self.session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self.cache = ValueCache()
+        self.refreshing = set()
+        self.calendar = CalendarIndex(logger=self.log)
+        self.objects = ObjectCatalog(logger=self.log)
         if get_objects:
-            self.objects = self.get_objects()
+            self.refresh_objects()
             self.log.info('{0} objects found in ioBroker on {1}'.format(len(self.objects), host))
 
+    def update_calendar(self, object_id='ical.0.data.table'):
+        """
+        Fetch the ical table into the calendar index (parsed only if it changed).
+        Returns the content hash of the table or None if there is no table.
+        """
+        table = self.get_value(object_id)
+        if not table:
+            self.log.warning('no ical data table from ioBroker on {0}'.format(self.url))
+            return None
+        self.calendar.update(table)
+        return self.calendar.digest
+
     def get_calendar(self, cal_name, cal_class=None):
         """
         Get calendar entries for given calendar name from ioBroker
-        Returns dictionary of datetime and event name.
+        Returns dictionary of timezone-aware datetime (local time) and event name.
         """
-        import ciso8601
-        import pytz
-        import tzlocal
-        import unidecode
+        if self.update_calendar() is None:
+            return {}
+        return self.calendar.legacy(cal_name, cal_class)
 
-        result = {}
-        cal = self.get_value('ical.0.data.table')
-        if not cal:
-            self.log.warning('no ical data table from ioBroker on {0}'.format(args.iobroker))
-            return result
-        local_tz = tzlocal.get_localzone()
-        today = datetime.date.today()
-        for ical in cal:
-            if not ical['_calName'] == cal_name:
-                continue
-            self.log.debug('{0} {1} {2}'.format(ical['date'], ical['_date'], unidecode.unidecode(ical['event'])))
-            if cal_class != None and not ical['_class'].endswith(cal_class):
-                continue
-            # convert UTC time to local time
-            start = ciso8601.parse_datetime(ical['_date']).replace(tzinfo=pytz.utc).astimezone(local_tz)
-            end = ciso8601.parse_datetime(ical['_end']).replace(tzinfo=pytz.utc).astimezone(local_tz)
-            dt = start
-            if start.date() <= today and end.date() >= today:
-                dt = ciso8601.parse_datetime(today.isoformat()).replace(tzinfo=local_tz)
-            result[dt] = unidecode.unidecode(ical['event'])
-        return result
+    def refresh_objects(self, prefix=''):
+        """
+        Download the objects with ids starting with prefix (all objects by default) into the catalog,
+        e.g. refresh_objects('hm-rpc.0.') after devices were added to one adapter.
+        Returns the number of objects or None if ioBroker did not answer.
+        """
+        if prefix == '':
+            objects = self.get('objects')
+        else:
+            objects = self.get('objects?pattern=' + urllib.parse.quote(prefix) + '*')
+        if objects is None:
+            return None
+        return self.objects.replace(objects, prefix)
 
     def get_objects(self, pattern=None):
         """
-        Get objects
+        Get objects, all objects from ioBroker or the objects of the catalog
+        with ids matching the regular expression pattern.
         """
         if pattern == None:
             return self.get('objects')
-        result = []
-        for id in self.objects:
-            m = re.match(pattern, id)
-            if not m:
-                continue
-            result.append(self.objects[id])
-        self.log.debug('{0} objects found for pattern {1}'.format(len(result), pattern))
+        result = self.objects.objects(pattern)
+        self.log.debug('%d objects found for pattern %s', len(result), pattern)
         return result
 
     def get_age(self, object_id):
         """
         Get age of a single ioBroker object value.
         """
-        val = self.get('getBulk/' + object_id)[0]
-        age = (datetime.datetime.now() - datetime.datetime.fromtimestamp(val['ts'] / 1000)).total_seconds()
-        return age
+        return self.get_cached_values([ object_id ], with_age=True)[object_id]['age']
 
     def get_value(self, object_id):
         """
@@ -111,22 +202,102 @@ class IoBroker(object):
         """
         Get a single ioBroker object value.
         """
-        bulk = self.get('getBulk/' + object_id)
-        if with_age:
-            bulk[0]['age'] = (datetime.datetime.now() - datetime.datetime.fromtimestamp(bulk[0]['ts'] / 1000)).total_seconds()
-        return bulk
+        return [ self.get_bulk_values([ object_id ], with_age)[object_id] ]
 
-    def get_values(self, object_ids):
+    def get_bulk_values(self, object_ids, with_age=True, chunk_size=50):
         """
-        Get ioBroker object values.
+        Get many ioBroker object values with one getBulk request (per chunk_size ids).
+        Returns dictionary of object id and value dictionary (val, ts and age in seconds if with_age).
+        Unknown or unreachable objects are missing in the result.
         """
         result = {}
-        self.log.debug('get_values() start')
+        object_ids = list(object_ids)
+        for i in range(0, len(object_ids), chunk_size):
+            ids = object_ids[i:i + chunk_size]
+            bulk = self.get('getBulk/' + ','.join(ids))
+            if bulk is None:
+                continue
+            now = datetime.datetime.fromtimestamp(self.clock())
+            for (id, value) in zip(ids, bulk):
+                if value is None:
+                    continue
+                if with_age and value.get('ts'):
+                    value['age'] = (now - datetime.datetime.fromtimestamp(value['ts'] / 1000)).total_seconds()
+                result[value.get('id', id)] = value
+        return result
+
+    def get_cached_values(self, object_ids, with_age=True, stale_ok=True):
+        """
+        Get ioBroker object values through the value cache.
+        Uncached values are fetched with one getBulk request. Stale values (older than
+        their ttl) are returned at once while a background refresh is running, or
+        fetched together with the uncached values if stale_ok is False.
+        Values older than the max_age of their policy are missing in the result.
+        Each value dictionary has an additional 'cache_age' (seconds since fetched).
+        """
+        now = self.clock()
+        result = {}
+        missing = []
+        stale = []
         for id in object_ids:
-            value = self.get('get/' + id)
-            if value == None:
+            (value, fetched, fresh) = self.cache.lookup(id, now)
+            if value is None:
+                missing.append(id)
+                continue
+            if not fresh and not stale_ok:
+                missing.append(id)
                 continue
+            result[id] = (value, fetched)
+            if not fresh:
+                stale.append(id)
+        if len(missing) > 0:
+            for (id, value) in self.get_bulk_values(missing, with_age=False).items():
+                self.cache.put(id, value, now)
+                result[id] = (value, now)
+        if len(stale) > 0:
+            self.refresh(stale)
+        for id in list(result.keys()):
+            (value, fetched) = result[id]
+            value = dict(value)
+            value['cache_age'] = now - fetched
+            max_age = self.cache.policy(id)[1]
+            if (with_age or not max_age is None) and value.get('ts'):
+                value['age'] = now - value['ts'] / 1000
+                if not max_age is None and value['age'] > max_age:
+                    self.log.debug('value of %s too old (%.0fs)', id, value['age'])
+                    del result[id]
+                    continue
             result[id] = value
+        return result
+
+    def refresh(self, object_ids):
+        """
+        Refresh cached values in a background thread (one refresh per datapoint in flight).
+        """
+        with self.cache.lock:
+            ids = [ id for id in object_ids if not id in self.refreshing ]
+            self.refreshing.update(ids)
+        if len(ids) == 0:
+            return
+        threading.Thread(target=self.refresh_values, args=(ids,), name='iobroker-refresh', daemon=True).start()
+
+    def refresh_values(self, object_ids):
+        """
+        Fetch values into the cache.
+        """
+        try:
+            for (id, value) in self.get_bulk_values(object_ids, with_age=False).items():
+                self.cache.put(id, value, self.clock())
+        finally:
+            with self.cache.lock:
+                self.refreshing.difference_update(object_ids)
+
+    def get_values(self, object_ids):
+        """
+        Get ioBroker object values.
+        """
+        self.log.debug('get_values() start')
+        result = self.get_bulk_values(object_ids, with_age=False)
         self.log.debug('get_values() finish')
         return result
 
@@ -142,6 +313,7 @@ class IoBroker(object):
             else:
                 [ id, state ] = value.split('=')
                 cmd = 'ssh pi@{0} sudo iobroker state set {1} {2}'.format(self.host, id, state)
+                metrics.registry.inc('subprocess_spawns_total', command='ssh')
                 os.system(cmd)
         self.log.debug('set_value() finish')
         return result
@@ -172,17 +344,19 @@ class IoBroker(object):
         Generic GET method.
         """
         result = None
-        self.log.debug('get({0}) start'.format(self.url + url))
+        self.log.debug('get(%s%s) start', self.url, url)
+        start = time.perf_counter()
         try:
-            response = requests.get(self.url + url, timeout=10)
+            response = self.session.get(self.url + url, timeout=10)
             if response.status_code == 200:
                 result = response.json()
             else:
-                self.log.debug('status {0}: {1}'.format(response.status_code, response.text))
+                self.log.debug('status %s: %s', response.status_code, response.text)
+                metrics.registry.inc('iobroker_failures_total', method='get', reason='status')
         except:
             self.log.critical('ioBroker connection to {0} failed'.format(self.url))
-            pass
-        self.log.debug('get() finish')
+            metrics.registry.inc('iobroker_failures_total', method='get', reason='connection')
+        metrics.registry.observe('iobroker_request_seconds', time.perf_counter() - start, method='get')
         return result
 
     def post(self, url):
@@ -190,14 +364,237 @@ class IoBroker(object):
         Generic POST method.
         """
         result = None
+        start = time.perf_counter()
         try:
-            response = requests.post(self.url + url, timeout=10)
+            response = self.session.post(self.url + url, timeout=10)
             result = response.status_code == 200
+            if not result:
+                metrics.registry.inc('iobroker_failures_total', method='post', reason='status')
         except:
             self.log.critical('ioBroker connection to {0} failed'.format(self.url))
-            pass
+            metrics.registry.inc('iobroker_failures_total', method='post', reason='connection')
+        metrics.registry.observe('iobroker_request_seconds', time.perf_counter() - start, method='post')
         return result
 
+class IoBrokerWorker(threading.Thread):
+    """
+    Background thread that owns all ioBroker traffic.
+    Fetch results are published in a snapshot dictionary name -> (sequence number, value),
+    which is replaced as a whole on every update and can be read without locking.
+    """
+
+    def __init__(self, iobroker, logger=None, on_update=None):
+        threading.Thread.__init__(self, name='iobroker', daemon=True)
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger(__name__)
+        self.iobroker = iobroker
+        self.on_update = on_update
+        self.snapshot = {}
+        self.requests = queue.Queue()
+        self.pending = set()
+        self.pending_lock = threading.Lock()
+        self.publish_lock = threading.Lock()
+        self.sequence = 0
+        self.keep_running = True
+
+    def request(self, name, func, *args):
+        """
+        Queue a fetch, the result of func(*args) is published under name.
+        A request for a name that is still pending is dropped.
+        """
+        with self.pending_lock:
+            if name in self.pending:
+                self.log.debug('fetch %s already pending', name)
+                return False
+            self.pending.add(name)
+        self.requests.put((name, func, args))
+        return True
+
+    def get(self, name, default=None):
+        """
+        Get the latest published value for name.
+        """
+        entry = self.snapshot.get(name)
+        if entry is None:
+            return default
+        return entry[1]
+
+    def publish(self, name, value):
+        """
+        Publish a fetch result by replacing the snapshot.
+        """
+        # writers (worker, subscriptions) are serialized, readers never lock
+        with self.publish_lock:
+            self.sequence += 1
+            snapshot = dict(self.snapshot)
+            snapshot[name] = (self.sequence, value)
+            self.snapshot = snapshot
+        if not self.on_update is None:
+            self.on_update(name)
+
+    def run(self):
+        while self.keep_running:
+            item = self.requests.get()
+            if item is None:
+                break
+            (name, func, args) = item
+            start = time.time()
+            try:
+                value = func(*args)
+            except Exception as e:
+                self.log.error('fetch {0} failed: {1}'.format(name, e))
+                value = None
+            with self.pending_lock:
+                self.pending.discard(name)
+            self.log.debug('fetch %s took %.3fs', name, time.time() - start)
+            if not value is None:
+                self.publish(name, value)
+            self.requests.task_done()
+
+    def stop(self):
+        """
+        Stop the worker thread.
+        """
+        self.keep_running = False
+        self.requests.put(None)
+
+class IoBrokerSubscription(threading.Thread):
+    """
+    Deliver value changes of a set of datapoints to a callback(id, value).
+    The values are polled with getBulk: every min_interval seconds after a change,
+    doubling up to max_interval while nothing changes.
+    The simple-API adapter has no push channel. With stream=True the subscription listens
+    on a server-sent event stream (<url>events/<id1>,<id2>,...) instead, as provided by
+    iobroker_standin.py or a custom script on the host, and polls while the stream is
+    not available. The stream is retried every retry_stream seconds.
+    """
+
+    def __init__(self, iobroker, object_ids, callback, logger=None, stream=False, min_interval=15, max_interval=300, retry_stream=600, stream_timeout=60):
+        threading.Thread.__init__(self, name='iobroker-subscription', daemon=True)
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger(__name__)
+        self.iobroker = iobroker
+        self.object_ids = list(object_ids)
+        self.callback = callback
+        self.stream = stream
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.retry_stream = retry_stream
+        self.stream_timeout = stream_timeout
+        self.interval = min_interval
+        self.mode = None
+        self.values = {}
+        # socket of the open event stream, shut down by stop()
+        self.socket = None
+        self.stopped = threading.Event()
+
+    def deliver(self, object_id, value):
+        """
+        Call the callback if the value or timestamp of a datapoint changed.
+        """
+        last = self.values.get(object_id)
+        if not last is None and last.get('val') == value.get('val') and last.get('ts') == value.get('ts'):
+            return False
+        self.values[object_id] = value
+        self.iobroker.cache.put(object_id, value, self.iobroker.clock())
+        self.log.debug('subscription %s = %s', object_id, value.get('val'))
+        try:
+            self.callback(object_id, value)
+        except Exception as e:
+            self.log.error('subscription callback for {0} failed: {1}'.format(object_id, e))
+        return True
+
+    def poll(self):
+        """
+        Poll all datapoints once and adapt the polling interval.
+        """
+        changed = False
+        for (id, value) in self.iobroker.get_bulk_values(self.object_ids, with_age=False).items():
+            if self.deliver(id, value):
+                changed = True
+        if changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+        return changed
+
+    def listen(self):
+        """
+        Read changes from the event stream until the connection drops.
+        """
+        url = self.iobroker.url + 'events/' + ','.join(self.object_ids)
+        parts = urllib.parse.urlsplit(url)
+        # plain http.client: stop() needs the socket to interrupt the blocking read
+        connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=self.stream_timeout)
+        try:
+            connection.request('GET', parts.path)
+            self.socket = connection.sock
+            if self.stopped.is_set():
+                return
+            response = connection.getresponse()
+            if response.status != 200:
+                raise IOError('status {0}'.format(response.status))
+            self.mode = 'stream'
+            self.log.info('subscribed to %s datapoints on %s', len(self.object_ids), url)
+            # events are small and rare, readline returns each one without buffering delay
+            for line in response:
+                if self.stopped.is_set():
+                    break
+                line = line.decode('utf-8').strip()
+                if not line.startswith('data:'):
+                    # empty lines and keep-alive comments
+                    continue
+                value = json.loads(line[5:])
+                if 'id' in value:
+                    self.deliver(value['id'], value)
+        finally:
+            self.socket = None
+            connection.close()
+
+    def run(self):
+        next_stream = time.time()
+        self.mode = 'poll'
+        self.poll()
+        while not self.stopped.is_set():
+            if self.stream and time.time() >= next_stream:
+                try:
+                    self.listen()
+                    if not self.stopped.is_set():
+                        self.log.warning('event stream on {0} closed'.format(self.iobroker.url))
+                    next_stream = time.time() + self.min_interval
+                except Exception as e:
+                    self.log.info('no event stream on %s: %s', self.iobroker.url, e)
+                    next_stream = time.time() + self.retry_stream
+                self.mode = 'poll'
+                self.interval = self.min_interval
+                if self.stopped.is_set():
+                    break
+                # catch up with changes missed while reconnecting
+                self.poll()
+                continue
+            self.stopped.wait(self.interval)
+            if not self.stopped.is_set():
+                self.poll()
+
+    def stop(self, timeout=5.0):
+        """
+        Stop the subscription and wait for its thread.
+        """
+        self.stopped.set()
+        sock = self.socket
+        if not sock is None:
+            try:
+                # wakes up the read of the event stream
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self.is_alive() and not self is threading.current_thread():
+            self.join(timeout)
+
 if __name__ == '__main__':
     import argparse
 
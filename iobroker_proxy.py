@@ -0,0 +1,434 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+       @file: iobroker_proxy.py
+
+@description: coalescing proxy for many alarm clocks in front of one ioBroker simple-API
+
+              GET  getBulk/<id>,<id>,...   values from the cache, missing values of all
+                                           clocks are fetched together with one getBulk
+              GET  getPlainValue/<id>      cached per path, identical requests in flight
+              GET  get/<id>                are sent to ioBroker once
+              GET  objects
+              GET  events/...              404, the clocks poll through the proxy
+              other requests (setBulk, toggle) are passed through and invalidate the cache
+
+              The clocks are started with --iobroker <proxy host>:<proxy port>.
+"""
+
+# standard Python modules
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import urllib.parse
+
+class IoBrokerProxy(object):
+    """
+    asyncio HTTP proxy that merges the datapoint requests of many clients.
+    Values are cached for ttl seconds, requested ids without a fresh value are collected
+    for batch_window seconds and fetched with one getBulk request (per chunk_size ids);
+    clients asking for an id that is already being fetched wait for that fetch.
+    """
+
+    def __init__(self, upstream, host='127.0.0.1', port=0, ttl=5.0, objects_ttl=300.0, batch_window=0.02, chunk_size=50, connections=4, timeout=10.0, logger=None):
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger(__name__)
+        (self.upstream_host, _, upstream_port) = upstream.partition(':')
+        self.upstream_port = int(upstream_port or 8082)
+        self.host = host
+        self.port = port
+        self.ttl = ttl
+        self.objects_ttl = objects_ttl
+        self.batch_window = batch_window
+        self.chunk_size = chunk_size
+        self.connections = connections
+        self.timeout = timeout
+        # id -> (fetch time, state or None)
+        self.values = {}
+        # id -> future of the running or next getBulk
+        self.inflight = {}
+        # (id, future) for the next getBulk
+        self.pending = []
+        # id -> number of writes, a getBulk overlapping a write does not cache its result
+        self.generations = {}
+        self.batch = None
+        # path -> (fetch time, status, body) and path -> future for the other GET requests
+        self.paths = {}
+        self.path_inflight = {}
+        self.path_generation = 0
+        self.limit = None
+        self.server = None
+        self.loop = None
+        self.thread = None
+        self.stats = { 'requests': 0, 'upstream': 0, 'hits': 0, 'coalesced': 0, 'errors': 0 }
+
+    async def start(self):
+        """
+        Listen for clients, the port is known afterwards.
+        """
+        self.loop = asyncio.get_running_loop()
+        self.limit = asyncio.Semaphore(self.connections)
+        self.server = await asyncio.start_server(self.serve, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.log.info('ioBroker proxy on {0}:{1} for {2}:{3}'.format(self.host, self.port, self.upstream_host, self.upstream_port))
+        return self
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    def start_thread(self):
+        """
+        Run the proxy in its own event loop in a background thread (tests, load test).
+        """
+        started = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self.start())
+            started.set()
+            self.loop.run_forever()
+            # end the open client connections before the loop is closed
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.close()
+
+        self.thread = threading.Thread(target=run, name='iobroker-proxy', daemon=True)
+        self.thread.start()
+        started.wait()
+        return self
+
+    def stop_thread(self):
+        def stop():
+            self.server.close()
+            self.loop.stop()
+        self.loop.call_soon_threadsafe(stop)
+        self.thread.join()
+
+    async def serve(self, reader, writer):
+        """
+        Handle the requests of one client connection (HTTP/1.1 keep-alive).
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                (method, target, version) = line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    (name, _, value) = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                if length > 0:
+                    await reader.readexactly(length)
+                self.stats['requests'] += 1
+                (status, body) = await self.dispatch(method, target)
+                close = headers.get('connection', '').lower() == 'close' or version.strip() == 'HTTP/1.0'
+                writer.write('HTTP/1.1 {0} {1}\r\nContent-Type: application/json\r\nContent-Length: {2}\r\n{3}\r\n'.format(
+                    status, 'OK' if status == 200 else 'Error', len(body), 'Connection: close\r\n' if close else '').encode('latin-1') + body)
+                await writer.drain()
+                if close:
+                    break
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError) as e:
+            self.log.debug('client connection: %s', e)
+        except asyncio.CancelledError:
+            # proxy stopped with open keep-alive connections
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, target):
+        """
+        Answer a simple-API request, returns (status, body).
+        """
+        url = urllib.parse.urlsplit(target)
+        path = urllib.parse.unquote(url.path.lstrip('/'))
+        (command, _, arg) = path.partition('/')
+        try:
+            if method == 'GET' and command == 'getBulk':
+                states = await self.get_states(arg.split(','))
+                return (200, json.dumps(states).encode('utf-8'))
+            if method == 'GET' and command in ('getPlainValue', 'get', 'objects'):
+                return await self.get_path(target, self.objects_ttl if command == 'objects' else self.ttl)
+            if command == 'events':
+                return (404, json.dumps({ 'error': 'no event streams, poll getBulk' }).encode('utf-8'))
+            # writes go to ioBroker, the next read fetches the new values
+            ids = [ arg ] + [ id for (id, value) in urllib.parse.parse_qsl(url.query) ]
+            self.invalidate(ids)
+            try:
+                return await self.upstream(method, target)
+            finally:
+                # reads started while the write was on its way may have the old values
+                self.invalidate(ids)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+            self.stats['errors'] += 1
+            self.log.warning('ioBroker request {0} failed: {1}'.format(path, e))
+            return (502, json.dumps({ 'error': str(e) }).encode('utf-8'))
+
+    def invalidate(self, ids):
+        """
+        Forget the cached values of ids and all other cached reads. Fetches already running
+        still answer their clients but do not cache their results, later clients do not wait for them.
+        """
+        for id in ids:
+            self.generations[id] = self.generations.get(id, 0) + 1
+            self.values.pop(id, None)
+            self.inflight.pop(id, None)
+        self.path_generation += 1
+        self.paths.clear()
+        self.path_inflight.clear()
+
+    async def get_states(self, ids):
+        """
+        Get the states of ids (in order, None for unknown ids) from the cache or the next batch.
+        """
+        now = self.loop.time()
+        result = {}
+        waiting = {}
+        for id in ids:
+            if id in result or id in waiting:
+                continue
+            entry = self.values.get(id)
+            if not entry is None and now - entry[0] < self.ttl:
+                self.stats['hits'] += 1
+                result[id] = entry[1]
+            elif id in self.inflight:
+                self.stats['coalesced'] += 1
+                waiting[id] = self.inflight[id]
+            else:
+                future = self.loop.create_future()
+                self.inflight[id] = future
+                self.pending.append((id, future))
+                waiting[id] = future
+        if len(self.pending) > 0 and self.batch is None:
+            self.batch = self.loop.create_task(self.fetch_batch())
+        for (id, future) in waiting.items():
+            result[id] = await future
+        return [ result[id] for id in ids ]
+
+    async def fetch_batch(self):
+        """
+        Wait for the batch window and fetch all pending ids with getBulk.
+        """
+        await asyncio.sleep(self.batch_window)
+        (entries, self.pending, self.batch) = (self.pending, [], None)
+        chunks = [ entries[i:i + self.chunk_size] for i in range(0, len(entries), self.chunk_size) ]
+        await asyncio.gather(*[ self.fetch_chunk(chunk) for chunk in chunks ])
+
+    async def fetch_chunk(self, entries):
+        """
+        Fetch the ids of (id, future) entries with one getBulk and resolve the futures.
+        """
+        ids = [ id for (id, future) in entries ]
+        generations = [ self.generations.get(id, 0) for id in ids ]
+        try:
+            (status, body) = await self.upstream('GET', '/getBulk/' + ','.join(ids))
+            if status != 200:
+                raise OSError('status {0}'.format(status))
+            states = json.loads(body)
+            error = None
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+            error = e
+        now = self.loop.time()
+        for (i, (id, future)) in enumerate(entries):
+            if self.inflight.get(id) is future:
+                del self.inflight[id]
+            if not error is None:
+                future.set_exception(OSError(str(error)))
+                continue
+            state = states[i] if i < len(states) else None
+            if self.generations.get(id, 0) == generations[i]:
+                self.values[id] = (now, state)
+            future.set_result(state)
+
+    async def get_path(self, target, ttl):
+        """
+        Get any other read request from the cache or from ioBroker, once for all waiting clients.
+        """
+        entry = self.paths.get(target)
+        if not entry is None and self.loop.time() - entry[0] < ttl:
+            self.stats['hits'] += 1
+            return entry[1:]
+        future = self.path_inflight.get(target)
+        if not future is None:
+            self.stats['coalesced'] += 1
+            return await future
+        future = self.loop.create_future()
+        self.path_inflight[target] = future
+        generation = self.path_generation
+        try:
+            result = await self.upstream('GET', target)
+            if result[0] == 200 and generation == self.path_generation:
+                self.paths[target] = (self.loop.time(),) + result
+            future.set_result(result)
+        except Exception as e:
+            future.set_exception(e)
+            # nobody else may be waiting
+            future.exception()
+            raise
+        finally:
+            if self.path_inflight.get(target) is future:
+                del self.path_inflight[target]
+        return result
+
+    async def upstream(self, method, target):
+        """
+        Send a request to ioBroker, returns (status, body).
+        """
+        async with self.limit:
+            self.stats['upstream'] += 1
+            return await asyncio.wait_for(self.request(method, target), self.timeout)
+
+    async def request(self, method, target):
+        (reader, writer) = await asyncio.open_connection(self.upstream_host, self.upstream_port)
+        try:
+            writer.write('{0} {1} HTTP/1.1\r\nHost: {2}:{3}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'.format(
+                method, target, self.upstream_host, self.upstream_port).encode('latin-1'))
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            length = None
+            chunked = False
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                (name, _, value) = line.decode('latin-1').partition(':')
+                name = name.strip().lower()
+                if name == 'content-length':
+                    length = int(value)
+                elif name == 'transfer-encoding':
+                    chunked = 'chunked' in value.lower()
+            if chunked:
+                body = await self.read_chunked(reader)
+            elif length is None:
+                body = await reader.read()
+            else:
+                body = await reader.readexactly(length)
+            return (status, body)
+        finally:
+            writer.close()
+
+    async def read_chunked(self, reader):
+        """
+        Read a body with Transfer-Encoding: chunked.
+        """
+        body = []
+        while True:
+            line = await reader.readline()
+            if not line:
+                raise asyncio.IncompleteReadError(b''.join(body), None)
+            # chunk extensions after ';' are ignored
+            size = int(line.split(b';')[0].strip(), 16)
+            if size == 0:
+                break
+            body.append(await reader.readexactly(size))
+            await reader.readline()
+        # trailer fields up to the empty line
+        while not (await reader.readline()) in (b'\r\n', b'\n', b''):
+            pass
+        return b''.join(body)
+
+def load_test(clocks=20, ticks=10, tick=1.0, delay=0.05, proxy=True, logger=None):
+    """
+    Simulate clocks polling the same temperature and alarm datapoints at the same
+    moments (every tick seconds like on the minute) against an ioBroker stand-in,
+    directly or through the proxy. Returns request counts and client latencies.
+    """
+    from iobroker import IoBroker
+    from iobroker_standin import IoBrokerStandIn
+
+    temperatures = [ 'fritzdect.0.DECT_116570043782.celsius', '0_userdata.0.eg.fr.nodemcu-wr.temp' ]
+    alarm = '0_userdata.0.og1.sz.alarm'
+    values = dict([ (id, 20.5) for id in temperatures ])
+    values[alarm] = '07:00'
+    standin = IoBrokerStandIn(values=values, delay=delay, logger=logger).start()
+    target = '{0}:{1}'.format(standin.host, standin.port)
+    server = None
+    if proxy:
+        server = IoBrokerProxy(target, ttl=tick / 2, logger=logger).start_thread()
+        target = '{0}:{1}'.format(server.host, server.port)
+    (host, port) = target.split(':')
+    latencies = []
+    lock = threading.Lock()
+    start = time.time() + 0.5
+
+    def clock():
+        iobroker = IoBroker(host, int(port), logger=logger, get_objects=False)
+        for i in range(ticks):
+            time.sleep(max(0.0, start + i * tick - time.time()))
+            t = time.perf_counter()
+            iobroker.get_bulk_values(temperatures, with_age=False)
+            iobroker.get_bulk_values([ alarm ], with_age=False)
+            with lock:
+                latencies.append(time.perf_counter() - t)
+        iobroker.session.close()
+
+    threads = [ threading.Thread(target=clock, daemon=True) for i in range(clocks) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    result = {
+        'clocks': clocks,
+        'client_requests': clocks * ticks * 2,
+        'upstream_requests': standin.requests,
+        'p50': latencies[len(latencies) // 2],
+        'p95': latencies[int(len(latencies) * 0.95)],
+        'max': latencies[-1],
+    }
+    if not server is None:
+        result['proxy'] = dict(server.stats)
+        server.stop_thread()
+    standin.stop()
+    return result
+
+if __name__ == '__main__':
+    import argparse
+
+    self = os.path.basename(sys.argv[0])
+    myName = os.path.splitext(self)[0]
+    log = logging.getLogger(myName)
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+    parser = argparse.ArgumentParser(description='coalescing ioBroker proxy for many alarm clocks')
+    parser.add_argument('-d', '--debug', action='store_true', help='debug execution')
+    parser.add_argument('-H', '--host', default='0.0.0.0', help='listen address')
+    parser.add_argument('-p', '--port', type=int, default=8082, help='listen port')
+    parser.add_argument('--iobroker', default='192.168.137.85:8082', help='iobroker IP address and port')
+    parser.add_argument('--ttl', type=float, default=5.0, help='seconds values are served from the cache')
+    parser.add_argument('--window', type=float, default=0.02, help='seconds requests are collected for one getBulk')
+    parser.add_argument('--load-test', type=int, default=0, metavar='CLOCKS', help='simulate this many clocks against a local stand-in, with and without proxy')
+    parser.add_argument('--ticks', type=int, default=10, help='polls per simulated clock in the load test')
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.debug:
+        log.setLevel(logging.DEBUG)
+    else:
+        log.setLevel(logging.INFO)
+    if args.load_test > 0:
+        log.setLevel(logging.WARNING)
+        for proxy in [ False, True ]:
+            result = load_test(args.load_test, args.ticks, proxy=proxy, logger=log)
+            print('{0:6} {1} clocks: {2} requests, {3} to ioBroker, latency p50 {4:.3f}s p95 {5:.3f}s max {6:.3f}s'.format(
+                'proxy' if proxy else 'direct', result['clocks'], result['client_requests'], result['upstream_requests'], result['p50'], result['p95'], result['max']))
+        sys.exit(0)
+    proxy = IoBrokerProxy(args.iobroker, args.host, args.port, ttl=args.ttl, batch_window=args.window, logger=log)
+    try:
+        asyncio.run(proxy.serve_forever())
+    except KeyboardInterrupt:
+        pass
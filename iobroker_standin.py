@@ -0,0 +1,233 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+       @file: iobroker_standin.py
+
+@description: local stand-in for an ioBroker simple-API instance (development and load tests)
+
+              GET  getBulk/<id>,<id>,...   list of {id, val, ts, ack}
+              GET  getPlainValue/<id>      value
+              GET  get/<id>                state object
+              GET  objects[?pattern=<glob>] object dictionary
+              GET  toggle/<id>             toggle boolean value
+              GET  events/<id>,<id>,...    server-sent event stream of value changes
+              GET  setBulk/?<id>=<value>&...
+              POST setBulk/?<id>=<value>&...
+
+     @author: Alexander Fischer
+"""
+
+# standard Python modules
+import fnmatch
+import http.server
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import urllib.parse
+
+class IoBrokerStandIn(object):
+    """
+    Threaded HTTP server with an in-memory datapoint table.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, values=None, delay=0.0, logger=None, clock=None):
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger(__name__)
+        # time source for the value timestamps (seconds since the epoch)
+        if clock is None:
+            clock = time.time
+        self.clock = clock
+        self.states = {}
+        self.changed = threading.Condition()
+        self.version = 0
+        self.delay = delay
+        self.requests = 0
+        self.request_log = []
+        self.stream_enabled = True
+        for (id, value) in (values or {}).items():
+            self.set(id, value)
+        standin = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # headers and body are written separately, avoid the delayed ACK stall on keep-alive connections
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                standin.log.debug(format % args)
+
+            def do_GET(self):
+                standin.handle(self, 'GET')
+
+            def do_POST(self):
+                standin.handle(self, 'POST')
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.host = host
+        self.port = self.server.server_address[1]
+        self.url = 'http://{0}:{1}/'.format(host, self.port)
+        self.thread = None
+
+    def set(self, object_id, value, ack=True):
+        """
+        Set a datapoint value and notify event stream listeners.
+        """
+        with self.changed:
+            self.states[object_id] = { 'val': value, 'ts': int(self.clock() * 1000), 'ack': ack }
+            self.version += 1
+            self.changed.notify_all()
+
+    def state(self, object_id):
+        state = self.states.get(object_id)
+        if state is None:
+            return None
+        result = dict(state)
+        result['id'] = object_id
+        return result
+
+    def handle(self, handler, method):
+        """
+        Dispatch a simple-API request.
+        """
+        self.requests += 1
+        url = urllib.parse.urlsplit(handler.path)
+        path = urllib.parse.unquote(url.path.lstrip('/'))
+        self.request_log.append(path)
+        if self.delay > 0:
+            time.sleep(self.delay)
+        (command, _, arg) = path.partition('/')
+        if command == 'events' and self.stream_enabled:
+            self.stream(handler, arg.split(','))
+            return
+        if command == 'getBulk':
+            self.reply(handler, [ self.state(id) for id in arg.split(',') ])
+        elif command == 'getPlainValue' and arg in self.states:
+            self.reply(handler, self.states[arg]['val'])
+        elif command == 'get' and arg in self.states:
+            self.reply(handler, self.state(arg))
+        elif command == 'objects':
+            pattern = dict(urllib.parse.parse_qsl(url.query)).get('pattern', '*')
+            self.reply(handler, dict([ (id, { '_id': id, 'type': 'state' }) for id in self.states if fnmatch.fnmatchcase(id, pattern) ]))
+        elif command == 'toggle' and arg in self.states:
+            self.set(arg, not self.states[arg]['val'])
+            self.reply(handler, self.state(arg))
+        elif command == 'setBulk':
+            for (id, value) in urllib.parse.parse_qsl(url.query):
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+                self.set(id, value)
+            self.reply(handler, [])
+        else:
+            self.reply(handler, { 'error': 'not found' }, status=404)
+
+    def reply(self, handler, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def stream(self, handler, object_ids, keepalive=15):
+        """
+        Send current values and then every change of the given datapoints as server-sent events.
+        """
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'text/event-stream')
+        handler.send_header('Cache-Control', 'no-cache')
+        handler.send_header('Connection', 'close')
+        handler.end_headers()
+        handler.close_connection = True
+        sent = {}
+        try:
+            while True:
+                with self.changed:
+                    states = dict([ (id, self.state(id)) for id in object_ids if id in self.states ])
+                lines = []
+                for (id, state) in states.items():
+                    if sent.get(id) == state['ts']:
+                        continue
+                    sent[id] = state['ts']
+                    lines.append('data: {0}\n\n'.format(json.dumps(state)))
+                if len(lines) == 0:
+                    lines.append(': keepalive\n\n')
+                handler.wfile.write(''.join(lines).encode('utf-8'))
+                handler.wfile.flush()
+                with self.changed:
+                    version = self.version
+                    self.changed.wait_for(lambda: self.version != version or not self.stream_enabled, timeout=keepalive)
+                if not self.stream_enabled:
+                    break
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def drop_streams(self):
+        """
+        Close all event streams and refuse new ones (simulates a dropped connection).
+        """
+        with self.changed:
+            self.stream_enabled = False
+            self.changed.notify_all()
+
+    def start(self):
+        """
+        Serve in a background thread.
+        """
+        self.thread = threading.Thread(target=self.server.serve_forever, name='iobroker-standin', daemon=True)
+        self.thread.start()
+        self.log.info('ioBroker stand-in on {0}'.format(self.url))
+        return self
+
+    def stop(self):
+        self.drop_streams()
+        self.server.shutdown()
+        self.server.server_close()
+
+if __name__ == '__main__':
+    import argparse
+
+    self = os.path.basename(sys.argv[0])
+    myName = os.path.splitext(self)[0]
+    log = logging.getLogger(myName)
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+    parser = argparse.ArgumentParser(description='ioBroker simple-API stand-in')
+    parser.add_argument('-d', '--debug', action='store_true', help='debug execution')
+    parser.add_argument('-H', '--host', default='127.0.0.1', help='listen address')
+    parser.add_argument('-p', '--port', type=int, default=8082, help='listen port')
+    parser.add_argument('-s', '--set', action='append', default=[], help='initial value id=value (JSON value)')
+    parser.add_argument('--delay', type=float, default=0.0, help='response delay in seconds')
+    parser.add_argument('--change', default='', help='datapoint to change periodically')
+    parser.add_argument('--interval', type=float, default=30.0, help='change interval in seconds')
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.debug:
+        log.setLevel(logging.DEBUG)
+    else:
+        log.setLevel(logging.INFO)
+    values = {}
+    for item in args.set:
+        (id, value) = item.split('=', 1)
+        try:
+            values[id] = json.loads(value)
+        except ValueError:
+            values[id] = value
+    standin = IoBrokerStandIn(args.host, args.port, values, delay=args.delay, logger=log).start()
+    try:
+        count = 0
+        while True:
+            time.sleep(args.interval)
+            if args.change:
+                count += 1
+                standin.set(args.change, count)
+                log.info('{0} = {1}'.format(args.change, count))
+    except KeyboardInterrupt:
+        standin.stop()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import collections
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+import metrics
+
+class RateLimitFilter(logging.Filter):
+    """
+    Pass at most burst records per message template (logger, level, format string)
+    within period seconds. The number of suppressed records is appended to the
+    next record that passes. Warnings and errors are never suppressed.
+    Log calls must pass their arguments separately ('%s', value) for the message to be a template.
+    Windows older than period are dropped (at most once per period).
+    """
+
+    def __init__(self, burst=5, period=60.0, level=logging.WARNING, clock=None):
+        logging.Filter.__init__(self)
+        if clock is None:
+            clock = time.monotonic
+        self.clock = clock
+        self.burst = burst
+        self.period = period
+        self.level = level
+        self.lock = threading.Lock()
+        # template -> [ window start, records in window, suppressed ]
+        self.windows = {}
+        self.pruned = clock()
+        self.suppressed = 0
+
+    def filter(self, record):
+        if record.levelno >= self.level:
+            return True
+        key = (record.name, record.levelno, record.msg)
+        now = self.clock()
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None or now - window[0] >= self.period:
+                suppressed = 0 if window is None else window[2]
+                if window is None and now - self.pruned >= self.period:
+                    self.prune(now)
+                self.windows[key] = [ now, 1, 0 ]
+            elif window[1] < self.burst:
+                window[1] += 1
+                suppressed = window[2]
+                window[2] = 0
+            else:
+                window[2] += 1
+                self.suppressed += 1
+                return False
+        if suppressed > 0:
+            record.suppressed = suppressed
+        return True
+
+    def prune(self, now):
+        """
+        Drop the windows of templates not logged within period (called with the lock held).
+        """
+        self.windows = dict([ (key, window) for (key, window) in self.windows.items() if now - window[0] < self.period ])
+        self.pruned = now
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves the message formatting to the listener thread.
+    The standard QueueHandler formats every record in the calling thread.
+    """
+
+    def prepare(self, record):
+        return record
+
+class RingBufferHandler(logging.Handler):
+    """
+    Keep the formatted records in a bounded in-memory buffer and append them to a
+    file every interval seconds, when a record of flush_level or higher arrives
+    or on close(). The oldest records are dropped if the buffer is full.
+    """
+
+    def __init__(self, file_name, capacity=5000, interval=300.0, flush_level=logging.ERROR):
+        logging.Handler.__init__(self)
+        self.file_name = file_name
+        self.capacity = capacity
+        self.interval = interval
+        self.flush_level = flush_level
+        self.buffer = collections.deque(maxlen=capacity)
+        self.last_flush = time.monotonic()
+        self.flushes = 0
+        self.dropped = 0
+
+    def emit(self, record):
+        try:
+            text = self.format(record)
+            if getattr(record, 'suppressed', 0) > 0:
+                text += ' ({0} similar messages suppressed)'.format(record.suppressed)
+        except Exception:
+            self.handleError(record)
+            return
+        if len(self.buffer) == self.capacity:
+            self.dropped += 1
+            metrics.registry.inc('log_dropped_total')
+        self.buffer.append(text)
+        if record.levelno >= self.flush_level or time.monotonic() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Append the buffered records to the file with a single write.
+        """
+        self.acquire()
+        try:
+            self.last_flush = time.monotonic()
+            if len(self.buffer) == 0 or self.file_name is None:
+                return
+            lines = list(self.buffer)
+            self.buffer.clear()
+            with open(self.file_name, 'a') as f:
+                f.write('\n'.join(lines) + '\n')
+            self.flushes += 1
+            metrics.registry.inc('log_flushes_total')
+        except OSError as e:
+            sys.stderr.write('writing log {0} failed: {1}\n'.format(self.file_name, e))
+        finally:
+            self.release()
+
+    def close(self):
+        self.flush()
+        logging.Handler.close(self)
+
+class AsyncLogging:
+    """
+    Route all records of the root logger through a queue to a background thread
+    that formats them into a RingBufferHandler (and optionally to stderr).
+    Records below WARNING are rate limited per message template before they are queued.
+    """
+
+    def __init__(self, file_name, capacity=5000, interval=300.0, burst=5, period=60.0, console=False,
+                 format='%(asctime)s %(levelname)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S'):
+        self.queue = queue.SimpleQueue()
+        self.ring = RingBufferHandler(file_name, capacity=capacity, interval=interval)
+        self.ring.setFormatter(logging.Formatter(format, datefmt))
+        handlers = [ self.ring ]
+        if console:
+            stream = logging.StreamHandler()
+            stream.setFormatter(logging.Formatter(format, datefmt))
+            handlers.append(stream)
+        self.handler = LazyQueueHandler(self.queue)
+        self.rate_limit = RateLimitFilter(burst, period)
+        self.handler.addFilter(self.rate_limit)
+        self.listener = logging.handlers.QueueListener(self.queue, *handlers)
+        self.replaced = []
+
+    def start(self):
+        """
+        Replace the handlers of the root logger by the queue handler.
+        """
+        root = logging.getLogger()
+        self.replaced = list(root.handlers)
+        for handler in self.replaced:
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        self.listener.start()
+        return self
+
+    def stop(self):
+        """
+        Write the queued and buffered records and restore the previous handlers.
+        """
+        root = logging.getLogger()
+        root.removeHandler(self.handler)
+        self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.close()
+        for handler in self.replaced:
+            root.addHandler(handler)
+        self.replaced = []
+
+def benchmark(file_name, count=100000, logger_name='benchmark'):
+    """
+    Time log calls like the render path (changing arguments) with a FileHandler
+    and with the queue and ring buffer (without rate limiting).
+    Returns the time per call in seconds and the number of file writes.
+    """
+    log = logging.getLogger(logger_name)
+    log.setLevel(logging.INFO)
+    log.propagate = False
+    result = {}
+
+    handler = logging.FileHandler(file_name)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    log.addHandler(handler)
+    start = time.perf_counter()
+    for i in range(count):
+        log.info('render time {0}:{1:02d}'.format(i // 60 % 24, i % 60))
+    result['file'] = (time.perf_counter() - start) / count
+    result['file_writes'] = count
+    log.removeHandler(handler)
+    handler.close()
+
+    logging_ = AsyncLogging(file_name, capacity=count, interval=3600.0, burst=count)
+    log.propagate = True
+    root = logging.getLogger()
+    level = root.level
+    root.setLevel(logging.INFO)
+    logging_.start()
+    start = time.perf_counter()
+    for i in range(count):
+        log.info('render time %d:%02d', i // 60 % 24, i % 60)
+    result['async'] = (time.perf_counter() - start) / count
+    logging_.stop()
+    root.setLevel(level)
+    result['async_writes'] = logging_.ring.flushes
+    return result
+
+if __name__ == '__main__':
+    import argparse
+
+    self = os.path.basename(sys.argv[0])
+    myName = os.path.splitext(self)[0]
+    log = logging.getLogger(myName)
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+    parser = argparse.ArgumentParser(description='logging overhead with and without the queue and ring buffer')
+    parser.add_argument('-d', '--debug', action='store_true', help='debug execution')
+    parser.add_argument('-f', '--file', default='/tmp/logbuffer-benchmark.log', help='log file')
+    parser.add_argument('-n', '--count', type=int, default=100000, help='number of log calls')
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.debug:
+        log.setLevel(logging.DEBUG)
+    else:
+        log.setLevel(logging.INFO)
+    result = benchmark(args.file, args.count)
+    print('file handler {0:8.3f} us per call, {1} writes'.format(result['file'] * 1e6, result['file_writes']))
+    print('async        {0:8.3f} us per call, {1} writes'.format(result['async'] * 1e6, result['async_writes']))
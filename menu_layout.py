@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import logging
+import os
+import sys
+import time
+
+import pygame
+
+class MenuLayout:
+    """
+    Geometry of one menu: element rectangles, a name index and a grid of screen
+    cells for hit-tests. The geometry is computed once and only recomputed after
+    invalidate() (label or element changes), not on every redraw.
+    """
+
+    def __init__(self, elements, font, size, dx=24, cell=32, logger=None):
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger(__name__)
+        self.elements = elements
+        self.font = font
+        (self.w, self.h) = size
+        self.dx = dx
+        self.cell = cell
+        # name -> position in the menu
+        self.index = {}
+        # element position -> rectangle
+        self.rects = {}
+        # drawing list of (element position, label or None for icons)
+        self.items = []
+        # (column, row) -> element positions in menu order
+        self.grid = {}
+        self.row = None
+        self.valid = False
+        self.layouts = 0
+
+    def invalidate(self):
+        self.valid = False
+
+    def update(self):
+        """
+        Recompute the geometry if the menu was changed since the last layout.
+        """
+        if self.valid:
+            return False
+        self.layout()
+        return True
+
+    def label(self, elem):
+        if 'label' in elem.keys():
+            return elem['label']
+        return elem['name']
+
+    def layout(self):
+        """
+        Lay out the elements: elements without 'pos' are centered as a row at the
+        bottom, elements with 'pos' are placed at their (relative or absolute) position.
+        """
+        self.index = {}
+        for i in range(len(self.elements)):
+            self.index.setdefault(self.elements[i]['name'], i)
+        s = self.font.size('ABC')
+        y = round(0.925 * self.h)
+        self.row = pygame.Rect(0, y - s[1] / 2 - 2, self.w, s[1] + 4)
+        sizes = []
+        w = 0
+        for elem in self.elements:
+            size = None
+            if 'icon' in elem.keys():
+                size = elem['icon'].get_size()
+            elif self.label(elem) != 'NONE':
+                size = self.font.size(self.label(elem))
+            sizes.append(size)
+            if 'pos' in elem.keys() or size is None:
+                continue
+            if size[0] > 0:
+                w += size[0] + self.dx
+        x = round(0.5 * self.w - (w - self.dx) / 2)
+        self.rects = {}
+        self.items = []
+        for i in range(len(self.elements)):
+            elem = self.elements[i]
+            if 'pos' in elem.keys():
+                x = elem['pos'][0]
+                if x < 1.0:
+                    x *= self.w
+                y = elem['pos'][1]
+                if y < 1.0:
+                    y *= self.h
+            size = sizes[i]
+            if size is None:
+                # touch areas set from outside (set_rect) are kept
+                if 'rect' in elem.keys():
+                    self.rects[i] = elem['rect']
+                continue
+            if 'icon' in elem.keys():
+                rect = pygame.Rect(x - size[0] / 2, y - size[1] / 2, size[0], size[1])
+                self.items.append((i, None))
+            else:
+                align = elem.get('align', 'cc')
+                tx = x
+                if align[0] == 'c':
+                    tx -= size[0] / 2
+                elif align[0] == 'r':
+                    tx -= size[0]
+                ty = y
+                if align[1] == 'c':
+                    ty -= size[1] / 2
+                elif align[1] == 't':
+                    ty -= size[1]
+                rect = pygame.Rect(tx, ty, size[0], size[1])
+                self.items.append((i, self.label(elem)))
+            self.rects[i] = rect
+            elem['rect'] = rect
+            x += size[0] + self.dx
+        self.build_grid()
+        self.valid = True
+        self.layouts += 1
+        self.log.debug('menu layout {0} elements {1} rects'.format(len(self.elements), len(self.rects)))
+
+    def build_grid(self):
+        """
+        Register every element rectangle in all grid cells it touches.
+        """
+        self.grid = {}
+        for i in sorted(self.rects.keys()):
+            rect = self.rects[i]
+            if rect.w <= 0 or rect.h <= 0:
+                continue
+            for cx in range(rect.left // self.cell, (rect.right - 1) // self.cell + 1):
+                for cy in range(rect.top // self.cell, (rect.bottom - 1) // self.cell + 1):
+                    self.grid.setdefault((cx, cy), []).append(i)
+
+    def get(self, name):
+        """
+        Get a menu element by name or None.
+        """
+        self.update()
+        i = self.index.get(name)
+        if i is None:
+            return None
+        return self.elements[i]
+
+    def get_index(self, name):
+        self.update()
+        return self.index.get(name)
+
+    def set_rect(self, name, rect):
+        """
+        Set the touch area of an element drawn outside of the menu row (e.g. the time digits).
+        """
+        self.update()
+        i = self.index.get(name)
+        if i is None:
+            return None
+        rect = pygame.Rect(rect)
+        self.elements[i]['rect'] = rect
+        if self.rects.get(i) != rect:
+            self.rects[i] = rect
+            self.build_grid()
+        return rect
+
+    def hit(self, pos):
+        """
+        Get the first element (in menu order) at a screen position or None.
+        """
+        self.update()
+        for i in self.grid.get((int(pos[0]) // self.cell, int(pos[1]) // self.cell), []):
+            if self.rects[i].collidepoint(pos):
+                return self.elements[i]
+        return None
+
+    def render(self, screen, font, bg_color, default_color):
+        """
+        Draw the menu elements, returns the changed screen area.
+        """
+        self.update()
+        dirty = screen.fill(bg_color, self.row)
+        for (i, label) in self.items:
+            elem = self.elements[i]
+            rect = self.rects[i]
+            if label is None:
+                screen.blit(elem['icon'], rect)
+            else:
+                color = elem.get('color', default_color)
+                screen.fill(bg_color, rect)
+                screen.blit(font.render(label, True, color), rect)
+            dirty.union_ip(rect)
+        return dirty
+
+def benchmark(menu_file, height=480, count=1000, logger=None):
+    """
+    Compare a full relayout with linear hit-tests (as done on every render_bottom
+    before) against the cached layout with grid hit-tests.
+    Returns times per hit-test and per relayout in seconds.
+    """
+    import json
+    import random
+
+    pygame.init()
+    size = (round(height * 5 / 3), height)
+    pygame.display.set_mode(size)
+    font = pygame.font.Font(None, round(height * 0.08))
+    with open(menu_file) as f:
+        elements = json.load(f)
+    for elem in elements:
+        if 'icon' in elem.keys():
+            elem['icon'] = pygame.transform.scale(pygame.image.load(elem['icon']), tuple(elem.get('size', (48, 48))))
+    elements.append({ 'name': 'station', 'label': 'WDR2', 'pos': (0.08, 0.925), 'align': 'lc' })
+    elements.append({ 'name': 'alarm', 'label': '7:00', 'pos': (0.925, 0.925), 'align': 'rc' })
+    layout = MenuLayout(elements, font, size, logger=logger)
+    layout.update()
+    positions = [ (random.randrange(size[0]), random.randrange(round(0.85 * height), height)) for i in range(count) ]
+    start = time.perf_counter()
+    for pos in positions:
+        for elem in elements:
+            if 'rect' in elem.keys() and elem['rect'].collidepoint(pos):
+                break
+    linear_time = (time.perf_counter() - start) / count
+    start = time.perf_counter()
+    for pos in positions:
+        layout.hit(pos)
+    grid_time = (time.perf_counter() - start) / count
+    start = time.perf_counter()
+    for i in range(count):
+        layout.invalidate()
+        layout.update()
+    layout_time = (time.perf_counter() - start) / count
+    start = time.perf_counter()
+    for i in range(count):
+        layout.update()
+    cached_time = (time.perf_counter() - start) / count
+    pygame.quit()
+    return { 'linear': linear_time, 'grid': grid_time, 'layout': layout_time, 'cached': cached_time }
+
+if __name__ == '__main__':
+    import argparse
+
+    self = os.path.basename(sys.argv[0])
+    myName = os.path.splitext(self)[0]
+    log = logging.getLogger(myName)
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+    parser = argparse.ArgumentParser(description='menu layout benchmark')
+    parser.add_argument('-d', '--debug', action='store_true', help='debug execution')
+    parser.add_argument('-m', '--menu', default='menu_bottom.json', help='menu file')
+    parser.add_argument('-n', '--count', type=int, default=10000, help='number of hit-tests and layouts')
+    parser.add_argument('--height', type=int, default=480, help='screen height')
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.debug:
+        log.setLevel(logging.DEBUG)
+    else:
+        log.setLevel(logging.INFO)
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    result = benchmark(args.menu, args.height, args.count, logger=log)
+    print('hit-test linear {0:8.3f} us'.format(result['linear'] * 1e6))
+    print('hit-test grid   {0:8.3f} us'.format(result['grid'] * 1e6))
+    print('relayout        {0:8.3f} us'.format(result['layout'] * 1e6))
+    print('cached layout   {0:8.3f} us'.format(result['cached'] * 1e6))
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import datetime
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+HELP = {
+    'loop_seconds': 'main loop iteration time without waiting',
+    'render_seconds': 'render time per screen region',
+    'flush_seconds': 'display update time',
+    'flush_pixels_total': 'pixels pushed to the display',
+    'iobroker_request_seconds': 'ioBroker request latency',
+    'iobroker_failures_total': 'failed ioBroker requests',
+    'subprocess_spawns_total': 'started external processes',
+    'backlight_writes_total': 'backlight brightness writes',
+    'volume_writes_total': 'mixer volume writes',
+    'startup_seconds': 'startup time per phase',
+    'log_flushes_total': 'log buffer writes to the log file',
+    'log_dropped_total': 'log records dropped from the full log buffer',
+    'state_changes_total': 'changed user settings',
+    'state_writes_total': 'state file writes',
+    'alarm_audio_seconds': 'time from alarm to first audio',
+    'alarm_audio_failures_total': 'alarms without audio before the deadline',
+    'stream_probe_seconds': 'stream time to first byte',
+    'stream_probe_failures_total': 'failed stream probes',
+}
+
+def escape(value, quote=True):
+    """
+    Escape a label value (or HELP text without quote) for the Prometheus text format.
+    """
+    value = str(value).replace('\\', '\\\\').replace('\n', '\\n')
+    if quote:
+        value = value.replace('"', '\\"')
+    return value
+
+class Metrics:
+    """
+    Thread safe registry of counters and histograms, optionally with labels.
+    Histograms have fixed (Prometheus style cumulative) buckets in seconds.
+    """
+
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, prefix='alarmclock', buckets=BUCKETS):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.started = time.time()
+
+    def key(self, name, labels):
+        return (name, tuple(sorted(labels.items())))
+
+    def inc(self, name, value=1, **labels):
+        """
+        Increase a counter.
+        """
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """
+        Add a value (seconds) to a histogram.
+        """
+        key = self.key(name, labels)
+        with self.lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = { 'buckets': [ 0 ] * len(self.buckets), 'count': 0, 'sum': 0.0, 'max': 0.0 }
+                self.histograms[key] = h
+            for i in range(len(self.buckets)):
+                if value <= self.buckets[i]:
+                    h['buckets'][i] += 1
+                    break
+            h['count'] += 1
+            h['sum'] += value
+            h['max'] = max(h['max'], value)
+
+    def timed(self, name, **labels):
+        """
+        Decorator recording the run time of a function in a histogram.
+        """
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - start, **labels)
+            return wrapper
+        return decorate
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+            self.started = time.time()
+
+    def series(self, name, labels, extra=None):
+        labels = list(labels)
+        if not extra is None:
+            labels.append(extra)
+        if len(labels) == 0:
+            return name
+        return '{0}{{{1}}}'.format(name, ','.join([ '{0}="{1}"'.format(k, escape(v)) for (k, v) in labels ]))
+
+    def snapshot(self):
+        """
+        Get all metrics as a JSON serializable dictionary.
+        """
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = dict([ (key, dict(h, buckets=list(h['buckets']))) for (key, h) in self.histograms.items() ])
+        result = { 'time': datetime.datetime.now().isoformat(), 'uptime': time.time() - self.started, 'counters': {}, 'histograms': {} }
+        for ((name, labels), value) in sorted(counters.items()):
+            result['counters'][self.series(name, labels)] = value
+        for ((name, labels), h) in sorted(histograms.items()):
+            buckets = {}
+            total = 0
+            for (le, n) in zip(self.buckets, h['buckets']):
+                total += n
+                buckets[str(le)] = total
+            result['histograms'][self.series(name, labels)] = { 'count': h['count'], 'sum': h['sum'], 'mean': h['sum'] / max(h['count'], 1), 'max': h['max'], 'buckets': buckets }
+        return result
+
+    def prometheus(self):
+        """
+        Get all metrics in the Prometheus text exposition format.
+        """
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = dict([ (key, dict(h, buckets=list(h['buckets']))) for (key, h) in self.histograms.items() ])
+        lines = []
+        described = set()
+        def describe(name, kind):
+            if name in described:
+                return
+            described.add(name)
+            if name in HELP:
+                lines.append('# HELP {0}_{1} {2}'.format(self.prefix, name, escape(HELP[name], quote=False)))
+            lines.append('# TYPE {0}_{1} {2}'.format(self.prefix, name, kind))
+        for ((name, labels), value) in sorted(counters.items()):
+            describe(name, 'counter')
+            lines.append('{0} {1}'.format(self.series(self.prefix + '_' + name, labels), value))
+        for ((name, labels), h) in sorted(histograms.items()):
+            describe(name, 'histogram')
+            series = self.prefix + '_' + name
+            total = 0
+            for (le, n) in zip(self.buckets, h['buckets']):
+                total += n
+                lines.append('{0} {1}'.format(self.series(series + '_bucket', labels, ('le', le)), total))
+            lines.append('{0} {1}'.format(self.series(series + '_bucket', labels, ('le', '+Inf')), h['count']))
+            lines.append('{0} {1}'.format(self.series(series + '_sum', labels), h['sum']))
+            lines.append('{0} {1}'.format(self.series(series + '_count', labels), h['count']))
+        lines.append('# TYPE {0}_uptime_seconds gauge'.format(self.prefix))
+        lines.append('{0}_uptime_seconds {1:.1f}'.format(self.prefix, time.time() - self.started))
+        return '\n'.join(lines) + '\n'
+
+# registry shared by all modules of the process
+registry = Metrics()
+
+class Stopwatch:
+    """
+    Time consecutive phases (e.g. of the startup), each phase is added to a histogram.
+    """
+
+    def __init__(self, name='startup_seconds', start=None, metrics=None):
+        if metrics is None:
+            metrics = registry
+        self.metrics = metrics
+        self.name = name
+        if start is None:
+            start = time.perf_counter()
+        self.start = start
+        self.last = start
+        self.phases = []
+
+    def lap(self, phase):
+        """
+        End a phase, returns its duration in seconds.
+        """
+        now = time.perf_counter()
+        duration = now - self.last
+        self.last = now
+        self.phases.append((phase, duration))
+        self.metrics.observe(self.name, duration, phase=phase)
+        return duration
+
+    def total(self):
+        return self.last - self.start
+
+    def summary(self):
+        return ', '.join([ '{0} {1:.3f}s'.format(phase, duration) for (phase, duration) in self.phases ] + [ 'total {0:.3f}s'.format(self.total()) ])
+
+class MetricsServer(object):
+    """
+    Local HTTP endpoint with the metrics in Prometheus format (/metrics) and as JSON (/stats.json).
+    """
+
+    def __init__(self, port=9105, host='127.0.0.1', metrics=None, logger=None):
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger(__name__)
+        import http.server
+
+        if metrics is None:
+            metrics = registry
+        self.metrics = metrics
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def log_message(self, format, *args):
+                server.log.debug(format % args)
+
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body = server.metrics.prometheus().encode('utf-8')
+                    content_type = 'text/plain; version=0.0.4'
+                elif self.path == '/stats.json':
+                    body = json.dumps(server.metrics.snapshot()).encode('utf-8')
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.url = 'http://{0}:{1}/metrics'.format(host, self.port)
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True)
+        self.thread.start()
+        self.log.info('metrics on {0}'.format(self.url))
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class StatsWriter(threading.Thread):
+    """
+    Write the metrics snapshot to a JSON file every interval seconds (replaced atomically).
+    """
+
+    def __init__(self, file_name, interval=60, metrics=None, logger=None):
+        threading.Thread.__init__(self, name='stats-writer', daemon=True)
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger(__name__)
+        if metrics is None:
+            metrics = registry
+        self.metrics = metrics
+        self.file_name = file_name
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def write(self):
+        tmp = self.file_name + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(self.metrics.snapshot(), f, indent=2)
+            os.replace(tmp, self.file_name)
+        except OSError as e:
+            self.log.error('writing stats to {0} failed: {1}'.format(self.file_name, e))
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+        self.write()
+
+    def stop(self):
+        self.stopped.set()
+
+if __name__ == '__main__':
+    import argparse
+    import random
+
+    self = os.path.basename(sys.argv[0])
+    myName = os.path.splitext(self)[0]
+    log = logging.getLogger(myName)
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+    parser = argparse.ArgumentParser(description='metrics endpoint with random sample data')
+    parser.add_argument('-d', '--debug', action='store_true', help='debug execution')
+    parser.add_argument('-p', '--port', type=int, default=9105, help='listen port')
+    parser.add_argument('-t', '--time', type=float, default=60.0, help='run time in seconds')
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.debug:
+        log.setLevel(logging.DEBUG)
+    else:
+        log.setLevel(logging.INFO)
+    server = MetricsServer(args.port, logger=log).start()
+    end = time.time() + args.time
+    while time.time() < end:
+        registry.observe('loop_seconds', random.expovariate(200))
+        registry.observe('render_seconds', random.expovariate(500), region='time')
+        registry.inc('backlight_writes_total')
+        time.sleep(0.1)
+    server.stop()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import logging
+import math
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+
+import metrics
+
+class Mixer:
+    """
+    Base class for volume controls (0 - max_volume %).
+    The current level is cached, unchanged levels are not written.
+    """
+
+    # the vol+ key goes up to 160 % like with amixer before, amixer limits the hardware level itself
+    max_volume = 160
+
+    def __init__(self, control='PCM,0', logger=None):
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger(__name__)
+        (self.control, _, index) = control.partition(',')
+        self.index = int(index or 0)
+        self.level = None
+        self.writes = 0
+
+    def get_volume(self):
+        """
+        Get the current volume in percent.
+        """
+        if self.level is None:
+            self.level = self.read()
+        return self.level
+
+    def set_volume(self, value):
+        """
+        Set the volume in percent.
+        """
+        value = max(0, min(self.max_volume, int(round(value))))
+        if value == self.get_volume():
+            return False
+        self.write(value)
+        self.level = value
+        self.writes += 1
+        metrics.registry.inc('volume_writes_total')
+        return True
+
+    def read(self):
+        return 0
+
+    def write(self, value):
+        pass
+
+class FakeMixer(Mixer):
+    """
+    In-memory mixer for development systems and tests.
+    """
+
+    def __init__(self, control='PCM,0', logger=None, level=50):
+        Mixer.__init__(self, control, logger)
+        self.hardware_level = level
+        self.history = []
+
+    def read(self):
+        return self.hardware_level
+
+    def write(self, value):
+        self.hardware_level = value
+        self.history.append((time.time(), value))
+
+class AlsaMixer(Mixer):
+    """
+    Mixer kept open in-process with pyalsaaudio (python3-alsaaudio).
+    """
+
+    # setvolume() rejects levels above 100
+    max_volume = 100
+
+    def __init__(self, control='PCM,0', logger=None):
+        Mixer.__init__(self, control, logger)
+        import alsaaudio
+        self.mixer = alsaaudio.Mixer(self.control, self.index)
+
+    def read(self):
+        volumes = self.mixer.getvolume()
+        return round(sum(volumes) / len(volumes))
+
+    def write(self, value):
+        self.mixer.setvolume(value)
+
+class AmixerMixer(Mixer):
+    """
+    Fallback without pyalsaaudio: amixer is only called for reading once and for real changes.
+    """
+
+    def read(self):
+        value = 0
+        metrics.registry.inc('subprocess_spawns_total', command='amixer')
+        output = subprocess.run([ 'amixer', 'get', '{0},{1}'.format(self.control, self.index) ], stdout=subprocess.PIPE).stdout
+        m = re.search(r'(\d+)%', output.decode('utf-8'))
+        if m:
+            value = int(m.group(1))
+        return value
+
+    def write(self, value):
+        metrics.registry.inc('subprocess_spawns_total', command='amixer')
+        subprocess.run([ 'amixer', '-q', 'set', '{0},{1}'.format(self.control, self.index), '{0}%'.format(value) ])
+
+def open_mixer(control='PCM,0', fake=False, logger=None):
+    """
+    Open the best available mixer: pyalsaaudio, amixer or a fake mixer.
+    """
+    if not fake:
+        try:
+            return AlsaMixer(control, logger)
+        except Exception as e:
+            if logger:
+                logger.info('no alsaaudio mixer ({0}), using amixer'.format(e))
+        return AmixerMixer(control, logger)
+    return FakeMixer(control, logger)
+
+class VolumeRamp:
+    """
+    Move the volume from start to end within duration seconds along a curve
+    ('linear', 'log' or 's') with rate steps per second, in its own timer thread.
+    """
+
+    CURVES = {
+        'linear': lambda x: x,
+        # fast rise at the beginning, slow at the end
+        'log': lambda x: math.log10(1 + 9 * x),
+        # smooth start and end
+        's': lambda x: x * x * (3 - 2 * x),
+    }
+
+    def __init__(self, mixer, start, end, duration, curve='linear', rate=20, logger=None):
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger(__name__)
+        self.mixer = mixer
+        self.start_volume = start
+        self.end_volume = end
+        self.duration = max(duration, 0.001)
+        if not curve in self.CURVES:
+            self.log.warning('unknown volume curve {0}, using linear'.format(curve))
+            curve = 'linear'
+        self.curve = self.CURVES[curve]
+        self.rate = rate
+        self.started = None
+        self.stopped = threading.Event()
+        # held while writing a step, so no step is written after stop() returned
+        self.lock = threading.RLock()
+        self.thread = None
+
+    def value(self, elapsed):
+        """
+        Get the volume after elapsed seconds.
+        """
+        x = max(0.0, min(1.0, elapsed / self.duration))
+        return self.start_volume + (self.end_volume - self.start_volume) * self.curve(x)
+
+    def start(self):
+        """
+        Start the ramp in a timer thread.
+        """
+        self.started = time.monotonic()
+        self.mixer.set_volume(self.start_volume)
+        self.thread = threading.Thread(target=self.run, name='volume-ramp', daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self):
+        step = 1.0 / self.rate
+        while not self.stopped.wait(step):
+            elapsed = time.monotonic() - self.started
+            with self.lock:
+                if self.stopped.is_set():
+                    break
+                self.mixer.set_volume(self.value(elapsed))
+            if elapsed >= self.duration:
+                break
+        self.log.debug('volume ramp finished at %s%%', self.mixer.get_volume())
+
+    def stop(self, timeout=1.0):
+        """
+        Stop the ramp at the current volume and wait for the timer thread.
+        """
+        with self.lock:
+            self.stopped.set()
+        if not self.thread is None and not self.thread is threading.current_thread():
+            self.thread.join(timeout)
+
+    def running(self):
+        return not self.thread is None and self.thread.is_alive()
+
+if __name__ == '__main__':
+    import argparse
+
+    self = os.path.basename(sys.argv[0])
+    myName = os.path.splitext(self)[0]
+    log = logging.getLogger(myName)
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+    parser = argparse.ArgumentParser(description='mixer volume ramp')
+    parser.add_argument('-d', '--debug', action='store_true', help='debug execution')
+    parser.add_argument('-c', '--control', default='PCM,0', help='mixer control')
+    parser.add_argument('--curve', default='linear', help='ramp curve (linear, log, s)')
+    parser.add_argument('--fake', action='store_true', help='use a fake mixer')
+    parser.add_argument('-t', '--time', type=float, default=10.0, help='ramp duration in seconds')
+    parser.add_argument('start', type=int, help='start volume')
+    parser.add_argument('end', type=int, help='end volume')
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.debug:
+        log.setLevel(logging.DEBUG)
+    else:
+        log.setLevel(logging.INFO)
+    mixer = open_mixer(args.control, args.fake, logger=log)
+    ramp = VolumeRamp(mixer, args.start, args.end, args.time, args.curve, logger=log).start()
+    ramp.thread.join()
+    print('{0} volume writes'.format(mixer.writes))
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import bisect
+import collections
+import json
+import logging
+import os
+import re
+import sys
+import time
+
+# characters with a meaning in regular expressions
+REGEX_SPECIAL = '.^$*+?{}[]()|\\'
+
+def literal_prefix(pattern):
+    """
+    Get the text every id matched by re.match(pattern, id) starts with ('' if unknown).
+    """
+    if '|' in pattern:
+        return ''
+    prefix = []
+    i = 1 if pattern.startswith('^') else 0
+    while i < len(pattern):
+        c = pattern[i]
+        step = 1
+        if c == '\\':
+            # escaped punctuation is literal, classes like \d end the prefix
+            if i + 1 < len(pattern) and not pattern[i + 1].isalnum():
+                c = pattern[i + 1]
+                step = 2
+            else:
+                break
+        elif c in REGEX_SPECIAL:
+            break
+        # a following quantifier makes the character optional
+        if i + step < len(pattern) and pattern[i + step] in '*?{':
+            break
+        prefix.append(c)
+        i += step
+    return ''.join(prefix)
+
+def prefix_end(prefix):
+    """
+    Get the smallest string greater than all strings starting with prefix.
+    """
+    return prefix + '\U0010ffff'
+
+class ObjectCatalog:
+    """
+    Compact catalog of the ioBroker object tree for pattern queries.
+    The dotted ids are kept in one sorted list and each object as compact JSON text
+    in a parallel list (decoded on demand): all ids below a prefix ('hm-rpc.0.')
+    form a contiguous range, found with two binary searches like in a prefix trie.
+    A pattern is matched only against the range of its literal prefix, results are
+    cached per pattern until the catalog changes. Ranges can be replaced on their
+    own (incremental refresh of one adapter or device).
+    Results are in the order ioBroker delivered the objects (objects added by a later
+    refresh at the end), like the former walk over the object dictionary.
+    """
+
+    def __init__(self, cache_size=128, logger=None):
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger(__name__)
+        self.ids = []
+        self.blobs = []
+        # position of each object in the ioBroker object list, parallel to ids
+        self.order = []
+        self.sequence = 0
+        self.version = 0
+        self.cache_size = cache_size
+        # pattern -> (catalog version, compiled pattern, matching ids)
+        self.patterns = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(list(self.ids))
+
+    def __contains__(self, object_id):
+        return not self.position(object_id) is None
+
+    def __getitem__(self, object_id):
+        result = self.get(object_id)
+        if result is None:
+            raise KeyError(object_id)
+        return result
+
+    def position(self, object_id):
+        i = bisect.bisect_left(self.ids, object_id)
+        if i < len(self.ids) and self.ids[i] == object_id:
+            return i
+        return None
+
+    def range(self, prefix):
+        """
+        Get the (start, end) positions of the ids starting with prefix.
+        """
+        if prefix == '':
+            return (0, len(self.ids))
+        return (bisect.bisect_left(self.ids, prefix), bisect.bisect_left(self.ids, prefix_end(prefix)))
+
+    def get(self, object_id):
+        """
+        Get an object or None.
+        """
+        i = self.position(object_id)
+        if i is None:
+            return None
+        return json.loads(self.blobs[i])
+
+    def replace(self, objects, prefix=''):
+        """
+        Replace all objects with ids starting with prefix by objects (dictionary id -> object).
+        Objects outside of the prefix are ignored.
+        """
+        start = time.perf_counter()
+        (lo, hi) = self.range(prefix)
+        # known objects keep their position, new ones are appended
+        known = dict(zip(self.ids[lo:hi], self.order[lo:hi]))
+        entries = []
+        for (id, obj) in objects.items():
+            if not id.startswith(prefix):
+                continue
+            if not id in known:
+                known[id] = self.sequence
+                self.sequence += 1
+            entries.append((id, json.dumps(obj, separators=(',', ':')), known[id]))
+        entries.sort()
+        # new lists, readers in other threads keep working on the old ones
+        ids = self.ids[:lo] + [ entry[0] for entry in entries ] + self.ids[hi:]
+        blobs = self.blobs[:lo] + [ entry[1] for entry in entries ] + self.blobs[hi:]
+        order = self.order[:lo] + [ entry[2] for entry in entries ] + self.order[hi:]
+        (self.ids, self.blobs, self.order) = (ids, blobs, order)
+        self.version += 1
+        self.patterns.clear()
+        self.log.debug('catalog %r: %d objects replaced by %d in %.3fs', prefix, hi - lo, len(entries), time.perf_counter() - start)
+        return len(entries)
+
+    def match(self, pattern):
+        """
+        Get the ids matching the regular expression (re.match) in ioBroker order.
+        """
+        entry = self.patterns.get(pattern)
+        if not entry is None and entry[0] == self.version:
+            self.patterns.move_to_end(pattern)
+            self.hits += 1
+            return entry[2]
+        self.misses += 1
+        (version, ids, order) = (self.version, self.ids, self.order)
+        regex = re.compile(pattern)
+        prefix = literal_prefix(pattern)
+        (lo, hi) = (0, len(ids))
+        if prefix != '':
+            (lo, hi) = (bisect.bisect_left(ids, prefix), bisect.bisect_left(ids, prefix_end(prefix)))
+        found = [ (order[i], ids[i]) for i in range(lo, hi) if regex.match(ids[i]) ]
+        found.sort()
+        result = [ id for (position, id) in found ]
+        self.patterns[pattern] = (version, regex, result)
+        if len(self.patterns) > self.cache_size:
+            self.patterns.popitem(last=False)
+        return result
+
+    def objects(self, pattern):
+        """
+        Get the objects with ids matching the regular expression.
+        """
+        return [ self.get(id) for id in self.match(pattern) ]
+
+def synthetic_objects(count=30000):
+    """
+    Build an object tree like a larger ioBroker installation (devices with channels and states).
+    """
+    adapters = [ 'hm-rpc.0', 'hm-rpc.1', 'zigbee.0', 'fritzdect.0', 'javascript.0', 'system.adapter', 'alias.0', '0_userdata.0' ]
+    states = [ 'TEMPERATURE', 'HUMIDITY', 'LEVEL', 'STATE', 'UNREACH', 'LOWBAT', 'RSSI' ]
+    objects = {}
+    i = 0
+    while len(objects) < count:
+        adapter = adapters[i % len(adapters)]
+        device = '{0}.DEV{1:05d}'.format(adapter, i // len(adapters))
+        for channel in range(3):
+            for state in states:
+                id = '{0}.{1}.{2}'.format(device, channel, state)
+                objects[id] = {
+                    '_id': id,
+                    'type': 'state',
+                    'common': { 'name': '{0} {1}'.format(device, state), 'role': 'value', 'type': 'number', 'read': True, 'write': False, 'unit': '' },
+                    'native': { 'channel': channel, 'control': state },
+                    'from': 'system.adapter.{0}'.format(adapter),
+                    'user': 'system.user.admin',
+                    'ts': 1760000000000 + i,
+                    'acl': { 'object': 1636, 'state': 1636, 'owner': 'system.user.admin', 'ownerGroup': 'system.group.administrator' },
+                }
+        i += 1
+    return objects
+
+def benchmark(count=30000, queries=1000):
+    """
+    Time pattern queries with re.match over all ids against the catalog
+    (first and cached query) and compare the memory of both representations.
+    Returns times in seconds and sizes in bytes.
+    """
+    import tracemalloc
+
+    text = json.dumps(synthetic_objects(count))
+    patterns = [ r'hm-rpc\.0\.DEV{0:05d}\..*'.format(i) for i in range(queries) ] + [ r'zigbee\.0\..*\.TEMPERATURE$', r'.*\.UNREACH$' ]
+    result = { 'objects': count }
+
+    tracemalloc.start()
+    objects = json.loads(text)
+    result['dict_bytes'] = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    start = time.perf_counter()
+    for pattern in patterns[:20]:
+        [ objects[id] for id in objects if re.match(pattern, id) ]
+    result['walk'] = (time.perf_counter() - start) / 20
+
+    catalog = ObjectCatalog()
+    start = time.perf_counter()
+    catalog.replace(objects)
+    result['build'] = time.perf_counter() - start
+    del objects
+    # what stays after a download was put into the catalog
+    tracemalloc.start()
+    measured = ObjectCatalog()
+    measured.replace(json.loads(text))
+    result['catalog_bytes'] = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del measured
+    start = time.perf_counter()
+    for pattern in patterns[:queries]:
+        catalog.objects(pattern)
+    result['first'] = (time.perf_counter() - start) / queries
+    start = time.perf_counter()
+    for pattern in patterns[:queries]:
+        catalog.objects(pattern)
+    result['cached'] = (time.perf_counter() - start) / queries
+    start = time.perf_counter()
+    catalog.match(patterns[-1])
+    result['full_scan'] = time.perf_counter() - start
+    start = time.perf_counter()
+    catalog.replace(dict([ (id, catalog.get(id)) for id in catalog.match(r'zigbee\.0\.') ]), 'zigbee.0.')
+    result['refresh'] = time.perf_counter() - start
+    return result
+
+if __name__ == '__main__':
+    import argparse
+
+    self = os.path.basename(sys.argv[0])
+    myName = os.path.splitext(self)[0]
+    log = logging.getLogger(myName)
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+    parser = argparse.ArgumentParser(description='object catalog pattern queries on a synthetic object tree')
+    parser.add_argument('-d', '--debug', action='store_true', help='debug execution')
+    parser.add_argument('-n', '--count', type=int, default=30000, help='number of objects')
+    parser.add_argument('-q', '--queries', type=int, default=1000, help='number of device queries')
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.debug:
+        log.setLevel(logging.DEBUG)
+    else:
+        log.setLevel(logging.INFO)
+    result = benchmark(args.count, args.queries)
+    print('{0} objects, dictionary {1:.1f} MB, catalog {2:.1f} MB'.format(result['objects'], result['dict_bytes'] / 1e6, result['catalog_bytes'] / 1e6))
+    print('re.match walk per query  {0:10.3f} ms'.format(result['walk'] * 1000))
+    print('catalog build            {0:10.3f} ms'.format(result['build'] * 1000))
+    print('catalog first query      {0:10.3f} ms'.format(result['first'] * 1000))
+    print('catalog cached query     {0:10.3f} ms'.format(result['cached'] * 1000))
+    print('catalog full scan        {0:10.3f} ms'.format(result['full_scan'] * 1000))
+    print('adapter refresh          {0:10.3f} ms'.format(result['refresh'] * 1000))
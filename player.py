@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import metrics
+
+def resolve_playlist(url, timeout=10):
+    """
+    Get the first stream URL of an .m3u or .pls playlist (or the URL itself).
+    """
+    if not (url.endswith('.m3u') or url.endswith('.pls')):
+        return url
+    import urllib.request
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        text = response.read().decode('utf-8', 'replace')
+    for line in text.splitlines():
+        line = line.strip()
+        if line.lower().startswith('file') and '=' in line:
+            line = line.partition('=')[2].strip()
+        if line.startswith('http://') or line.startswith('https://'):
+            return line
+    return None
+
+class Mpg123Player:
+    """
+    Long-lived mpg123 process in remote control mode (mpg123 -R).
+    Commands are written to its stdin, status lines (@P, @I, @E, ...) are parsed
+    from its stdout by a reader thread. The process is (re)started on demand.
+    """
+
+    STOPPED = 0
+    PAUSED = 1
+    PLAYING = 2
+
+    def __init__(self, command='mpg123', logger=None, on_status=None, on_audio=None):
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger(__name__)
+        if isinstance(command, str):
+            command = command.split()
+        self.command = command + [ '-R' ]
+        self.on_status = on_status
+        # on_audio(seconds since load) is called in the reader thread when the audio starts
+        self.on_audio = on_audio
+        self.process = None
+        self.reader = None
+        self.lock = threading.Lock()
+        self.state = self.STOPPED
+        self.url = None
+        self.info = {}
+        self.error = None
+        self.load_time = None
+        # time of the first decoded frame after the last load
+        self.audio_time = None
+        # URL opened paused by preload(), started by load() of the same URL
+        self.preloaded = None
+        self.resumed = False
+        self.starts = 0
+
+    def running(self):
+        """
+        Check if the mpg123 process is alive.
+        """
+        return not self.process is None and self.process.poll() is None
+
+    def start(self):
+        """
+        Start the mpg123 process if it is not running (called with the command lock held).
+        """
+        if self.running():
+            return
+        self.log.info('starting {0}'.format(' '.join(self.command)))
+        self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=1, universal_newlines=True)
+        self.starts += 1
+        metrics.registry.inc('subprocess_spawns_total', command='mpg123')
+        self.state = self.STOPPED
+        self.reader = threading.Thread(target=self.read_status, args=(self.process,), name='mpg123', daemon=True)
+        self.reader.start()
+        # no frame progress messages, only state changes
+        self.process.stdin.write('SILENCE\n')
+        self.process.stdin.flush()
+
+    def send(self, command):
+        """
+        Send a remote control command, (re)start mpg123 if necessary.
+        """
+        with self.lock:
+            if not self.running():
+                self.start()
+            self.log.debug('mpg123 < %s', command)
+            try:
+                self.process.stdin.write(command + '\n')
+                self.process.stdin.flush()
+            except (BrokenPipeError, OSError) as e:
+                self.log.error('mpg123 command {0} failed: {1}'.format(command, e))
+                return False
+        return True
+
+    def read_status(self, process):
+        """
+        Parse the status output of mpg123 (runs in the reader thread).
+        """
+        for line in process.stdout:
+            line = line.strip()
+            if not line.startswith('@'):
+                continue
+            (tag, _, value) = line[1:].partition(' ')
+            if tag == 'P':
+                try:
+                    self.set_state(int(value.split()[0]))
+                except (ValueError, IndexError):
+                    pass
+                # a preloaded stream plays from the buffer as soon as it is unpaused
+                if self.resumed and self.state == self.PLAYING:
+                    self.resumed = False
+                    self.audio_started()
+            elif tag == 'F' or tag == 'S':
+                # @S: stream format known, @F: frame decoded (only before SILENCE)
+                self.audio_started()
+                if tag == 'S':
+                    self.info['format'] = value
+            elif tag == 'I':
+                (key, _, text) = value.partition(':')
+                self.info[key] = text.strip()
+            elif tag == 'E':
+                self.error = value
+                self.log.error('mpg123 error: {0}'.format(value))
+            else:
+                self.log.debug('mpg123 > %s', line)
+        self.log.info('mpg123 process ended ({0})'.format(process.wait()))
+        if process is self.process:
+            self.set_state(self.STOPPED)
+
+    def audio_started(self):
+        """
+        Remember the time of the first audio after a load (not for preloads).
+        """
+        if not self.audio_time is None or self.load_time is None:
+            return
+        self.audio_time = time.time()
+        self.log.info('mpg123 audio after %.2fs', self.audio_time - self.load_time)
+        if not self.on_audio is None:
+            self.on_audio(self.audio_time - self.load_time)
+
+    def set_state(self, state):
+        if state == self.state:
+            return
+        self.state = state
+        self.log.info('mpg123 state %s', ['stopped', 'paused', 'playing'][state])
+        if not self.on_status is None:
+            self.on_status(state)
+
+    def preload(self, url):
+        """
+        Open a file or stream paused: name lookup, connection and the first data are done
+        before load() of the same URL starts the playback. Playlists are resolved here.
+        """
+        try:
+            stream = resolve_playlist(url)
+        except OSError as e:
+            self.log.error('playlist {0} failed: {1}'.format(url, e))
+            return False
+        if stream is None:
+            self.log.error('no stream in playlist {0}'.format(url))
+            return False
+        self.url = url
+        self.error = None
+        self.info = {}
+        self.audio_time = None
+        self.load_time = None
+        self.resumed = False
+        self.preloaded = url
+        return self.send('LOADPAUSED {0}'.format(stream))
+
+    def load(self, url):
+        """
+        Start playback of a file or stream URL (playlists via LOADLIST).
+        A preloaded URL is only unpaused.
+        """
+        self.error = None
+        self.audio_time = None
+        self.load_time = time.time()
+        if url == self.preloaded and self.state == self.PAUSED:
+            self.preloaded = None
+            self.resumed = True
+            return self.send('PAUSE')
+        self.preloaded = None
+        self.resumed = False
+        self.url = url
+        self.info = {}
+        if url.endswith('.m3u') or url.endswith('.pls'):
+            return self.send('LOADLIST 1 {0}'.format(url))
+        return self.send('LOAD {0}'.format(url))
+
+    def pause(self):
+        """
+        Toggle pause.
+        """
+        return self.send('PAUSE')
+
+    def stop(self):
+        """
+        Stop playback, the process keeps running.
+        """
+        self.preloaded = None
+        self.resumed = False
+        if not self.running():
+            return True
+        return self.send('STOP')
+
+    def volume(self, percent):
+        """
+        Set the mpg123 output volume in percent.
+        """
+        return self.send('VOLUME {0}'.format(round(percent)))
+
+    def quit(self, timeout=2.0):
+        """
+        Terminate the mpg123 process.
+        """
+        if not self.running():
+            return
+        self.send('QUIT')
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.terminate()
+
+class FakePlayer:
+    """
+    Player without audio output for development systems and tests, records the loaded URLs.
+    """
+
+    STOPPED = Mpg123Player.STOPPED
+    PAUSED = Mpg123Player.PAUSED
+    PLAYING = Mpg123Player.PLAYING
+
+    def __init__(self, logger=None, on_status=None, on_audio=None):
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger(__name__)
+        self.on_status = on_status
+        self.on_audio = on_audio
+        self.state = self.STOPPED
+        self.url = None
+        self.error = None
+        self.load_time = None
+        self.audio_time = None
+        self.preloaded = None
+        self.starts = 0
+        self.history = []
+
+    def running(self):
+        return True
+
+    def set_state(self, state):
+        if state == self.state:
+            return
+        self.state = state
+        if not self.on_status is None:
+            self.on_status(state)
+
+    def preload(self, url):
+        self.url = url
+        self.preloaded = url
+        self.history.append((time.time(), 'preload', url))
+        self.set_state(self.PAUSED)
+        return True
+
+    def load(self, url):
+        self.url = url
+        self.preloaded = None
+        self.load_time = time.time()
+        self.audio_time = self.load_time
+        self.history.append((self.load_time, 'load', url))
+        self.set_state(self.PLAYING)
+        if not self.on_audio is None:
+            self.on_audio(0.0)
+        return True
+
+    def pause(self):
+        self.history.append((time.time(), 'pause', self.url))
+        self.set_state(self.PAUSED if self.state == self.PLAYING else self.PLAYING)
+        return True
+
+    def stop(self):
+        self.preloaded = None
+        self.history.append((time.time(), 'stop', self.url))
+        self.set_state(self.STOPPED)
+        return True
+
+    def volume(self, percent):
+        return True
+
+    def quit(self, timeout=2.0):
+        self.set_state(self.STOPPED)
+
+if __name__ == '__main__':
+    import argparse
+
+    self = os.path.basename(sys.argv[0])
+    myName = os.path.splitext(self)[0]
+    log = logging.getLogger(myName)
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+    parser = argparse.ArgumentParser(description='mpg123 remote control player')
+    parser.add_argument('-d', '--debug', action='store_true', help='debug execution')
+    parser.add_argument('--command', default='mpg123', help='player command')
+    parser.add_argument('-t', '--time', type=float, default=10.0, help='playback time in seconds')
+    parser.add_argument('-p', '--preload', type=float, default=0.0, help='open the stream paused this many seconds before playing')
+    parser.add_argument('url', help='file or stream URL')
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.debug:
+        log.setLevel(logging.DEBUG)
+    else:
+        log.setLevel(logging.INFO)
+    player = Mpg123Player(args.command, logger=log)
+    if args.preload > 0:
+        player.preload(args.url)
+        time.sleep(args.preload)
+    player.load(args.url)
+    time.sleep(args.time)
+    player.stop()
+    player.quit()
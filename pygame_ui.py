@@ -9,9 +9,11 @@
 import glob
 import json
 import logging
+import math
 #import multiprocessing
 import os
 import platform
+import time
 #import re
 #import signal
 #import subprocess
@@ -20,17 +22,37 @@ import platform
 import pygame
 from pygame.locals import *
 
+from asset_cache import AssetCache
+from backlight import Backlight
+from menu_layout import MenuLayout
+import metrics
+
+# timer event used to end pygame.event.wait() on pygame 1.x (no timeout argument)
+WAKEUP_EVENT = USEREVENT + 1
+# posted by background threads to wake up the main loop when new data is available
+DATA_EVENT = USEREVENT + 2
+
 class PygameUi:
     """
     Base class for UIs based on pygame
     """
 
-    def __init__(self, size=(800,480), logger=None) :
+    def __init__(self, size=(800,480), logger=None, backlight='/sys/class/backlight/rpi_backlight', lazy=False, cache=None) :
+        """
+        Open the display. Fonts and menus are loaded at once or, if lazy is set,
+        by load_assets() (e.g. after the first frame has been shown).
+        """
         if logger:
             self.log = logger
         else:
             self.log = logging.getLogger(__name__)
 
+        # a sysfs path or an already opened Backlight, e.g. a FakeBacklight
+        if isinstance(backlight, Backlight):
+            self.backlight = backlight
+        else:
+            self.backlight = Backlight(backlight, logger=self.log)
+
         self.bg_color = (0, 0, 0)
         self.default_color = (255, 255, 255)
         self.rotated_display = True
@@ -38,13 +60,7 @@ class PygameUi:
         self.system = platform.machine().lower()
         self.log.info('running on an {0} system'.format(self.system))
         if self.system.startswith('arm'):
-            from evdev import InputDevice, list_devices
-            devices = map(InputDevice, list_devices())
-            eventX = ''
-            for dev in devices:
-                self.log.info('input device {0}'.format(dev.name))
-                if dev.name == "ADS7846 Touchscreen":
-                    eventX = dev.path
+            eventX = self.find_input_device('ADS7846 Touchscreen')
 
             os.environ['SDL_FBDEV'] = '/dev/fb1'
             self.log.info('SDL_FBDEV = {0}'.format(os.environ['SDL_FBDEV']))
@@ -53,7 +69,8 @@ class PygameUi:
             os.environ['SDL_MOUSEDEV'] = eventX
             self.log.info('SDL_MOUSEDEV = {0}'.format(os.environ['SDL_MOUSEDEV']))
 
-        pygame.init()
+        # only the display, other pygame modules (audio, joystick, ...) are initialized on demand
+        pygame.display.init()
 
         self.log.info('Window size: %d x %d' % (size[0], size[1]))
         self.screen = pygame.display.set_mode(size, DOUBLEBUF)
@@ -62,6 +79,8 @@ class PygameUi:
         self.screen.fill(self.bg_color)
         # Initialise font support
         pygame.font.init()
+        # touch movements would only wake up the main loop
+        pygame.event.set_blocked(MOUSEMOTION)
         # Render the screen
         pygame.display.update()
 
@@ -72,14 +91,52 @@ class PygameUi:
         self.log.info('Screen size: %d x %d' % (self.w, self.h))
         self.clock = pygame.time.Clock()
 
+        # dirty screen regions since the last display update
+        self.dirty = []
+        self.flush_count = 0
+        self.flush_pixels = 0
+        self.flush_pixels_total = 0
+
+        if cache is None:
+            cache = AssetCache(None, logger=self.log)
+        self.cache = cache
+        self.text_font = None
+        self.menu = {}
+        self.layouts = {}
+        if not lazy:
+            self.load_assets()
+
+    def find_input_device(self, name):
+        """
+        Get the event device path of an input device from /proc (evdev as fallback).
+        """
+        try:
+            with open('/proc/bus/input/devices') as f:
+                for block in f.read().split('\n\n'):
+                    if not 'N: Name="{0}"'.format(name) in block:
+                        continue
+                    for handler in block.split('Handlers=')[1].split('\n')[0].split():
+                        if handler.startswith('event'):
+                            return '/dev/input/' + handler
+        except (OSError, IndexError):
+            from evdev import InputDevice, list_devices
+            for dev in map(InputDevice, list_devices()):
+                self.log.info('input device {0}'.format(dev.name))
+                if dev.name == name:
+                    return dev.path
+        return ''
+
+    def load_assets(self):
+        """
+        Load the text font and read the menus.
+        """
         if self.system.startswith('arm'):
             self.text_font = pygame.font.Font('/usr/share/fonts/truetype/freefont/FreeSansBold.ttf', round(self.h * 0.08))
-        elif self.system.startswith('amd'):
+        else:
             font_path = pygame.font.match_font('arial')
             self.text_font = pygame.font.Font(font_path, round(self.h * 0.08))
 
-        self.menu = {}
-        for f in glob.glob('menu_*.json'):
+        for f in sorted(glob.glob('menu_*.json')):
             label = os.path.splitext(os.path.basename(f))[0].split('_')[1]
             self.log.info('reading menu {} from {}'.format(label, f))
             self.menu[label] = self.read_menu(f)
@@ -89,31 +146,127 @@ class PygameUi:
         """
         Clear a rectangular area of the screen.
         """
-        self.screen.fill(self.bg_color, rect=(x * self.w, y * self.h, w * self.w, h * self.h))
+        rect = self.screen.fill(self.bg_color, rect=(x * self.w, y * self.h, w * self.w, h * self.h))
+        return self.mark_dirty(rect)
 
-    def get_menu_element(self, menu, name):
+    def mark_dirty(self, rect):
         """
-        Get menu element.
+        Remember a screen region that must be pushed with the next display update.
         """
+        rect = pygame.Rect(rect)
+        self.dirty.append(rect)
+        return rect
 
-        result = None
-        for elem in self.menu[menu]:
-            if elem['name'] == name:
-                result = elem
-                break
+    def merge_rects(self, rects):
+        """
+        Merge overlapping rectangles and clip them to the screen.
+        """
+        screen_rect = self.screen.get_rect()
+        result = []
+        for rect in rects:
+            rect = rect.clip(screen_rect)
+            if rect.w == 0 or rect.h == 0:
+                continue
+            i = rect.collidelist(result)
+            while i >= 0:
+                rect.union_ip(result.pop(i))
+                i = rect.collidelist(result)
+            result.append(rect)
         return result
 
-    def get_menu_element_index(self, menu, name):
+    def update_display(self):
+        """
+        Push the dirty screen regions to the display.
+        Returns the number of flushed pixels.
+        """
+        rects = self.merge_rects(self.dirty)
+        self.dirty = []
+        if len(rects) == 0:
+            return 0
+        start = time.perf_counter()
+        pygame.display.update(rects)
+        metrics.registry.observe('flush_seconds', time.perf_counter() - start)
+        pixels = sum([ r.w * r.h for r in rects ])
+        metrics.registry.inc('flush_pixels_total', pixels)
+        self.flush_count += 1
+        self.flush_pixels = pixels
+        self.flush_pixels_total += pixels
+        self.log.debug('display update %d rects %d pixels (%.1f%%)', len(rects), pixels, 100.0 * pixels / (self.w * self.h))
+        return pixels
+
+    def wait_events(self, timeout):
+        """
+        Block until user input arrives or timeout (datetime.timedelta or seconds) has passed.
+        Returns the list of pending events.
+        """
+        if hasattr(timeout, 'total_seconds'):
+            timeout = timeout.total_seconds()
+        # round up and add a small margin to wake up after (not just before) the deadline
+        ms = max(1, math.ceil(timeout * 1000) + 5)
+        if pygame.version.vernum[0] >= 2:
+            event = pygame.event.wait(ms)
+        else:
+            pygame.time.set_timer(WAKEUP_EVENT, ms)
+            event = pygame.event.wait()
+            pygame.time.set_timer(WAKEUP_EVENT, 0)
+        events = []
+        if not event.type in [ NOEVENT, WAKEUP_EVENT ]:
+            events.append(event)
+        for event in pygame.event.get():
+            if event.type != WAKEUP_EVENT:
+                events.append(event)
+        return events
+
+    def get_layout(self, menu):
+        """
+        Get the (cached) layout of a menu.
+        """
+        if not menu in self.layouts:
+            self.layouts[menu] = MenuLayout(self.menu[menu], self.text_font, (self.w, self.h), logger=self.log)
+        return self.layouts[menu]
+
+    def invalidate_menu(self, menu=None):
+        """
+        Recompute the layout of a menu (all menus if None) before its next use.
+        """
+        for label in self.layouts:
+            if menu is None or label == menu:
+                self.layouts[label].invalidate()
+
+    def add_menu_element(self, menu, elem):
+        """
+        Append an element to a menu.
+        """
+        self.menu[menu].append(elem)
+        self.invalidate_menu(menu)
+
+    def set_menu_label(self, menu, name, label):
+        """
+        Change the label of a menu element, elements shared by several menus are updated everywhere.
+        """
+        elem = self.get_menu_element(menu, name)
+        if elem is None or elem.get('label') == label:
+            return
+        elem['label'] = label
+        self.invalidate_menu()
+
+    def set_menu_rect(self, menu, name, rect):
+        """
+        Set the touch area of a menu element drawn elsewhere.
+        """
+        return self.get_layout(menu).set_rect(name, rect)
+
+    def get_menu_element(self, menu, name):
         """
         Get menu element.
         """
+        return self.get_layout(menu).get(name)
 
-        result = None
-        for i in range(len(self.menu[menu])):
-            if self.menu[menu][i]['name'] == name:
-                result = i
-                break
-        return result
+    def get_menu_element_index(self, menu, name):
+        """
+        Get menu element.
+        """
+        return self.get_layout(menu).get_index(name)
 
     def get_ui_action(self, pos, menus=['bottom']):
         """
@@ -121,13 +274,9 @@ class PygameUi:
         """
         result = None
         for menu in menus:
-            for elem in self.menu[menu]:
-                if not 'rect' in elem.keys():
-                    continue
-                if not elem['rect'].collidepoint(pos):
-                    continue
+            elem = self.get_layout(menu).hit(pos)
+            if not elem is None:
                 result = elem
-                break
         return result
 
     def read_menu(self, file_name):
@@ -144,81 +293,33 @@ class PygameUi:
             if not 'label' in elem.keys() or not elem['label']:
                 elem['label'] = elem['name']
             if 'icon' in elem.keys():
-                elem['icon'] = pygame.image.load(elem['icon'])
-                if 'size' in elem.keys():
-                    elem['icon'] = pygame.transform.scale(elem['icon'], tuple(elem['size']))
+                # pre-scaled icons from the asset cache
+                elem['icon'] = self.cache.image(elem['icon'], elem.get('size'))
         return menu
 
+    @metrics.registry.timed('render_seconds', region='top')
     def render_top(self, date, color):
         """
         Draw the date in the top row above the time.
         """
-        self.log.info('render date {0}'.format(date))
+        self.log.info('render date %s', date)
         s = self.text_font.size(date)
         x = round(0.5 * self.w - s[0] / 2)
         y = round(0.1 * self.h - s[1] / 2)
-        self.log.debug('date p={0},{1},{2}'.format(x, y, s))
-        self.screen.fill(self.bg_color, rect=(0.075 * self.w, y, 0.85 * self.w, s[1]))
+        self.log.debug('date p=%s,%s,%s', x, y, s)
+        rect = self.screen.fill(self.bg_color, rect=(0.075 * self.w, y, 0.85 * self.w, s[1]))
         surface = self.text_font.render(date, True, color)
-        self.screen.blit(surface, (x, y))
-
-    def render_bottom(self, menu='bottom', default_color=(255,255,255), dx=24):
-        """
-        Draw bottom row elements.
-        """
-        s = self.text_font.size('ABC')
-        x = round(0.075 * self.w)
-        y = round(0.925 * self.h)
-        self.screen.fill(self.bg_color, rect=(0, y - s[1] / 2 - 2, self.w, s[1] + 4))
-        self.log.debug('rendering menu {} with {} elements'.format(menu, len(self.menu[menu])))
-        #self.log.debug(json.dumps(self.menu[menu], indent=2, default=str))
-        w = 0
-        for elem in self.menu[menu]:
-            elem_width = 0
-            if 'pos' in elem.keys():
-                continue
-            if 'icon' in elem.keys():
-                elem_width = elem['icon'].get_width()
-            else:
-                if 'label' in elem.keys():
-                    label = elem['label']
-                else:
-                    label = elem['name']
-                if not label == 'NONE':
-                    elem_width = self.text_font.size(label)[0]
-            if elem_width > 0:
-                w += elem_width + dx
-        x = round(0.5 * self.w - (w - dx) / 2)
-        for elem in self.menu[menu]:
-            if 'pos' in elem.keys():
-                x = elem['pos'][0]
-                if x < 1.0:
-                    x *= self.w
-                y = elem['pos'][1]
-                if y < 1.0:
-                    y *= self.h
-            if 'icon' in elem.keys():
-                img = elem['icon']
-                ix = x - img.get_width() / 2
-                iy = y - img.get_height() / 2
-                self.screen.blit(img, (ix, iy))
-                elem['rect'] = pygame.Rect(ix, iy, img.get_width(), img.get_height())
-                x += img.get_width() + dx
-            else:
-                if 'label' in elem.keys():
-                    label = elem['label']
-                else:
-                    label = elem['name']
-                color = (default_color[0], default_color[1], default_color[2])
-                if 'color' in elem.keys():
-                    color = elem['color']
-                align = 'cc'
-                if align in elem.keys():
-                    align = elem['align']
-                if not label == 'NONE':
-                    rect = self.render_text(x, y, label, color=color, align=align)
-                    elem['rect'] = pygame.Rect(rect[0], rect[1], rect[2], rect[3])
-                    x += rect[2] + 24
+        rect.union_ip(self.screen.blit(surface, (x, y)))
+        return self.mark_dirty(rect)
+
+    @metrics.registry.timed('render_seconds', region='bottom')
+    def render_bottom(self, menu='bottom', default_color=(255,255,255)):
+        """
+        Draw bottom row elements, the layout is only recomputed after menu changes.
+        """
+        self.log.debug('rendering menu %s with %d elements', menu, len(self.menu[menu]))
+        dirty = self.get_layout(menu).render(self.screen, self.text_font, self.bg_color, tuple(default_color))
+        return self.mark_dirty(dirty)
 
     def render_text(self, x, y, text, color=None, align='cc'):
         """
@@ -244,29 +345,22 @@ class PygameUi:
         self.screen.fill(self.bg_color, rect=(tx, ty, s[0], s[1]))
         surface = self.text_font.render(text, True, color)
         self.screen.blit(surface, (tx, ty))
-        return (tx, ty, s[0], s[1])
+        return self.mark_dirty((tx, ty, s[0], s[1]))
 
-    def set_brightness(self, value):
+    def set_brightness(self, value, duration=0):
         """
-        Set the the panel brightness to value (0- 255).
+        Set the the panel brightness to value (0- 255), fade within duration seconds.
+        A running fade is stopped.
         """
-        self.log.info('set_brightness({0})'.format(value))
-        current_brightness = self.get_brightness()
-        if value == current_brightness:
-            return
-        if not os.path.exists('/sys/class/backlight/rpi_backlight/brightness'):
-            return
-        with open('/sys/class/backlight/rpi_backlight/brightness', 'w') as f:
-            f.write('{0}'.format(value))
+        self.log.debug('set_brightness(%s, %s)', value, duration)
+        if duration > 0:
+            self.backlight.fade(value, duration)
+        else:
+            self.backlight.stop_fade()
+            self.backlight.set(value)
 
     def get_brightness(self):
         """
         Get the current panel brightness (0 - 255).
         """
-        value = 0
-        if not os.path.exists('/sys/class/backlight/rpi_backlight/actual_brightness'):
-            return value
-        with open('/sys/class/backlight/rpi_backlight/actual_brightness') as f:
-            value = int(f.read())
-        self.log.info('get_brightness() {0}'.format(value))
-        return value
+        return self.backlight.get()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import collections
+import logging
+import os
+import sys
+import time
+
+import pygame
+
+class SplitFlap:
+    """
+    Split-flap transition between two labels of a DigitAtlas.
+    The upper half of the old label folds down to the middle, then the lower
+    half of the new label unfolds from the middle. Half-label surfaces are
+    subsurfaces of the atlas sheets (no copies). Frames are drawn at a fixed
+    rate, frames that are already too late are skipped.
+    """
+
+    def __init__(self, atlas, fps=20, duration=0.5, logger=None):
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger(__name__)
+        self.atlas = atlas
+        self.fps = fps
+        self.duration = duration
+        self.halves = {}
+        self.frames = 0
+        self.skipped = 0
+        self.frame_times = collections.deque(maxlen=1000)
+
+    def half(self, label, color):
+        """
+        Get the (upper, lower) half surfaces of a label.
+        """
+        key = (label, tuple([ int(c) for c in color ]))
+        if not key in self.halves:
+            sheet = self.atlas.sheet(color)
+            r = self.atlas.rects[label]
+            upper = sheet.subsurface(pygame.Rect(r.x, r.y, r.w, r.h // 2))
+            lower = sheet.subsurface(pygame.Rect(r.x, r.y + r.h // 2, r.w, r.h - r.h // 2))
+            self.halves[key] = (upper, lower)
+        return self.halves[key]
+
+    def draw_card(self, screen, card, t, color):
+        """
+        Draw one card (x_old, x_new, y, old label, new label) at animation time t (0 - 1).
+        Returns the drawn rectangle.
+        """
+        (x_old, x_new, y, old, new) = card
+        (old_upper, old_lower) = self.half(old, color)
+        (new_upper, new_lower) = self.half(new, color)
+        middle = y + old_upper.get_height()
+        rect = pygame.Rect(x_old, y, old_upper.get_width(), old_upper.get_height() + old_lower.get_height())
+        rect.union_ip(pygame.Rect(x_new, y, new_upper.get_width(), new_upper.get_height() + new_lower.get_height()))
+        screen.fill(self.atlas.bg_color, rect)
+        # static parts: new upper half behind the falling flap, old lower half below
+        screen.blit(new_upper, (x_new, y))
+        screen.blit(old_lower, (x_old, middle))
+        if t < 0.5:
+            h = round(old_upper.get_height() * (1.0 - 2.0 * t))
+            if h > 0:
+                flap = pygame.transform.scale(old_upper, (old_upper.get_width(), h))
+                screen.blit(flap, (x_old, middle - h))
+        else:
+            h = round(new_lower.get_height() * (2.0 * t - 1.0))
+            if h > 0:
+                flap = pygame.transform.scale(new_lower, (new_lower.get_width(), h))
+                screen.blit(flap, (x_new, middle))
+        return rect
+
+    def animate(self, screen, cards, color, update, overlay=[]):
+        """
+        Run the transition for all cards, calling update(rect) after each frame.
+        overlay is a list of (color, rect) fills drawn on top of every frame.
+        """
+        count = max(1, round(self.duration * self.fps))
+        period = 1.0 / self.fps
+        start = time.perf_counter()
+        for frame in range(1, count + 1):
+            due = start + frame * period
+            now = time.perf_counter()
+            if frame < count and now > due + period:
+                # behind schedule, the last frame is always drawn
+                self.skipped += 1
+                continue
+            if now < due:
+                time.sleep(due - now)
+            t0 = time.perf_counter()
+            rect = None
+            for card in cards:
+                r = self.draw_card(screen, card, frame / count, color)
+                if rect is None:
+                    rect = r
+                else:
+                    rect.union_ip(r)
+            for (c, r) in overlay:
+                screen.fill(c, r)
+            update(rect)
+            self.frame_times.append(time.perf_counter() - t0)
+            self.frames += 1
+        self.log.debug('split-flap %s', self.stats())
+
+    def stats(self):
+        """
+        Get frame statistics: drawn and skipped frames, mean and max frame time, frame budget.
+        """
+        times = list(self.frame_times)
+        result = { 'frames': self.frames, 'skipped': self.skipped, 'budget': 1.0 / self.fps }
+        if len(times) > 0:
+            result['mean'] = sum(times) / len(times)
+            result['max'] = max(times)
+        return result
+
+if __name__ == '__main__':
+    import argparse
+
+    from digit_atlas import DigitAtlas
+
+    self = os.path.basename(sys.argv[0])
+    myName = os.path.splitext(self)[0]
+    log = logging.getLogger(myName)
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+    parser = argparse.ArgumentParser(description='split-flap animation benchmark')
+    parser.add_argument('-d', '--debug', action='store_true', help='debug execution')
+    parser.add_argument('-f', '--font', default='font/gluqlo.ttf', help='digit font')
+    parser.add_argument('-n', '--count', type=int, default=10, help='number of transitions')
+    parser.add_argument('--fps', type=int, default=20, help='frames per second')
+    parser.add_argument('--height', type=int, default=480, help='screen height')
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.debug:
+        log.setLevel(logging.DEBUG)
+    else:
+        log.setLevel(logging.INFO)
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.init()
+    screen = pygame.display.set_mode((round(args.height * 5 / 3), args.height))
+    font = pygame.font.Font(args.font, round(args.height * 0.64))
+    flap = SplitFlap(DigitAtlas(font, (10, 10, 10), logger=log), fps=args.fps, logger=log)
+    flap.atlas.sheet((255, 255, 255))
+    for i in range(args.count):
+        cards = [ (20, 20, 20, '{0:02d}'.format(i % 60), '{0:02d}'.format((i + 1) % 60)) ]
+        flap.animate(screen, cards, (255, 255, 255), lambda rect: pygame.display.update(rect))
+    stats = flap.stats()
+    print('{0} frames, {1} skipped, mean {2:.2f} ms, max {3:.2f} ms, budget {4:.2f} ms'.format(stats['frames'], stats['skipped'], stats['mean'] * 1000, stats['max'] * 1000, stats['budget'] * 1000))
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import json
+import logging
+import os
+import sys
+import time
+
+import metrics
+
+class StateStore:
+    """
+    Small JSON state file (manual alarm, station, brightness) that survives restarts.
+    Changes are collected in memory and written at most every interval seconds
+    (and on close()), atomically: temporary file, fsync, rename, fsync of the directory.
+    Without a file name the writes are only counted.
+    """
+
+    def __init__(self, file_name, interval=60, clock=None, logger=None):
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger(__name__)
+        if clock is None:
+            clock = time.monotonic
+        self.clock = clock
+        self.file_name = file_name
+        self.interval = interval
+        self.values = {}
+        self.dirty = False
+        # changes are written interval seconds after the first unwritten change
+        self.first_change = None
+        self.changes = 0
+        self.writes = 0
+
+    def load(self):
+        """
+        Read the state file, returns the stored values (empty if there is none).
+        """
+        self.values = {}
+        if self.file_name is None or not os.path.exists(self.file_name):
+            return dict(self.values)
+        try:
+            with open(self.file_name) as f:
+                self.values = json.load(f)
+        except (OSError, ValueError) as e:
+            self.log.error('reading state {0} failed: {1}'.format(self.file_name, e))
+        return dict(self.values)
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def set(self, key, value):
+        """
+        Change a value, it is written with the next due write.
+        """
+        if key in self.values and self.values[key] == value:
+            return
+        self.values[key] = value
+        self.changes += 1
+        metrics.registry.inc('state_changes_total')
+        if not self.dirty:
+            self.dirty = True
+            self.first_change = self.clock()
+
+    def due(self):
+        """
+        Get the clock time of the next write or None if nothing changed.
+        """
+        if not self.dirty:
+            return None
+        return self.first_change + self.interval
+
+    def flush(self, force=False):
+        """
+        Write the changes if the write is due (or forced), returns True if written.
+        """
+        due = self.due()
+        if due is None or (not force and self.clock() < due):
+            return False
+        return self.write()
+
+    def write(self):
+        """
+        Write all values, returns False on failure (the changes stay dirty and are written with the next due write).
+        """
+        if not self.file_name is None:
+            tmp = self.file_name + '.tmp'
+            try:
+                with open(tmp, 'w') as f:
+                    json.dump(self.values, f, indent=2)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.file_name)
+            except OSError as e:
+                self.log.error('writing state {0} failed: {1}'.format(self.file_name, e))
+                # retry one interval later
+                self.first_change = self.clock()
+                return False
+            try:
+                directory = os.open(os.path.dirname(os.path.abspath(self.file_name)), os.O_RDONLY)
+                try:
+                    os.fsync(directory)
+                finally:
+                    os.close(directory)
+            except OSError as e:
+                self.log.warning('syncing the directory of {0} failed: {1}'.format(self.file_name, e))
+        self.dirty = False
+        self.writes += 1
+        metrics.registry.inc('state_writes_total')
+        self.log.debug('state written (%s changes, %s writes)', self.changes, self.writes)
+        return True
+
+    def close(self):
+        self.flush(force=True)
+
+if __name__ == '__main__':
+    import argparse
+    import random
+
+    self = os.path.basename(sys.argv[0])
+    myName = os.path.splitext(self)[0]
+    log = logging.getLogger(myName)
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+    parser = argparse.ArgumentParser(description='state writes for simulated taps')
+    parser.add_argument('-d', '--debug', action='store_true', help='debug execution')
+    parser.add_argument('-f', '--file', default='/tmp/alarmclock-state.json', help='state file')
+    parser.add_argument('-n', '--count', type=int, default=1000, help='number of taps')
+    parser.add_argument('-i', '--interval', type=float, default=60, help='seconds between writes')
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.debug:
+        log.setLevel(logging.DEBUG)
+    else:
+        log.setLevel(logging.INFO)
+    # taps a few seconds apart on a simulated clock
+    now = [ 0.0 ]
+    store = StateStore(args.file, args.interval, clock=lambda: now[0], logger=log)
+    store.load()
+    for i in range(args.count):
+        now[0] += random.expovariate(1 / 3.0)
+        store.set('alarm', '{0}:{1:02d}'.format(random.randrange(5, 9), random.randrange(60)))
+        store.flush()
+    store.close()
+    print('{0} changes in {1:.0f}s, {2} writes'.format(store.changes, now[0], store.writes))
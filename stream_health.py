@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import concurrent.futures
+import http.client
+import logging
+import os
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+import metrics
+from player import resolve_playlist
+
+# layer III bit rates in kbit/s by the bit rate index of the frame header (MPEG-1, MPEG-2/2.5)
+MP3_BITRATES = {
+    3: [ None, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, None ],
+    2: [ None, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160, None ],
+    0: [ None, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160, None ],
+}
+
+def mp3_bitrate(data):
+    """
+    Get the bit rate (kbit/s) of the first layer III frame header in data or None.
+    """
+    i = data.find(b'\xff')
+    while i >= 0 and i + 2 < len(data):
+        # 11 sync bits, version (not reserved), layer III
+        version = (data[i + 1] >> 3) & 3
+        if data[i + 1] & 0xe0 == 0xe0 and version in MP3_BITRATES and (data[i + 1] >> 1) & 3 == 1:
+            return MP3_BITRATES[version][data[i + 2] >> 4]
+        i = data.find(b'\xff', i + 1)
+    return None
+
+class IcyResponse(http.client.HTTPResponse):
+    """
+    HTTP response that also accepts the 'ICY 200 OK' status line of SHOUTcast v1 servers.
+    """
+
+    def _read_status(self):
+        line = str(self.fp.readline(65537), 'iso-8859-1')
+        if len(line) == 0:
+            raise http.client.RemoteDisconnected('no status line')
+        (protocol, _, rest) = line.strip().partition(' ')
+        (status, _, reason) = rest.partition(' ')
+        if not (protocol == 'ICY' or protocol.startswith('HTTP/')) or not status.isdigit():
+            raise http.client.BadStatusLine(line)
+        # the headers that follow are plain HTTP/1.0 headers
+        return ('HTTP/1.0' if protocol == 'ICY' else protocol, int(status), reason.strip())
+
+def open_icy(url, headers, timeout):
+    """
+    Open a stream with http.client, tolerating an 'ICY 200 OK' status line (urllib rejects it).
+    """
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme == 'https':
+        connection = http.client.HTTPSConnection(parts.hostname, parts.port, timeout=timeout)
+    else:
+        connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+    connection.response_class = IcyResponse
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    connection.request('GET', path, headers=headers)
+    response = connection.getresponse()
+    if response.status != 200:
+        connection.close()
+        raise ValueError('status {0} {1}'.format(response.status, response.reason))
+    return response
+
+def stream_urls(value):
+    """
+    Get the mirror URLs of a config['streams'] entry (a URL or a list of URLs).
+    """
+    if isinstance(value, str):
+        return [ value ]
+    return list(value)
+
+class StreamProber(threading.Thread):
+    """
+    Check all stream URLs (every mirror of every station) concurrently with a small
+    thread pool every interval seconds. The health table has per URL the time to
+    the first byte, the bit rate and the consecutive failures; stations are usable
+    if one of their mirrors answered at the last check.
+    """
+
+    def __init__(self, streams, interval=600, workers=4, timeout=10, read=16384, logger=None):
+        threading.Thread.__init__(self, name='stream-prober', daemon=True)
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger(__name__)
+        self.streams = dict([ (name, stream_urls(value)) for (name, value) in streams.items() ])
+        self.interval = interval
+        self.workers = workers
+        self.timeout = timeout
+        self.read = read
+        self.lock = threading.Lock()
+        # URL -> { 'station', 'ok', 'ttfb', 'bitrate', 'failures', 'checks', 'time', 'error' }
+        self.table = {}
+        self.wakeup = threading.Event()
+        self.keep_running = True
+        self.rounds = 0
+
+    def probe(self, station, url):
+        """
+        Open a stream and read the first bytes, returns a health table entry.
+        """
+        result = { 'station': station, 'ok': False, 'ttfb': None, 'bitrate': None, 'error': None }
+        start = time.perf_counter()
+        try:
+            stream = resolve_playlist(url, timeout=self.timeout)
+            if stream is None:
+                raise ValueError('no stream in playlist')
+            headers = { 'Icy-MetaData': '0', 'User-Agent': 'alarmclock' }
+            try:
+                response = urllib.request.urlopen(urllib.request.Request(stream, headers=headers), timeout=self.timeout)
+            except http.client.BadStatusLine as e:
+                # SHOUTcast v1 answers 'ICY 200 OK', which mpg123 plays fine
+                if not str(e.line).startswith('ICY 200'):
+                    raise
+                start = time.perf_counter()
+                response = open_icy(stream, headers, self.timeout)
+            with response:
+                data = response.read(1)
+                result['ttfb'] = time.perf_counter() - start
+                if len(data) == 0:
+                    raise ValueError('empty stream')
+                data += response.read(self.read - 1)
+                bitrate = response.headers.get('icy-br')
+            if not bitrate is None:
+                bitrate = int(bitrate.split(',')[0])
+            else:
+                bitrate = mp3_bitrate(data)
+            result['bitrate'] = bitrate
+            result['ok'] = True
+            metrics.registry.observe('stream_probe_seconds', result['ttfb'], station=station)
+        except (OSError, ValueError, http.client.HTTPException) as e:
+            result['error'] = '{0}: {1}'.format(type(e).__name__, e)
+            metrics.registry.inc('stream_probe_failures_total', station=station)
+        except Exception as e:
+            # a single broken server must not abort the probe round
+            self.log.error('probing {0} failed: {1!r}'.format(url, e))
+            result['error'] = '{0}: {1}'.format(type(e).__name__, e)
+            metrics.registry.inc('stream_probe_failures_total', station=station)
+        return result
+
+    def probe_all(self):
+        """
+        Probe all URLs concurrently and update the health table.
+        """
+        # every URL once, also if several stations share a mirror
+        jobs = dict([ (url, station) for (station, urls) in reversed(list(self.streams.items())) for url in urls ])
+        jobs = [ (station, url) for (url, station) in jobs.items() ]
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='probe') as pool:
+            results = list(pool.map(lambda job: (job[1], self.probe(*job)), jobs))
+        now = time.time()
+        with self.lock:
+            for (url, result) in results:
+                entry = self.table.get(url, { 'failures': 0, 'checks': 0 })
+                entry.update(result)
+                entry['checks'] += 1
+                entry['failures'] = 0 if result['ok'] else entry['failures'] + 1
+                entry['time'] = now
+                self.table[url] = entry
+        self.rounds += 1
+        failed = [ url for (url, result) in results if not result['ok'] ]
+        self.log.info('%s streams probed in %.2fs, %s failed', len(jobs), time.perf_counter() - start, len(failed))
+        for url in failed:
+            self.log.warning('stream {0} failed: {1}'.format(url, self.table[url]['error']))
+        return results
+
+    def healthy(self, station):
+        """
+        Check if a station has a working mirror (unknown stations and stations not probed yet count as healthy).
+        """
+        urls = self.streams.get(station)
+        if urls is None:
+            return True
+        with self.lock:
+            entries = [ self.table.get(url) for url in urls ]
+        if any([ entry is None for entry in entries ]):
+            return True
+        return any([ entry['ok'] for entry in entries ])
+
+    def url(self, station):
+        """
+        Get the fastest working mirror of a station (the first mirror without results).
+        """
+        urls = self.streams[station]
+        with self.lock:
+            working = [ (self.table[url]['ttfb'], url) for url in urls if url in self.table and self.table[url]['ok'] ]
+        if len(working) == 0:
+            return urls[0]
+        return min(working)[1]
+
+    def ttfb(self, station):
+        with self.lock:
+            values = [ self.table[url]['ttfb'] for url in self.streams.get(station, []) if url in self.table and self.table[url]['ok'] ]
+        if len(values) == 0:
+            return None
+        return min(values)
+
+    def fastest(self, stations=None):
+        """
+        Get the healthy station with the shortest time to the first byte or None.
+        """
+        if stations is None:
+            stations = sorted(self.streams.keys())
+        best = None
+        for station in stations:
+            ttfb = self.ttfb(station)
+            if not ttfb is None and (best is None or ttfb < best[0]):
+                best = (ttfb, station)
+        if best is None:
+            return None
+        return best[1]
+
+    def snapshot(self):
+        with self.lock:
+            return dict([ (url, dict(entry)) for (url, entry) in self.table.items() ])
+
+    def check(self):
+        """
+        Probe again at once (e.g. before an alarm).
+        """
+        self.wakeup.set()
+
+    def run(self):
+        while self.keep_running:
+            try:
+                self.probe_all()
+            except Exception as e:
+                self.log.error('stream probe failed: {0}'.format(e))
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+    def stop(self):
+        self.keep_running = False
+        self.wakeup.set()
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    from stream_standin import StreamStandIn
+
+    self = os.path.basename(sys.argv[0])
+    myName = os.path.splitext(self)[0]
+    log = logging.getLogger(myName)
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+    parser = argparse.ArgumentParser(description='stream health check')
+    parser.add_argument('-d', '--debug', action='store_true', help='debug execution')
+    parser.add_argument('-c', '--config', default=None, help='probe the streams of this config file')
+    parser.add_argument('-w', '--workers', type=int, default=4, help='concurrent probes')
+    parser.add_argument('-t', '--timeout', type=float, default=5.0, help='probe timeout in seconds')
+    parser.add_argument('--standin', default=None, help='probe local stand-ins (fast, slow, broken, playlist) serving this MP3 file')
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.debug:
+        log.setLevel(logging.DEBUG)
+    else:
+        log.setLevel(logging.INFO)
+    standins = []
+    if not args.standin is None:
+        fast = StreamStandIn(args.standin, logger=log).start()
+        slow = StreamStandIn(args.standin, delay=1.5, logger=log).start()
+        broken = StreamStandIn(args.standin, logger=log).start()
+        broken.enabled = False
+        stalled = StreamStandIn(args.standin, delay=args.timeout + 5, logger=log).start()
+        standins = [ fast, slow, broken, stalled ]
+        streams = {
+            'mirrors': [ slow.url, fast.url ],
+            'slow': slow.url,
+            'broken': broken.url,
+            'stalled': stalled.url,
+            'playlist': fast.url.replace('.mp3', '.m3u'),
+        }
+    else:
+        with open(args.config or 'alarmclock.json') as f:
+            streams = json.load(f)['streams']
+    prober = StreamProber(streams, workers=args.workers, timeout=args.timeout, logger=log)
+    start = time.perf_counter()
+    prober.probe_all()
+    print('probed in {0:.2f}s'.format(time.perf_counter() - start))
+    for (url, entry) in sorted(prober.snapshot().items(), key=lambda item: item[1]['station']):
+        ttfb = '-' if entry['ttfb'] is None else '{0:.3f}s'.format(entry['ttfb'])
+        print('{0:10} {1:5} {2:>8} {3:>5} {4} {5}'.format(entry['station'], 'ok' if entry['ok'] else 'FAIL', ttfb, str(entry['bitrate']), url, entry['error'] or ''))
+    for station in sorted(prober.streams.keys()):
+        print('{0:10} healthy={1} url={2}'.format(station, prober.healthy(station), prober.url(station)))
+    print('fastest: {0}'.format(prober.fastest()))
+    for standin in standins:
+        standin.stop()
@@ -0,0 +1,180 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+       @file: stream_standin.py
+
+@description: local stand-in for an internet radio stream (development and alarm tests)
+
+              GET  /stream.mp3    endless MP3 stream (the file in a loop) at the given bit rate
+              GET  /stream.m3u    playlist with the stream URL
+              GET  /stream.pls    playlist with the stream URL
+
+              The first byte can be delayed (slow buffering) and the stream can be
+              switched off (HTTP 503) to test the alarm fallback.
+"""
+
+# standard Python modules
+import http.server
+import logging
+import os
+import sys
+import threading
+import time
+
+class StreamStandIn(object):
+    """
+    Threaded HTTP server sending an MP3 file in a loop like an Icecast mount.
+    """
+
+    def __init__(self, file_name, host='127.0.0.1', port=0, rate=16000, delay=0.0, logger=None):
+        if logger:
+            self.log = logger
+        else:
+            self.log = logging.getLogger(__name__)
+        with open(file_name, 'rb') as f:
+            self.data = f.read()
+        # bytes per second (16000 = 128 kbit/s), the first second is sent at once (server side buffer)
+        self.rate = rate
+        self.delay = delay
+        self.enabled = True
+        self.connections = 0
+        self.bytes_sent = 0
+        self.stopped = threading.Event()
+        standin = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def log_message(self, format, *args):
+                standin.log.debug(format % args)
+
+            def do_GET(self):
+                standin.handle(self)
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.host = host
+        self.port = self.server.server_address[1]
+        self.url = 'http://{0}:{1}/stream.mp3'.format(host, self.port)
+        self.thread = None
+
+    def handle(self, handler):
+        if handler.path == '/stream.m3u':
+            self.reply(handler, 'audio/x-mpegurl', '#EXTM3U\n{0}\n'.format(self.url))
+        elif handler.path == '/stream.pls':
+            self.reply(handler, 'audio/x-scpls', '[playlist]\nFile1={0}\nNumberOfEntries=1\n'.format(self.url))
+        elif handler.path != '/stream.mp3':
+            handler.send_error(404)
+        elif not self.enabled:
+            handler.send_error(503)
+        else:
+            self.stream(handler)
+
+    def reply(self, handler, content_type, text):
+        body = text.encode('utf-8')
+        handler.send_response(200)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def stream(self, handler, chunk=4096):
+        self.connections += 1
+        if self.delay > 0:
+            time.sleep(self.delay)
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'audio/mpeg')
+        handler.send_header('Cache-Control', 'no-cache')
+        handler.send_header('icy-name', 'stand-in')
+        handler.end_headers()
+        start = time.time()
+        sent = 0
+        pos = 0
+        try:
+            while self.enabled and not self.stopped.is_set():
+                # stay one second ahead of real time
+                ahead = sent - (time.time() - start + 1.0) * self.rate
+                if ahead > 0:
+                    self.stopped.wait(ahead / self.rate)
+                    continue
+                block = self.data[pos:pos + chunk]
+                pos = (pos + chunk) % len(self.data)
+                handler.wfile.write(block)
+                sent += len(block)
+                self.bytes_sent += len(block)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def start(self):
+        """
+        Serve in a background thread.
+        """
+        self.thread = threading.Thread(target=self.server.serve_forever, name='stream-standin', daemon=True)
+        self.thread.start()
+        self.log.info('stream stand-in on {0}'.format(self.url))
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+def measure(url, command='mpg123', preload=5.0, timeout=20.0, logger=None):
+    """
+    Time to first audio of a cold load and of a preloaded stream with mpg123.
+    """
+    from player import Mpg123Player
+
+    result = {}
+    for mode in [ 'cold', 'preloaded' ]:
+        started = threading.Event()
+        player = Mpg123Player(command, logger=logger, on_audio=lambda delay: started.set())
+        if mode == 'preloaded':
+            player.preload(url)
+            time.sleep(preload)
+        player.load(url)
+        started.wait(timeout)
+        if player.audio_time is None:
+            result[mode] = None
+        else:
+            result[mode] = player.audio_time - player.load_time
+        player.stop()
+        player.quit()
+    return result
+
+if __name__ == '__main__':
+    import argparse
+
+    self = os.path.basename(sys.argv[0])
+    myName = os.path.splitext(self)[0]
+    log = logging.getLogger(myName)
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+    parser = argparse.ArgumentParser(description='internet radio stream stand-in')
+    parser.add_argument('-d', '--debug', action='store_true', help='debug execution')
+    parser.add_argument('-H', '--host', default='127.0.0.1', help='listen address')
+    parser.add_argument('-p', '--port', type=int, default=8000, help='listen port')
+    parser.add_argument('--rate', type=int, default=16000, help='stream rate in bytes per second')
+    parser.add_argument('--delay', type=float, default=0.0, help='delay before the first byte in seconds')
+    parser.add_argument('--measure', action='store_true', help='measure the time to first audio with mpg123 and exit')
+    parser.add_argument('file', help='MP3 file')
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.debug:
+        log.setLevel(logging.DEBUG)
+    else:
+        log.setLevel(logging.INFO)
+    standin = StreamStandIn(args.file, args.host, args.port, rate=args.rate, delay=args.delay, logger=log).start()
+    if args.measure:
+        result = measure(standin.url, logger=log)
+        for (mode, delay) in result.items():
+            if delay is None:
+                print('{0:10} no audio'.format(mode))
+            else:
+                print('{0:10} {1:.3f}s'.format(mode, delay))
+        standin.stop()
+        sys.exit(0)
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        standin.stop()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Stand-in for mpg123 -R: answers the remote control commands with the status lines
+of mpg123 without decoding anything. Received commands are appended to the file
+named by FAKE_MPG123_LOG. URLs containing 'crash' end the process right after the playback started,
+URLs containing 'missing' are answered with @E.
+"""
+
+# standard Python modules
+import os
+import sys
+import time
+
+STREAM_FORMAT = '1.0 3 44100 Joint-Stereo 0 418 2 0 0 0 128 0 1'
+
+def say(line):
+    sys.stdout.write(line + '\n')
+    sys.stdout.flush()
+
+def main():
+    log = os.environ.get('FAKE_MPG123_LOG')
+    say('@R MPG123 (fake)')
+    state = 0
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        if log:
+            with open(log, 'a') as f:
+                f.write(line + '\n')
+        (command, _, arg) = line.partition(' ')
+        command = command.upper()
+        if command in ('LOAD', 'LOADPAUSED', 'LOADLIST'):
+            url = arg.split(' ')[-1]
+            if 'crash' in url:
+                say('@P 2')
+                sys.exit(1)
+            if 'missing' in url:
+                say('@E Cannot open {0}'.format(url))
+                state = 0
+                say('@P 0')
+                continue
+            say('@I ID3:{0}'.format(os.path.basename(url)))
+            if command == 'LOADPAUSED':
+                state = 1
+                say('@S ' + STREAM_FORMAT)
+                say('@P 1')
+            else:
+                state = 2
+                say('@P 2')
+                # connection and first frame
+                time.sleep(0.1)
+                say('@S ' + STREAM_FORMAT)
+        elif command == 'PAUSE':
+            if state != 0:
+                state = 1 if state == 2 else 2
+                say('@P {0}'.format(state))
+        elif command == 'STOP':
+            state = 0
+            say('@P 0')
+        elif command == 'QUIT':
+            break
+        elif command in ('SILENCE', 'VOLUME'):
+            pass
+        else:
+            say('@E Unknown command or no arguments: {0}'.format(command.lower()))
+
+if __name__ == '__main__':
+    main()
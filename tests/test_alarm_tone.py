@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import unittest
+import wave
+
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pygame
+
+from alarm_tone import AlarmTone
+from asset_cache import AssetCache
+
+class AlarmToneTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'tone.wav')
+        with wave.open(self.file_name, 'wb') as w:
+            w.setnchannels(2)
+            w.setsampwidth(2)
+            w.setframerate(44100)
+            # 1.1s, so the last slice is shorter than the others
+            w.writeframes(b''.join(struct.pack('<hh', i % 1000, -(i % 1000)) for i in range(48510)))
+        try:
+            pygame.mixer.init(44100, -16, 2, 1024)
+        except pygame.error as e:
+            self.skipTest('no audio output: {0}'.format(e))
+        self.cache = AssetCache(os.path.join(self.directory, 'cache'))
+        self.tone = AlarmTone(self.file_name, cache=self.cache, chunk=0.25)
+
+    def tearDown(self):
+        self.tone.close()
+        pygame.mixer.quit()
+        shutil.rmtree(self.directory)
+
+    def test_slices_cover_the_mapping(self):
+        self.assertTrue(self.tone.open())
+        self.assertIsNone(self.tone.sound)
+        self.assertEqual(self.tone.chunk_size, 11025 * 4)
+        self.tone.loops = 1
+        parts = []
+        while True:
+            sound = self.tone.next_chunk()
+            if sound is None:
+                break
+            parts.append(sound.get_raw())
+        self.assertEqual(len(parts), 10)
+        self.assertEqual(b''.join(parts), self.tone.map[:] * 2)
+        self.assertEqual(self.tone.map[:], pygame.mixer.Sound(self.file_name).get_raw())
+
+    def test_play_queues_slices_until_stop(self):
+        self.assertTrue(self.tone.play())
+        self.assertTrue(self.tone.playing())
+        time.sleep(0.2)
+        self.assertIsNotNone(self.tone.channel.get_queue())
+        self.tone.stop()
+        self.assertFalse(self.tone.running())
+        self.assertFalse(self.tone.playing())
+        self.tone.close()
+        self.assertIsNone(self.tone.map)
+
+    def test_volume_applies_to_the_channel(self):
+        self.tone.volume(40)
+        self.assertTrue(self.tone.play())
+        self.assertAlmostEqual(self.tone.channel.get_volume(), 0.4, places=2)
+        self.tone.volume(150)
+        self.assertAlmostEqual(self.tone.channel.get_volume(), 1.0, places=2)
+
+    def test_without_cache_the_samples_are_played(self):
+        tone = AlarmTone(self.file_name)
+        try:
+            self.assertTrue(tone.play(loops=0))
+            self.assertIsNone(tone.map)
+            self.assertFalse(tone.running())
+        finally:
+            tone.close()
+
+if __name__ == '__main__':
+    unittest.main()
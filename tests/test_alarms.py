@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import datetime
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from alarms import Alarm, AlarmScheduler, AlarmTrigger
+
+# a Monday
+MONDAY = datetime.datetime(2026, 10, 12, 0, 0)
+
+def at(days, hh, mm):
+    return MONDAY + datetime.timedelta(days=days, hours=hh, minutes=mm)
+
+class AlarmTest(unittest.TestCase):
+
+    def test_rules(self):
+        alarm = Alarm('work', '6:30', 'weekdays', dates=[ '2026-10-18' ], skip=[ '2026-10-13' ], overrides={ '2026-10-14': '5:45' })
+        self.assertEqual(alarm.next_fire(at(0, 0, 0)), at(0, 6, 30))
+        # Tuesday skipped, Wednesday overridden
+        self.assertEqual(alarm.next_fire(at(0, 6, 30)), at(2, 5, 45))
+        self.assertEqual(alarm.next_fire(at(2, 5, 45)), at(3, 6, 30))
+        # Saturday without alarm, the single date on Sunday fires
+        self.assertEqual(alarm.next_fire(at(4, 6, 30)), at(6, 6, 30))
+
+    def test_config_round_trip(self):
+        alarm = Alarm('work', '6:30', [ 'mon', 'fri' ], skip=[ '2026-10-16' ], calendar_skip=False)
+        self.assertEqual(Alarm.from_config(alarm.to_config()).to_config(), alarm.to_config())
+
+class AlarmSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = AlarmScheduler()
+
+    def test_due_in_time_order(self):
+        self.scheduler.add(Alarm('late', '7:00', 'daily'), at(0, 0, 0))
+        self.scheduler.add(Alarm('early', '6:00', 'daily'), at(0, 0, 0))
+        self.assertEqual(self.scheduler.label(), '6:00')
+        self.assertEqual(self.scheduler.due(at(0, 5, 59)), [])
+        due = self.scheduler.due(at(0, 7, 0))
+        self.assertEqual([ (t, alarm.name) for (t, alarm) in due ], [ (at(0, 6, 0), 'early'), (at(0, 7, 0), 'late') ])
+        # next occurrences are scheduled, nothing fires twice
+        self.assertEqual(self.scheduler.due(at(0, 7, 0)), [])
+        self.assertEqual(self.scheduler.peek()[0], at(1, 6, 0))
+
+    def test_replaced_and_removed_alarms(self):
+        self.scheduler.add(Alarm('wake', '6:00', 'daily'), at(0, 0, 0))
+        self.scheduler.add(Alarm('wake', '8:00', 'daily'), at(0, 0, 0))
+        self.scheduler.add(Alarm('nap', '13:00', 'daily'), at(0, 0, 0))
+        # the outdated 6:00 entry is still in the heap but not valid
+        self.assertEqual(self.scheduler.peek()[0], at(0, 8, 0))
+        self.assertEqual(self.scheduler.alarm_time('wake'), at(0, 8, 0))
+        self.scheduler.remove('wake')
+        self.assertEqual([ alarm.name for (t, alarm) in self.scheduler.due(at(0, 23, 0)) ], [ 'nap' ])
+
+    def test_disabled_alarm(self):
+        self.scheduler.add(Alarm('off', '6:00', 'daily', enabled=False), at(0, 0, 0))
+        self.assertEqual(self.scheduler.peek(), (None, None))
+        self.assertEqual(self.scheduler.label(), '-:--')
+
+    def test_calendar_skip_on_holiday(self):
+        holiday = at(1, 0, 0).date()
+        self.scheduler.add(Alarm('work', '6:30', 'weekdays'), at(0, 12, 0))
+        self.scheduler.add(Alarm('clock', '7:00', 'daily', calendar_skip=False), at(0, 12, 0))
+        self.scheduler.add(Alarm('trip', '4:00', dates=[ holiday ]), at(0, 12, 0))
+        self.scheduler.set_skip_day(lambda day: 'holiday' if day == holiday else None, at(0, 12, 0))
+        self.assertEqual(self.scheduler.alarm_time('work'), at(2, 6, 30))
+        # manual alarm and single dates are not skipped
+        self.assertEqual(self.scheduler.alarm_time('clock'), at(1, 7, 0))
+        self.assertEqual(self.scheduler.alarm_time('trip'), at(1, 4, 0))
+        self.scheduler.set_skip_day(None, at(0, 12, 0))
+        self.assertEqual(self.scheduler.alarm_time('work'), at(1, 6, 30))
+
+class FakeClock:
+    """
+    Wall clock of the trigger, moved by the test (suspend, clock change).
+    """
+
+    def __init__(self, now):
+        self.now = now
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            return self.now
+
+    def set(self, now):
+        with self.lock:
+            self.now = now
+
+class AlarmTriggerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock(at(0, 6, 0))
+        self.scheduler = AlarmScheduler()
+        self.fired = []
+        self.event = threading.Event()
+        self.trigger = None
+
+    def tearDown(self):
+        if not self.trigger is None:
+            self.trigger.stop()
+            self.trigger.join(2)
+
+    def callback(self, fire_time, alarm, latency):
+        self.fired.append((fire_time, alarm.name, latency))
+        self.event.set()
+
+    def start(self, max_wait=60):
+        self.trigger = AlarmTrigger(self.scheduler, self.callback, max_wait=max_wait, clock=self.clock)
+        self.trigger.start()
+
+    def wait_fired(self, count, timeout=2.0):
+        deadline = time.time() + timeout
+        while len(self.fired) < count and time.time() < deadline:
+            self.event.wait(0.01)
+            self.event.clear()
+        self.assertEqual(len(self.fired), count)
+
+    def test_fires_at_the_exact_time(self):
+        self.scheduler.add(Alarm('wake', '6:30', 'daily'), self.clock())
+        self.start(max_wait=0.02)
+        time.sleep(0.1)
+        self.assertEqual(self.fired, [])
+        self.clock.set(at(0, 6, 30))
+        self.wait_fired(1)
+        self.assertEqual(self.fired[0], (at(0, 6, 30), 'wake', 0.0))
+        self.assertEqual(self.scheduler.peek()[0], at(1, 6, 30))
+
+    def test_catch_up_after_suspend(self):
+        self.scheduler.add(Alarm('wake', '6:30', 'daily'), self.clock())
+        self.start(max_wait=0.02)
+        # the system slept through the alarm for 20 minutes
+        self.clock.set(at(0, 6, 50))
+        self.wait_fired(1)
+        self.assertEqual(self.fired[0], (at(0, 6, 30), 'wake', 1200.0))
+        self.assertEqual(self.trigger.latencies[-1]['latency'], 1200.0)
+
+    def test_missed_alarm_is_skipped(self):
+        self.scheduler.add(Alarm('wake', '6:30', 'daily'), self.clock())
+        self.scheduler.add(Alarm('late', '7:45', 'daily'), self.clock())
+        self.start(max_wait=0.02)
+        # more than catch_up (3600 s) after 6:30
+        self.clock.set(at(0, 7, 45))
+        self.wait_fired(1)
+        time.sleep(0.1)
+        self.assertEqual([ name for (t, name, latency) in self.fired ], [ 'late' ])
+        # the missed alarm is scheduled again for the next day
+        self.assertEqual(self.scheduler.alarm_time('wake'), at(1, 6, 30))
+
+    def test_new_alarm_wakes_the_waiting_trigger(self):
+        self.scheduler.add(Alarm('evening', '22:00', 'daily'), self.clock())
+        # without the notification the trigger would sleep for max_wait
+        self.start(max_wait=60)
+        time.sleep(0.1)
+        # set at 6:00 for 6:01, the trigger sees the change at 6:01
+        self.clock.set(at(0, 6, 1))
+        self.scheduler.add(Alarm('now', '6:01', 'daily'), at(0, 6, 0))
+        self.wait_fired(1)
+        self.assertEqual(self.fired[0][1], 'now')
+
+    def test_replaced_alarm_does_not_fire(self):
+        self.scheduler.add(Alarm('wake', '6:30', 'daily'), self.clock())
+        self.start(max_wait=0.02)
+        time.sleep(0.05)
+        self.scheduler.add(Alarm('wake', '7:00', 'daily'), self.clock())
+        self.clock.set(at(0, 6, 45))
+        time.sleep(0.1)
+        self.assertEqual(self.fired, [])
+        self.clock.set(at(0, 7, 0))
+        self.wait_fired(1)
+        self.assertEqual(self.fired[0][0], at(0, 7, 0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backlight import Backlight, FakeBacklight
+
+class BacklightTest(unittest.TestCase):
+
+    def setUp(self):
+        # sysfs backlight directory
+        self.path = tempfile.mkdtemp()
+        for (name, value) in [ ('brightness', 40), ('actual_brightness', 40), ('max_brightness', 200) ]:
+            with open(os.path.join(self.path, name), 'w') as f:
+                f.write('{0}\n'.format(value))
+        self.backlight = Backlight(self.path)
+
+    def tearDown(self):
+        self.backlight.close()
+        shutil.rmtree(self.path)
+
+    def brightness(self):
+        with open(os.path.join(self.path, 'brightness')) as f:
+            return int(f.read())
+
+    def test_cached_value(self):
+        self.assertTrue(self.backlight.available())
+        self.assertEqual((self.backlight.get(), self.backlight.max_value), (40, 200))
+        self.assertFalse(self.backlight.set(40))
+        self.assertTrue(self.backlight.set(250))
+        self.assertEqual(self.brightness(), 200)
+        self.assertEqual(self.backlight.writes, 1)
+
+    def test_fade_ends_on_the_target(self):
+        self.backlight.fade(120, 0.2, rate=50)
+        self.assertTrue(self.backlight.fading())
+        self.backlight.fade_thread.join(2)
+        self.assertFalse(self.backlight.fading())
+        self.assertEqual(self.backlight.get(), 120)
+        self.assertEqual(self.brightness(), 120)
+        # fewer writes than steps, unchanged values are skipped
+        self.assertLessEqual(self.backlight.writes, 80)
+
+    def test_new_fade_replaces_the_running_one(self):
+        self.backlight.fade(200, 10, rate=50)
+        time.sleep(0.1)
+        first = self.backlight.fade_thread
+        self.backlight.fade(10, 0.1, rate=50)
+        self.assertFalse(first.is_alive())
+        self.backlight.fade_thread.join(2)
+        self.assertEqual(self.brightness(), 10)
+
+    def test_stop_fade(self):
+        self.backlight.fade(200, 10, rate=50)
+        time.sleep(0.1)
+        self.backlight.stop_fade()
+        value = self.backlight.get()
+        time.sleep(0.1)
+        self.assertEqual(self.backlight.get(), value)
+        self.assertEqual(self.brightness(), value)
+        self.assertLess(value, 200)
+
+    def test_missing_control(self):
+        backlight = Backlight(os.path.join(self.path, 'missing'))
+        self.assertFalse(backlight.available())
+        self.assertFalse(backlight.set(100))
+
+class FakeBacklightTest(unittest.TestCase):
+
+    def test_fade_is_recorded(self):
+        backlight = FakeBacklight(50)
+        backlight.fade(15, 1800)
+        self.assertEqual(backlight.get(), 15)
+        self.assertEqual(backlight.fades, [ (50, 15, 1800) ])
+        self.assertEqual([ value for (t, value) in backlight.history ], [ 15 ])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import datetime
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from calendar_index import CalendarIndex, parse_timestamp
+
+def entry(calendar, start, end, event, cls=None):
+    return { 'event': event, '_calName': calendar, '_class': cls or 'ical_{0}'.format(calendar), '_date': start, '_end': end }
+
+# ical table of the ioBroker adapter in UTC, the clock runs in Europe/Berlin (UTC+2 in October)
+TABLE = [
+    # all-day event from Monday 12 to Wednesday 14 October (end is exclusive)
+    entry('Familie', '2026-10-11T22:00:00.000Z', '2026-10-14T22:00:00.000Z', 'Urlaub'),
+    # zero-length reminder at midnight of the 13th
+    entry('Familie', '2026-10-12T22:00:00.000Z', '2026-10-12T22:00:00.000Z', 'Muell'),
+    entry('Familie', '2026-10-13T08:15:00.000Z', '2026-10-13T09:00:00.000Z', 'Arzt', 'ical_Familie_termin'),
+    entry('Feiertage', '2026-10-02T22:00:00.000Z', '2026-10-03T22:00:00.000Z', 'Tag der Deutschen Einheit'),
+] + [
+    # many short events starting inside the long one
+    entry('Familie', '2026-10-{0:02d}T{1:02d}:00:00.000Z'.format(12 + i // 10, 8 + i % 10), '2026-10-{0:02d}T{1:02d}:30:00.000Z'.format(12 + i // 10, 8 + i % 10), 'Termin {0}'.format(i))
+    for i in range(30)
+]
+
+def day(d):
+    return datetime.date(2026, 10, d)
+
+def former_get_calendar(table, cal_name, cal_class=None, today=None):
+    """
+    get_calendar of the baseline, with the standard library instead of ciso8601/pytz/tzlocal.
+    """
+    result = {}
+    for ical in table:
+        if not ical['_calName'] == cal_name:
+            continue
+        if cal_class != None and not ical['_class'].endswith(cal_class):
+            continue
+        start = datetime.datetime.fromisoformat(ical['_date'].replace('Z', '+00:00')).astimezone()
+        end = datetime.datetime.fromisoformat(ical['_end'].replace('Z', '+00:00')).astimezone()
+        dt = start
+        if start.date() <= today and end.date() >= today:
+            dt = datetime.datetime.combine(today, datetime.time()).astimezone()
+        result[dt] = ical['event']
+    return result
+
+class CalendarIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tz = os.environ.get('TZ')
+        os.environ['TZ'] = 'Europe/Berlin'
+        time.tzset()
+        parse_timestamp.cache_clear()
+        self.index = CalendarIndex()
+        self.assertTrue(self.index.update(TABLE))
+
+    def tearDown(self):
+        if self.tz is None:
+            del os.environ['TZ']
+        else:
+            os.environ['TZ'] = self.tz
+        time.tzset()
+        parse_timestamp.cache_clear()
+
+    def events(self, d, calendar='Familie', cls=None):
+        return [ event.event for event in self.index.on(day(d), calendar, cls) if not event.event.startswith('Termin') ]
+
+    def test_unchanged_table_is_not_parsed(self):
+        self.assertFalse(self.index.update(list(TABLE)))
+        self.assertEqual(self.index.parses, 1)
+        self.assertTrue(self.index.update(TABLE[:3]))
+
+    def test_multi_day_event(self):
+        self.assertEqual(self.events(11), [])
+        self.assertEqual(self.events(12), [ 'Urlaub' ])
+        # found from its last day although 30 events start in between
+        self.assertEqual(self.events(14), [ 'Urlaub' ])
+        # the exclusive end at midnight is not on the next day
+        self.assertEqual(self.events(15), [])
+
+    def test_zero_length_event_at_midnight(self):
+        self.assertEqual(self.events(12), [ 'Urlaub' ])
+        self.assertEqual(self.events(13), [ 'Urlaub', 'Muell', 'Arzt' ])
+        start = datetime.datetime(2026, 10, 13)
+        self.assertEqual([ e.event for e in self.index.between(start, start + datetime.timedelta(minutes=1)) ], [ 'Urlaub', 'Muell' ])
+
+    def test_class_and_rules(self):
+        self.assertEqual(self.events(13, cls='_termin'), [ 'Arzt' ])
+        rules = [ { 'calendar': 'Feiertage' }, { 'calendar': 'Familie', 'match': 'URLAUB' } ]
+        self.assertEqual(self.index.match(day(3), rules).event, 'Tag der Deutschen Einheit')
+        self.assertEqual(self.index.match(day(14), rules).event, 'Urlaub')
+        self.assertIsNone(self.index.match(day(16), rules))
+
+    def test_legacy_matches_former_get_calendar(self):
+        for d in [ 1, 3, 12, 13, 14, 15, 20 ]:
+            for (calendar, cls) in [ ('Familie', None), ('Familie', '_termin'), ('Feiertage', None) ]:
+                expected = former_get_calendar(TABLE, calendar, cls, day(d))
+                result = self.index.legacy(calendar, cls, day(d))
+                self.assertEqual(result, expected)
+                self.assertTrue(all([ not key.tzinfo is None for key in result.keys() ]))
+        # ongoing events are keyed with local midnight of today
+        midnight = datetime.datetime(2026, 10, 3, tzinfo=datetime.timezone(datetime.timedelta(hours=2)))
+        self.assertEqual(self.index.legacy('Feiertage', None, day(3)), { midnight: 'Tag der Deutschen Einheit' })
+
+if __name__ == '__main__':
+    unittest.main()
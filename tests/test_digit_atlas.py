@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pygame
+
+from digit_atlas import DigitAtlas
+from splitflap import SplitFlap
+
+class DigitAtlasTest(unittest.TestCase):
+
+    bg_color = (10, 10, 10)
+    colors = [ (255, 255, 255), (48, 48, 48), (192, 0, 0) ]
+
+    @classmethod
+    def setUpClass(cls):
+        pygame.font.init()
+        cls.font = pygame.font.Font(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'font', 'gluqlo.ttf'), 60)
+
+    def setUp(self):
+        self.atlas = DigitAtlas(self.font, self.bg_color)
+
+    def screen(self):
+        screen = pygame.Surface((200, 100))
+        screen.fill(self.bg_color)
+        return screen
+
+    def font_render(self, label, color):
+        """
+        Baseline: the label rendered with the font onto the background.
+        """
+        screen = self.screen()
+        screen.blit(self.font.render(label, True, color, self.bg_color), (5, 7))
+        return pygame.image.tostring(screen, 'RGB')
+
+    def test_render_matches_the_font(self):
+        for color in self.colors:
+            for label in [ '7', '0', '23', '05', '59' ]:
+                screen = self.screen()
+                rect = self.atlas.render(screen, label, (5, 7), color)
+                self.assertEqual(rect.size, self.font.size(label))
+                self.assertEqual(pygame.image.tostring(screen, 'RGB'), self.font_render(label, color), '{0} {1}'.format(label, color))
+
+    def test_colors_share_the_glyph_indices(self):
+        sheets = [ self.atlas.sheet(color) for color in self.colors ]
+        glyphs = self.atlas.glyph_indices()
+        self.assertEqual(len(glyphs), self.atlas.sheet_size[0] * self.atlas.sheet_size[1])
+        for (sheet, color) in zip(sheets, self.colors):
+            self.assertEqual(sheet.get_bitsize(), 8)
+            self.assertEqual(sheet.get_size(), self.atlas.sheet_size)
+            self.assertEqual(tuple(sheet.get_palette()[-1])[:3], color)
+        self.assertIs(self.atlas.sheet(self.colors[0]), sheets[0])
+        self.assertIs(self.atlas.glyph_indices(), glyphs)
+
+    def test_clear_renders_again(self):
+        glyphs = self.atlas.glyph_indices()
+        self.atlas.clear()
+        self.assertEqual(self.atlas.sheets, {})
+        self.assertIsNot(self.atlas.glyph_indices(), glyphs)
+        self.assertEqual(self.atlas.glyph_indices(), glyphs)
+
+    def test_direct_labels_and_unknown_labels_use_the_font(self):
+        self.atlas.direct = True
+        screen = self.screen()
+        self.atlas.render(screen, '12', (5, 7), self.colors[0])
+        self.assertEqual(self.atlas.sheets, {})
+        self.atlas.direct = False
+        screen = self.screen()
+        self.atlas.render(screen, '99', (5, 7), self.colors[0])
+        self.assertEqual(self.atlas.sheets, {})
+
+    def test_splitflap_halves_keep_their_color(self):
+        flap = SplitFlap(self.atlas)
+        (white, _) = flap.half('7', self.colors[0])
+        (red, _) = flap.half('7', self.colors[2])
+        self.assertEqual(white.get_palette()[-1][:3], self.colors[0])
+        self.assertEqual(red.get_palette()[-1][:3], self.colors[2])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import http.server
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+import urllib.parse
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from iobroker_proxy import IoBrokerProxy
+
+class SlowUpstream(http.server.BaseHTTPRequestHandler):
+    """
+    simple-API with getBulk reading the values when the request arrives and answering
+    late, get/ answers with Transfer-Encoding: chunked.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    values = {}
+    delay = 0.3
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        (command, _, arg) = url.path.lstrip('/').partition('/')
+        if command == 'getBulk':
+            body = json.dumps([ { 'id': id, 'val': self.values.get(id) } for id in arg.split(',') ]).encode('utf-8')
+            time.sleep(self.delay)
+            self.reply(body)
+        elif command == 'setBulk':
+            for (id, value) in urllib.parse.parse_qsl(url.query):
+                self.values[id] = value
+            self.reply(b'[]')
+        elif command == 'get':
+            body = json.dumps({ '_id': arg, 'val': self.values.get(arg) }).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            for i in range(0, len(body), 5):
+                chunk = body[i:i + 5]
+                self.wfile.write('{0:x};ext=1\r\n'.format(len(chunk)).encode('latin-1') + chunk + b'\r\n')
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            self.send_error(404)
+
+    def reply(self, body):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class IoBrokerProxyTest(unittest.TestCase):
+
+    def setUp(self):
+        SlowUpstream.values = { 'alarm': '06:30' }
+        self.upstream = http.server.ThreadingHTTPServer(('127.0.0.1', 0), SlowUpstream)
+        self.upstream.daemon_threads = True
+        threading.Thread(target=self.upstream.serve_forever, daemon=True).start()
+        self.proxy = IoBrokerProxy('127.0.0.1:{0}'.format(self.upstream.server_address[1]), ttl=60).start_thread()
+        self.url = 'http://127.0.0.1:{0}/'.format(self.proxy.port)
+
+    def tearDown(self):
+        self.proxy.stop_thread()
+        self.upstream.shutdown()
+        self.upstream.server_close()
+
+    def get(self, path):
+        with urllib.request.urlopen(self.url + path, timeout=10) as response:
+            return json.loads(response.read())
+
+    def test_write_during_fetch_is_not_overwritten(self):
+        old = []
+        reader = threading.Thread(target=lambda: old.append(self.get('getBulk/alarm')))
+        reader.start()
+        # the getBulk has read the old value upstream and is still on its way
+        time.sleep(0.1)
+        self.get('setBulk?alarm=07:15')
+        reader.join()
+        self.assertEqual(old[0][0]['val'], '06:30')
+        self.assertEqual(self.get('getBulk/alarm')[0]['val'], '07:15')
+        self.assertEqual(self.get('getBulk/alarm')[0]['val'], '07:15')
+
+    def test_chunked_upstream_response(self):
+        self.assertEqual(self.get('get/alarm'), { '_id': 'alarm', 'val': '06:30' })
+
+if __name__ == '__main__':
+    unittest.main()
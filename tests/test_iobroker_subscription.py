@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from iobroker import IoBroker, IoBrokerSubscription
+from iobroker_standin import IoBrokerStandIn
+
+class IoBrokerSubscriptionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.standin = IoBrokerStandIn(values={ 'alarm': '06:30' })
+        self.standin.start()
+        (host, port) = self.standin.url.split('//')[1].strip('/').split(':')
+        self.iobroker = IoBroker(host, int(port), get_objects=False, clock=lambda: 1000.0)
+        self.changes = []
+        self.changed = threading.Event()
+
+    def tearDown(self):
+        self.standin.stop()
+
+    def on_change(self, object_id, value):
+        self.changes.append((object_id, value['val']))
+        self.changed.set()
+
+    def wait_for(self, count):
+        deadline = time.time() + 5
+        while len(self.changes) < count and time.time() < deadline:
+            self.changed.wait(0.1)
+            self.changed.clear()
+        self.assertEqual(len(self.changes), count)
+
+    def test_stream_is_interrupted_by_stop(self):
+        subscription = IoBrokerSubscription(self.iobroker, [ 'alarm' ], self.on_change, stream=True, stream_timeout=60)
+        subscription.start()
+        self.wait_for(1)
+        deadline = time.time() + 5
+        while subscription.mode != 'stream' and time.time() < deadline:
+            time.sleep(0.05)
+        self.standin.set('alarm', '07:00')
+        self.wait_for(2)
+        self.assertEqual(self.changes[-1], ('alarm', '07:00'))
+        # cached with the time of the ioBroker clock
+        self.assertEqual(self.iobroker.cache.entries['alarm'][0], 1000.0)
+        start = time.time()
+        subscription.stop()
+        self.assertLess(time.time() - start, 2)
+        self.assertFalse(subscription.is_alive())
+
+    def test_polls_by_default(self):
+        subscription = IoBrokerSubscription(self.iobroker, [ 'alarm' ], self.on_change)
+        subscription.start()
+        self.wait_for(1)
+        subscription.stop()
+        self.assertFalse(subscription.is_alive())
+        self.assertEqual(subscription.mode, 'poll')
+        self.assertFalse([ request for request in self.standin.request_log if 'events/' in request ])
+
+if __name__ == '__main__':
+    unittest.main()
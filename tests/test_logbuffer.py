@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import logging
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from logbuffer import AsyncLogging, LazyQueueHandler, RateLimitFilter, RingBufferHandler
+
+def record(msg, *args, level=logging.INFO, name='test'):
+    return logging.LogRecord(name, level, __file__, 1, msg, args, None)
+
+class RateLimitFilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.filter = RateLimitFilter(burst=3, period=60.0, clock=lambda: self.now)
+
+    def test_burst_per_template(self):
+        passed = [ self.filter.filter(record('event %s pos %s', i, (i, i))) for i in range(10) ]
+        self.assertEqual(passed, [ True ] * 3 + [ False ] * 7)
+        # another template has its own window
+        self.assertTrue(self.filter.filter(record('state %s', 1)))
+        self.assertEqual(self.filter.suppressed, 7)
+        # the first record of the next window reports the suppressed ones
+        self.now = 60.0
+        passed = record('event %s pos %s', 11, (0, 0))
+        self.assertTrue(self.filter.filter(passed))
+        self.assertEqual(passed.suppressed, 7)
+
+    def test_warnings_pass(self):
+        for i in range(10):
+            self.assertTrue(self.filter.filter(record('failed %s', i, level=logging.WARNING)))
+        self.assertEqual(self.filter.windows, {})
+
+    def test_old_windows_are_dropped(self):
+        for i in range(100):
+            self.filter.filter(record('formatted message {0}'.format(i)))
+        self.assertEqual(len(self.filter.windows), 100)
+        self.now = 30.0
+        self.filter.filter(record('state %s', 1))
+        self.now = 61.0
+        self.filter.filter(record('state %s', 2))
+        self.filter.filter(record('other %s', 2))
+        # only the windows younger than period are kept
+        self.assertEqual(sorted([ key[2] for key in self.filter.windows.keys() ]), [ 'other %s', 'state %s' ])
+
+class LazyQueueHandlerTest(unittest.TestCase):
+
+    def test_record_is_formatted_by_the_listener(self):
+        records = queue.SimpleQueue()
+        handler = LazyQueueHandler(records)
+        formatted = []
+
+        class Value:
+            def __str__(self):
+                formatted.append(threading.current_thread().name)
+                return 'value'
+
+        handler.handle(record('value %s', Value()))
+        queued = records.get_nowait()
+        # the arguments are kept and not formatted in the logging thread
+        self.assertEqual(formatted, [])
+        self.assertEqual(queued.msg, 'value %s')
+        self.assertEqual(queued.getMessage(), 'value value')
+
+class RingBufferHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'clock.log')
+        self.handler = RingBufferHandler(self.file_name, capacity=3, interval=3600.0)
+        self.handler.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def lines(self):
+        if not os.path.exists(self.file_name):
+            return []
+        with open(self.file_name) as f:
+            return f.read().splitlines()
+
+    def test_error_flushes_the_buffer(self):
+        for i in range(5):
+            self.handler.handle(record('tick %d', i))
+        # buffered, the oldest are dropped
+        self.assertEqual(self.lines(), [])
+        self.assertEqual(self.handler.dropped, 2)
+        self.handler.handle(record('broken %s', 'stream', level=logging.ERROR))
+        self.assertEqual(self.lines(), [ 'INFO tick 3', 'INFO tick 4', 'ERROR broken stream' ])
+        self.assertEqual(self.handler.flushes, 1)
+
+    def test_suppressed_count_and_close(self):
+        passed = record('tick %d', 1)
+        passed.suppressed = 4
+        self.handler.handle(passed)
+        self.handler.close()
+        self.assertEqual(self.lines(), [ 'INFO tick 1 (4 similar messages suppressed)' ])
+
+    def test_async_logging(self):
+        logging_ = AsyncLogging(self.file_name, burst=2, format='%(levelname)s %(message)s')
+        log = logging.getLogger('test_async_logging')
+        log.setLevel(logging.INFO)
+        logging_.start()
+        try:
+            for i in range(5):
+                log.info('tick %d', i)
+            log.error('broken')
+        finally:
+            logging_.stop()
+        self.assertEqual(self.lines(), [ 'INFO tick 0', 'INFO tick 1', 'ERROR broken' ])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pygame
+
+from menu_layout import MenuLayout
+
+class MenuLayoutTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        pygame.font.init()
+        cls.font = pygame.font.Font(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'font', 'gluqlo.ttf'), 30)
+
+    def setUp(self):
+        icon = pygame.Surface((40, 40))
+        self.elements = [
+            { 'name': 'alarm', 'label': 'NONE' },
+            { 'name': 'play', 'label': 'PLAY' },
+            { 'name': 'stop', 'label': 'STOP' },
+            { 'name': 'vol+', 'icon': icon, 'pos': (0.9, 0.1) },
+            { 'name': 'corner', 'label': 'X', 'pos': (64, 64), 'align': 'lb' },
+        ]
+        self.layout = MenuLayout(self.elements, self.font, (800, 480), cell=32)
+
+    def linear_hit(self, pos):
+        """
+        Hit-test of the former linear walk over all rectangles.
+        """
+        for elem in self.elements:
+            if 'rect' in elem and elem['rect'].collidepoint(pos):
+                return elem
+        return None
+
+    def test_layout_is_cached(self):
+        self.assertIs(self.layout.get('play'), self.elements[1])
+        self.layout.hit((0, 0))
+        self.assertEqual(self.layout.layouts, 1)
+        self.elements[1]['label'] = 'PAUSE'
+        self.layout.invalidate()
+        self.assertEqual(self.layout.get('play')['rect'].w, self.font.size('PAUSE')[0])
+        self.assertEqual(self.layout.layouts, 2)
+
+    def test_hit_matches_the_linear_walk(self):
+        self.layout.update()
+        for x in range(0, 800, 3):
+            for y in range(0, 480, 3):
+                self.assertIs(self.layout.hit((x, y)), self.linear_hit((x, y)), (x, y))
+
+    def test_hit_at_cell_borders(self):
+        rect = self.layout.get('corner')['rect']
+        # placed at a cell corner, the element starts in cell (2, 2)
+        self.assertEqual(rect.topleft, (64, 64))
+        self.assertIs(self.layout.hit((64, 64)), self.elements[4])
+        self.assertIsNone(self.layout.hit((63, 64)))
+        self.assertIsNone(self.layout.hit((64, 63)))
+        # the last pixel inside and the first outside
+        self.assertIs(self.layout.hit((rect.right - 1, rect.bottom - 1)), self.elements[4])
+        self.assertIsNone(self.layout.hit((rect.right, rect.bottom - 1)))
+        self.assertIsNone(self.layout.hit((rect.right - 1, rect.bottom)))
+
+    def test_set_rect(self):
+        self.assertIsNone(self.layout.hit((400, 200)))
+        self.assertEqual(self.layout.set_rect('alarm', (300, 100, 200, 150)), pygame.Rect(300, 100, 200, 150))
+        self.assertIs(self.layout.hit((400, 200)), self.elements[0])
+        self.assertIs(self.layout.hit((300, 100)), self.elements[0])
+        self.assertIsNone(self.layout.hit((500, 250)))
+        # moved touch area
+        self.layout.set_rect('alarm', (0, 300, 100, 50))
+        self.assertIsNone(self.layout.hit((400, 200)))
+        self.assertIs(self.layout.hit((50, 320)), self.elements[0])
+        # kept by a relayout
+        self.layout.invalidate()
+        self.assertIs(self.layout.hit((50, 320)), self.elements[0])
+        self.assertIsNone(self.layout.set_rect('missing', (0, 0, 10, 10)))
+
+if __name__ == '__main__':
+    unittest.main()
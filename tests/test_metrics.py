@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import json
+import os
+import sys
+import unittest
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics
+from metrics import Metrics, MetricsServer, Stopwatch
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics(prefix='test', buckets=(0.1, 1.0))
+
+    def lines(self):
+        return self.metrics.prometheus().splitlines()
+
+    def test_counters(self):
+        self.metrics.inc('subprocess_spawns_total', command='amixer')
+        self.metrics.inc('subprocess_spawns_total', 2, command='amixer')
+        self.metrics.inc('backlight_writes_total')
+        lines = self.lines()
+        self.assertIn('# HELP test_subprocess_spawns_total started external processes', lines)
+        self.assertIn('# TYPE test_subprocess_spawns_total counter', lines)
+        self.assertIn('test_subprocess_spawns_total{command="amixer"} 3', lines)
+        self.assertIn('test_backlight_writes_total 1', lines)
+
+    def test_histogram_buckets(self):
+        for value in [ 0.05, 0.1, 0.5, 3.0 ]:
+            self.metrics.observe('render_seconds', value, region='time')
+        lines = self.lines()
+        self.assertIn('# TYPE test_render_seconds histogram', lines)
+        # cumulative buckets, the upper bound is inclusive
+        self.assertIn('test_render_seconds_bucket{region="time",le="0.1"} 2', lines)
+        self.assertIn('test_render_seconds_bucket{region="time",le="1.0"} 3', lines)
+        self.assertIn('test_render_seconds_bucket{region="time",le="+Inf"} 4', lines)
+        self.assertIn('test_render_seconds_sum{region="time"} 3.65', lines)
+        self.assertIn('test_render_seconds_count{region="time"} 4', lines)
+        histogram = self.metrics.snapshot()['histograms']['render_seconds{region="time"}']
+        self.assertEqual(histogram['buckets'], { '0.1': 2, '1.0': 3 })
+        self.assertEqual((histogram['count'], histogram['max']), (4, 3.0))
+
+    def test_label_escaping(self):
+        self.metrics.inc('stream_probe_failures_total', station='Radio "Eins"\\Berlin\nKultur')
+        self.assertIn('test_stream_probe_failures_total{station="Radio \\"Eins\\"\\\\Berlin\\nKultur"} 1', self.lines())
+        # one line per series
+        self.assertEqual(len([ line for line in self.lines() if line.startswith('test_stream_probe_failures_total') ]), 1)
+
+    def test_timed_and_stopwatch(self):
+        @self.metrics.timed('loop_seconds')
+        def work():
+            return 42
+
+        self.assertEqual(work(), 42)
+        stopwatch = Stopwatch(metrics=self.metrics)
+        stopwatch.lap('fonts')
+        stopwatch.lap('atlas')
+        histograms = self.metrics.snapshot()['histograms']
+        self.assertEqual(histograms['loop_seconds']['count'], 1)
+        self.assertEqual(sorted(histograms.keys()), [ 'loop_seconds', 'startup_seconds{phase="atlas"}', 'startup_seconds{phase="fonts"}' ])
+        self.assertTrue(stopwatch.summary().startswith('fonts '))
+
+    def test_server(self):
+        self.metrics.inc('state_writes_total')
+        server = MetricsServer(port=0, metrics=self.metrics).start()
+        try:
+            with urllib.request.urlopen(server.url, timeout=5) as response:
+                self.assertIn('test_state_writes_total 1', response.read().decode('utf-8').splitlines())
+            with urllib.request.urlopen(server.url.replace('/metrics', '/stats.json'), timeout=5) as response:
+                self.assertEqual(json.loads(response.read())['counters'], { 'state_writes_total': 1 })
+        finally:
+            server.stop()
+
+if __name__ == '__main__':
+    unittest.main()
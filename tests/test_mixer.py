@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import os
+import sys
+import threading
+import time
+import types
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mixer import AlsaMixer, FakeMixer, VolumeRamp
+
+class FakeAlsaMixer:
+    """
+    alsaaudio.Mixer stand-in, rejects levels above 100 like pyalsaaudio.
+    """
+
+    def __init__(self, control, index):
+        self.volume = 40
+        self.writes = []
+
+    def getvolume(self):
+        return [ self.volume, self.volume ]
+
+    def setvolume(self, value):
+        if value > 100:
+            raise ValueError('volume must be between 0 and 100')
+        self.volume = value
+        self.writes.append(value)
+
+class MixerTest(unittest.TestCase):
+
+    def test_unchanged_levels_are_not_written(self):
+        mixer = FakeMixer(level=50)
+        self.assertFalse(mixer.set_volume(50))
+        self.assertTrue(mixer.set_volume(60.4))
+        self.assertFalse(mixer.set_volume(60))
+        self.assertEqual([ value for (t, value) in mixer.history ], [ 60 ])
+        self.assertEqual(mixer.writes, 1)
+
+    def test_volume_range(self):
+        mixer = FakeMixer(level=50)
+        mixer.set_volume(170)
+        self.assertEqual(mixer.get_volume(), 160)
+        mixer.set_volume(-5)
+        self.assertEqual(mixer.get_volume(), 0)
+
+    def test_alsa_mixer_clamps_at_100(self):
+        alsaaudio = types.SimpleNamespace(Mixer=FakeAlsaMixer)
+        with mock.patch.dict(sys.modules, { 'alsaaudio': alsaaudio }):
+            mixer = AlsaMixer('PCM,0')
+        self.assertEqual(mixer.get_volume(), 40)
+        self.assertTrue(mixer.set_volume(160))
+        self.assertEqual(mixer.get_volume(), 100)
+        self.assertFalse(mixer.set_volume(110))
+        self.assertEqual(mixer.mixer.writes, [ 100 ])
+
+class VolumeRampTest(unittest.TestCase):
+
+    def test_ramp_reaches_its_target(self):
+        mixer = FakeMixer(level=0)
+        ramp = VolumeRamp(mixer, 20, 80, 0.2, curve='s', rate=50).start()
+        ramp.thread.join(2)
+        self.assertFalse(ramp.running())
+        levels = [ value for (t, value) in mixer.history ]
+        self.assertEqual(levels[0], 20)
+        self.assertEqual(levels[-1], 80)
+        self.assertEqual(levels, sorted(levels))
+
+    def test_curves(self):
+        for curve in [ 'linear', 'log', 's' ]:
+            ramp = VolumeRamp(FakeMixer(), 50, 90, 10, curve=curve)
+            self.assertEqual((ramp.value(0), ramp.value(10), ramp.value(20)), (50, 90, 90))
+        self.assertGreater(VolumeRamp(FakeMixer(), 50, 90, 10, curve='log').value(2), VolumeRamp(FakeMixer(), 50, 90, 10).value(2))
+
+    def test_stop_joins_the_thread(self):
+        mixer = FakeMixer(level=0)
+        ramp = VolumeRamp(mixer, 10, 100, 60, rate=100).start()
+        time.sleep(0.1)
+        ramp.stop()
+        self.assertFalse(ramp.thread.is_alive())
+        writes = len(mixer.history)
+        level = mixer.get_volume()
+        time.sleep(0.1)
+        # no step after stop()
+        self.assertEqual(len(mixer.history), writes)
+        self.assertEqual(mixer.get_volume(), level)
+        self.assertLess(level, 100)
+
+    def test_stop_from_the_ramp_thread(self):
+        mixer = FakeMixer(level=0)
+        ramp = VolumeRamp(mixer, 10, 100, 60, rate=100)
+        stopped = threading.Event()
+
+        def write(value):
+            ramp.stop()
+            stopped.set()
+
+        ramp.start()
+        mixer.write = write
+        self.assertTrue(stopped.wait(2))
+        ramp.thread.join(2)
+        self.assertFalse(ramp.running())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import os
+import re
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from iobroker import IoBroker
+from iobroker_standin import IoBrokerStandIn
+from object_catalog import ObjectCatalog, literal_prefix, synthetic_objects
+
+# the former IoBroker.get_objects walk
+def walk(objects, pattern):
+    return [ id for id in objects if re.match(pattern, id) ]
+
+PATTERNS = [
+    # wildcard in the middle
+    r'hm-rpc\.0\..*\.LEVEL',
+    r'zigbee\.0\.DEV0000.\.1\.TEMPERATURE',
+    # trailing wildcard
+    r'hm-rpc\.0\..*',
+    r'hm-rpc.*',
+    r'^alias\.0\.DEV00001\.',
+    # no wildcard
+    r'fritzdect\.0\.DEV00003\.2\.STATE',
+    r'fritzdect\.0\.DEV00003\.2\.STATE$',
+    r'system\.adapter\.missing',
+    # no literal prefix
+    r'.*\.UNREACH$',
+    r'(hm-rpc|zigbee)\.1\.DEV0000\d\.0\.RSSI',
+    r'\w+\.0\.DEV00002\.0\.LOWBAT',
+    r'hm-rpc\.[01]\.DEV00000\.0\.STATE',
+    r'hm-rpcx?\.0\.DEV00000\.0\.STATE',
+    r'',
+]
+
+class LiteralPrefixTest(unittest.TestCase):
+
+    def test_prefixes(self):
+        self.assertEqual(literal_prefix(r'hm-rpc\.0\..*\.LEVEL'), 'hm-rpc.0.')
+        self.assertEqual(literal_prefix(r'hm-rpc.*'), 'hm-rpc')
+        self.assertEqual(literal_prefix(r'^alias\.0\.'), 'alias.0.')
+        self.assertEqual(literal_prefix(r'fritzdect\.0\.x$'), 'fritzdect.0.x')
+        # an optional character is not part of the prefix
+        self.assertEqual(literal_prefix(r'hm-rpcx?\.0'), 'hm-rpc')
+        self.assertEqual(literal_prefix(r'ab{2}'), 'a')
+        self.assertEqual(literal_prefix(r'hm-rpc\.[01]'), 'hm-rpc.')
+        self.assertEqual(literal_prefix(r'\w+\.0'), '')
+        self.assertEqual(literal_prefix(r'.*\.UNREACH$'), '')
+        self.assertEqual(literal_prefix(r'hm-rpc|zigbee'), '')
+        self.assertEqual(literal_prefix(r''), '')
+
+class ObjectCatalogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.objects = synthetic_objects(2000)
+        # ioBroker does not deliver the ids sorted
+        self.objects = dict(reversed(list(self.objects.items())))
+        self.catalog = ObjectCatalog()
+        self.catalog.replace(self.objects)
+
+    def test_patterns_match_like_the_walk(self):
+        for pattern in PATTERNS:
+            self.assertEqual(self.catalog.match(pattern), walk(self.objects, pattern), pattern)
+            self.assertEqual(self.catalog.objects(pattern), [ self.objects[id] for id in walk(self.objects, pattern) ], pattern)
+
+    def test_cached_results(self):
+        pattern = PATTERNS[0]
+        first = self.catalog.match(pattern)
+        self.assertIs(self.catalog.match(pattern), first)
+        self.assertEqual((self.catalog.hits, self.catalog.misses), (1, 1))
+        self.catalog.replace({}, 'hm-rpc.0.')
+        self.assertEqual(self.catalog.match(pattern), [])
+
+    def test_refresh_of_one_adapter(self):
+        prefix = 'zigbee.0.'
+        refreshed = dict([ (id, obj) for (id, obj) in self.objects.items() if id.startswith(prefix) and not id.endswith('.RSSI') ])
+        refreshed['zigbee.0.NEW.0.STATE'] = { '_id': 'zigbee.0.NEW.0.STATE' }
+        # objects of other adapters are ignored
+        refreshed['hm-rpc.0.OTHER'] = {}
+        self.assertEqual(self.catalog.replace(refreshed, prefix), len(refreshed) - 1)
+        self.assertNotIn('hm-rpc.0.OTHER', self.catalog)
+        self.assertNotIn('zigbee.0.DEV00002.0.RSSI', self.catalog)
+        self.assertEqual(self.catalog['zigbee.0.NEW.0.STATE'], { '_id': 'zigbee.0.NEW.0.STATE' })
+        result = self.catalog.match(r'zigbee\.0\..*\.STATE')
+        # known objects keep their place, the new one is at the end
+        self.assertEqual(result[-1], 'zigbee.0.NEW.0.STATE')
+        self.assertEqual(result[:-1], walk(self.objects, r'zigbee\.0\..*\.STATE'))
+        self.assertEqual(len(self.catalog), len(self.objects) - len([ id for id in self.objects if id.startswith(prefix) and id.endswith('.RSSI') ]) + 1)
+
+class RefreshObjectsTest(unittest.TestCase):
+
+    def test_glob_download_of_a_prefix(self):
+        values = dict([ (id, 0) for id in [ 'hm-rpc.0.A.STATE', 'hm-rpc.0.B.STATE', 'hm-rpc.1.A.STATE', 'zigbee.0.C.STATE' ] ])
+        standin = IoBrokerStandIn(values=values).start()
+        try:
+            iobroker = IoBroker(standin.host, standin.port, get_objects=True)
+            self.assertEqual(len(iobroker.objects), 4)
+            standin.set('hm-rpc.0.D.STATE', 1)
+            standin.set('hm-rpc.1.E.STATE', 1)
+            # only the objects matching the glob 'hm-rpc.0.*' are downloaded and replaced
+            self.assertEqual(iobroker.refresh_objects('hm-rpc.0.'), 3)
+            self.assertEqual(iobroker.objects.match(r'hm-rpc\..*'), [ 'hm-rpc.0.A.STATE', 'hm-rpc.0.B.STATE', 'hm-rpc.1.A.STATE', 'hm-rpc.0.D.STATE' ])
+            self.assertEqual([ obj['_id'] for obj in iobroker.get_objects(r'.*\.STATE$') ], [ 'hm-rpc.0.A.STATE', 'hm-rpc.0.B.STATE', 'hm-rpc.1.A.STATE', 'zigbee.0.C.STATE', 'hm-rpc.0.D.STATE' ])
+        finally:
+            standin.stop()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from player import Mpg123Player
+
+FAKE_MPG123 = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_mpg123.py')
+
+class Mpg123PlayerTest(unittest.TestCase):
+
+    def setUp(self):
+        (fd, self.log) = tempfile.mkstemp(suffix='.log')
+        os.close(fd)
+        os.environ['FAKE_MPG123_LOG'] = self.log
+        self.states = []
+        self.audio = []
+        self.player = Mpg123Player([ sys.executable, FAKE_MPG123 ], on_status=self.states.append, on_audio=self.audio.append)
+
+    def tearDown(self):
+        self.player.quit()
+        del os.environ['FAKE_MPG123_LOG']
+        os.remove(self.log)
+
+    def wait(self, condition, timeout=5.0):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def commands(self):
+        with open(self.log) as f:
+            return [ line.strip() for line in f ]
+
+    def test_load(self):
+        self.assertTrue(self.player.load('radio.mp3'))
+        self.wait(lambda: not self.player.audio_time is None)
+        self.assertEqual(self.player.state, Mpg123Player.PLAYING)
+        self.assertEqual(len(self.audio), 1)
+        self.assertEqual(self.player.info['ID3'], 'radio.mp3')
+        self.assertEqual(self.commands(), [ 'SILENCE', 'LOAD radio.mp3' ])
+        self.player.stop()
+        self.wait(lambda: self.player.state == Mpg123Player.STOPPED)
+
+    def test_preload_and_resume(self):
+        self.assertTrue(self.player.preload('radio.mp3'))
+        self.wait(lambda: self.player.state == Mpg123Player.PAUSED)
+        # the format line of the preload is not the start of the audio
+        self.assertIsNone(self.player.audio_time)
+        self.assertTrue(self.player.load('radio.mp3'))
+        self.wait(lambda: not self.player.audio_time is None)
+        self.assertEqual(self.player.state, Mpg123Player.PLAYING)
+        self.assertFalse(self.player.resumed)
+        self.assertEqual(self.commands(), [ 'SILENCE', 'LOADPAUSED radio.mp3', 'PAUSE' ])
+        self.assertEqual(self.states, [ Mpg123Player.PAUSED, Mpg123Player.PLAYING ])
+
+    def test_other_url_after_preload_is_loaded(self):
+        self.player.preload('radio.mp3')
+        self.wait(lambda: self.player.state == Mpg123Player.PAUSED)
+        self.player.load('other.mp3')
+        self.wait(lambda: not self.player.audio_time is None)
+        self.assertEqual(self.commands()[-1], 'LOAD other.mp3')
+
+    def test_error(self):
+        self.player.load('missing.mp3')
+        self.wait(lambda: not self.player.error is None)
+        self.assertIn('missing.mp3', self.player.error)
+        self.assertIsNone(self.player.audio_time)
+
+    def test_restart_after_crash(self):
+        self.player.load('crash.mp3')
+        self.wait(lambda: not self.player.running())
+        self.wait(lambda: self.player.state == Mpg123Player.STOPPED)
+        self.assertEqual(self.states, [ Mpg123Player.PLAYING, Mpg123Player.STOPPED ])
+        self.assertEqual(self.player.starts, 1)
+        self.player.load('radio.mp3')
+        self.wait(lambda: not self.player.audio_time is None)
+        self.assertEqual(self.player.starts, 2)
+        self.assertEqual(self.player.state, Mpg123Player.PLAYING)
+        self.assertEqual(self.commands(), [ 'SILENCE', 'LOAD crash.mp3', 'SILENCE', 'LOAD radio.mp3' ])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import state_store
+from state_store import StateStore
+
+class StateStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'state.json')
+        self.now = 0.0
+        self.store = StateStore(self.file_name, interval=60, clock=lambda: self.now)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def stored(self):
+        with open(self.file_name) as f:
+            return json.load(f)
+
+    def test_changes_are_debounced(self):
+        self.assertEqual(self.store.load(), {})
+        self.store.set('alarm', '6:30')
+        self.now = 30.0
+        self.store.set('alarm', '6:45')
+        self.store.set('station', 'radio')
+        # written one interval after the first change
+        self.assertEqual(self.store.due(), 60.0)
+        self.assertFalse(self.store.flush())
+        self.assertFalse(os.path.exists(self.file_name))
+        self.now = 60.0
+        self.assertTrue(self.store.flush())
+        self.assertEqual(self.stored(), { 'alarm': '6:45', 'station': 'radio' })
+        self.assertEqual((self.store.changes, self.store.writes), (3, 1))
+        # unchanged values do not make the store dirty
+        self.store.set('alarm', '6:45')
+        self.assertIsNone(self.store.due())
+        self.assertFalse(self.store.flush(force=True))
+        self.assertEqual(self.store.writes, 1)
+
+    def test_close_writes_at_once(self):
+        self.store.set('brightness', 120)
+        self.store.close()
+        self.assertEqual(StateStore(self.file_name).load(), { 'brightness': 120 })
+
+    def test_atomic_write_sequence(self):
+        calls = []
+        replace = os.replace
+        fsync = os.fsync
+
+        def recording_replace(src, dst):
+            calls.append(('replace', os.path.basename(src), os.path.basename(dst)))
+            replace(src, dst)
+
+        def recording_fsync(fd):
+            calls.append(('fsync', os.path.isdir('/proc/self/fd/{0}'.format(fd)) if os.path.exists('/proc/self/fd') else None))
+            fsync(fd)
+
+        self.store.set('alarm', '7:00')
+        with mock.patch.object(state_store.os, 'replace', recording_replace), mock.patch.object(state_store.os, 'fsync', recording_fsync):
+            self.assertTrue(self.store.flush(force=True))
+        self.assertEqual([ call[0] for call in calls ], [ 'fsync', 'replace', 'fsync' ])
+        self.assertEqual(calls[1][1:], ('state.json.tmp', 'state.json'))
+        if not calls[0][1] is None:
+            # the file first, then the directory
+            self.assertEqual((calls[0][1], calls[2][1]), (False, True))
+        self.assertFalse(os.path.exists(self.file_name + '.tmp'))
+
+    def test_failed_write_stays_dirty(self):
+        self.store.set('alarm', '6:30')
+        self.store.close()
+        self.store.set('alarm', '8:00')
+        self.now = 60.0
+        with mock.patch.object(state_store.os, 'replace', side_effect=OSError(28, 'No space left on device')):
+            self.assertFalse(self.store.flush())
+        # the old file is untouched and the change is retried one interval later
+        self.assertEqual(self.stored(), { 'alarm': '6:30' })
+        self.assertTrue(self.store.dirty)
+        self.assertEqual(self.store.due(), 120.0)
+        self.assertFalse(self.store.flush())
+        self.now = 120.0
+        self.assertTrue(self.store.flush())
+        self.assertEqual(self.stored(), { 'alarm': '8:00' })
+        self.assertFalse(self.store.dirty)
+
+    def test_unreadable_file(self):
+        with open(self.file_name, 'w') as f:
+            f.write('{ broken')
+        self.assertEqual(self.store.load(), {})
+
+if __name__ == '__main__':
+    unittest.main()
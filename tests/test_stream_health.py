@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import os
+import socketserver
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stream_health import StreamProber
+from stream_standin import StreamStandIn
+
+class IcyHandler(socketserver.StreamRequestHandler):
+    """
+    SHOUTcast v1 style server: answers with 'ICY 200 OK' instead of an HTTP status line.
+    """
+
+    def handle(self):
+        while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+            pass
+        self.wfile.write(b'ICY 200 OK\r\nicy-name:test\r\nicy-br:128\r\n\r\n' + b'\xff\xfb\x90\x00' * 4096)
+
+class BrokenHandler(socketserver.StreamRequestHandler):
+    """
+    Server answering with garbage instead of a status line.
+    """
+
+    def handle(self):
+        while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+            pass
+        self.wfile.write(b'HELLO\r\n\r\n')
+
+class StreamProberTest(unittest.TestCase):
+
+    def setUp(self):
+        (fd, self.mp3) = tempfile.mkstemp(suffix='.mp3')
+        # MPEG-1 layer III frame headers, 128 kbit/s
+        os.write(fd, b'\xff\xfb\x90\x00' + b'\x00' * 413)
+        os.close(fd)
+        self.standin = StreamStandIn(self.mp3).start()
+        self.icy = socketserver.ThreadingTCPServer(('127.0.0.1', 0), IcyHandler)
+        self.icy.daemon_threads = True
+        threading.Thread(target=self.icy.serve_forever, daemon=True).start()
+        self.icy_url = 'http://127.0.0.1:{0}/stream'.format(self.icy.server_address[1])
+
+    def tearDown(self):
+        self.standin.stop()
+        self.icy.shutdown()
+        self.icy.server_close()
+        os.remove(self.mp3)
+
+    def test_icy_server_is_healthy(self):
+        prober = StreamProber({ 'good': self.standin.url, 'icy': self.icy_url }, timeout=5)
+        prober.probe_all()
+        table = prober.snapshot()
+        self.assertEqual(set(table.keys()), set([ self.standin.url, self.icy_url ]))
+        self.assertTrue(table[self.standin.url]['ok'])
+        self.assertEqual(table[self.standin.url]['bitrate'], 128)
+        self.assertTrue(table[self.icy_url]['ok'], table[self.icy_url]['error'])
+        self.assertEqual(table[self.icy_url]['bitrate'], 128)
+        self.assertGreater(table[self.icy_url]['ttfb'], 0)
+        self.assertEqual(table[self.icy_url]['failures'], 0)
+        self.assertTrue(prober.healthy('good'))
+        self.assertTrue(prober.healthy('icy'))
+
+    def test_broken_server_is_a_failure_of_its_station_only(self):
+        broken = socketserver.ThreadingTCPServer(('127.0.0.1', 0), BrokenHandler)
+        broken.daemon_threads = True
+        threading.Thread(target=broken.serve_forever, daemon=True).start()
+        broken_url = 'http://127.0.0.1:{0}/stream'.format(broken.server_address[1])
+        try:
+            prober = StreamProber({ 'good': self.standin.url, 'broken': broken_url }, timeout=5)
+            prober.probe_all()
+            table = prober.snapshot()
+        finally:
+            broken.shutdown()
+            broken.server_close()
+        self.assertFalse(table[broken_url]['ok'])
+        self.assertIn('BadStatusLine', table[broken_url]['error'])
+        self.assertEqual(table[broken_url]['failures'], 1)
+        self.assertTrue(prober.healthy('good'))
+        self.assertFalse(prober.healthy('broken'))
+        self.assertEqual(prober.fastest(), 'good')
+
+    def test_mirror_fallback(self):
+        prober = StreamProber({ 'radio': [ 'http://127.0.0.1:1/stream', self.standin.url ] }, timeout=5)
+        prober.probe_all()
+        self.assertTrue(prober.healthy('radio'))
+        self.assertEqual(prober.url('radio'), self.standin.url)
+
+if __name__ == '__main__':
+    unittest.main()
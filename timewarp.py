@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+
+# standard Python modules
+import collections
+import datetime
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pygame
+from pygame.locals import *
+
+from alarmclock import *
+from backlight import FakeBacklight
+from iobroker_standin import IoBrokerStandIn
+import metrics
+
+# touches replayed every simulated day: (time, menu element)
+DEFAULT_SCRIPT = [
+    { 'time': '7:30', 'touch': 'play' },
+    { 'time': '7:45', 'touch': 'play' },
+    { 'time': '12:00', 'touch': 'bright+' },
+    { 'time': '12:00:10', 'touch': 'bright-' },
+    { 'time': '18:00', 'touch': 'vol+' },
+    { 'time': '18:00:05', 'touch': 'vol-' },
+    { 'time': '20:00', 'touch': 'alarm' },
+    { 'time': '20:00:05', 'touch': 'hour+' },
+    { 'time': '20:00:10', 'touch': 'hour-' },
+    { 'time': '20:00:15', 'touch': 'alarm' },
+]
+
+class SimulatedClock:
+    """
+    Time source for the simulation, time only moves when advanced.
+    """
+
+    def __init__(self, start):
+        self.current = start
+
+    def now(self):
+        return self.current
+
+    def time(self):
+        """
+        Current simulated time in seconds since the epoch.
+        """
+        return self.current.timestamp()
+
+    def advance(self, until):
+        if until > self.current:
+            self.current = until
+
+class SimulatedAlarmClock(AlarmClock):
+    """
+    AlarmClock running on a simulated clock without display, backlight, mixer or player.
+    wait_events() does not sleep: it jumps to the next wake-up, fires due alarms
+    and replays scripted touches. Renders, touches and loop iterations are counted.
+    """
+
+    def __init__(self, clock, end, script=[], config=None, iobroker=None, logger=None, standin=None):
+        # the first frame is already rendered during AlarmClock.__init__()
+        self.renders = collections.Counter()
+        # nothing real is opened: the fakes are passed in before AlarmClock.__init__() sets the brightness
+        backlight = FakeBacklight(logger=logger)
+        mixer = FakeMixer(logger=logger)
+        player = FakePlayer(logger=logger, on_audio=self.on_audio)
+        AlarmClock.__init__(self, config=config, iobroker=iobroker, logger=logger, time_source=clock.now, backlight=backlight, mixer=mixer, player=player)
+        self.sim = clock
+        self.end = end
+        self.script = sorted(script, key=lambda entry: entry[0])
+        self.standin = standin
+        # the split-flap transition sleeps in real time
+        self.flipper = None
+        self.touches = 0
+        self.iterations = 0
+        self.next_sensor_update = clock.now()
+
+    def open_state_store(self, config):
+        """
+        Count the state writes without reading or writing a state file.
+        """
+        return StateStore(None, config.get('interval', 60), clock=lambda: self.time_source().timestamp(), logger=self.log)
+
+    def start_workers(self):
+        """
+        Start the ioBroker threads, alarms are fired by wait_events() instead of the trigger thread.
+        """
+        if self.fetcher is None:
+            return
+        self.fetcher.start()
+        self.alarm_subscription.start()
+        # the current alarm of the stream must be known before the simulated time runs
+        deadline = time.time() + 2.0
+        while self.fetcher.get('alarm') is None and time.time() < deadline:
+            time.sleep(0.01)
+
+    def render_time(self, *args, **kwargs):
+        self.renders['time'] += 1
+        return AlarmClock.render_time(self, *args, **kwargs)
+
+    def render_top(self, *args, **kwargs):
+        self.renders['top'] += 1
+        return AlarmClock.render_top(self, *args, **kwargs)
+
+    def render_bottom(self, *args, **kwargs):
+        self.renders['bottom'] += 1
+        return AlarmClock.render_bottom(self, *args, **kwargs)
+
+    def render_temp(self, *args, **kwargs):
+        self.renders['temp'] += 1
+        return AlarmClock.render_temp(self, *args, **kwargs)
+
+    def touch(self, name):
+        """
+        Create the touch event for a menu element of the current screen or None.
+        """
+        menu = 'bottom'
+        if self.state == ClockState.EDIT:
+            menu = 'edit'
+        elem = self.get_menu_element(menu, name)
+        if elem is None or not 'rect' in elem.keys():
+            self.log.warning('no touch area for {0} in menu {1}'.format(name, menu))
+            return None
+        (x, y) = elem['rect'].center
+        if self.rotated_display:
+            (x, y) = (self.w - x, self.h - y)
+        self.touches += 1
+        return pygame.event.Event(MOUSEBUTTONUP, pos=(x, y), button=1)
+
+    def update_sensors(self):
+        """
+        Let the stand-in temperatures change every 5 simulated minutes.
+        """
+        if self.standin is None or self.sim.now() < self.next_sensor_update:
+            return
+        for id in self.config.get('temperatures', []):
+            state = self.standin.states.get(id)
+            value = 20.0 if state is None else state['val']
+            self.standin.set(id, round(value + random.uniform(-0.3, 0.3), 1))
+        self.next_sensor_update = self.sim.now() + datetime.timedelta(minutes=5)
+
+    def wait_events(self, timeout):
+        """
+        Advance the simulated time to the next wake-up or scripted touch.
+        """
+        self.iterations += 1
+        if not self.fetcher is None:
+            # fetch results and cache refreshes are applied before the time moves on, as on the real clock
+            self.fetcher.requests.join()
+            while len(self.iobroker.refreshing) > 0:
+                time.sleep(0.001)
+        events = [ event for event in pygame.event.get() if event.type != WAKEUP_EVENT ]
+        if len(events) > 0:
+            return events
+        if hasattr(timeout, 'total_seconds'):
+            timeout = timeout.total_seconds()
+        target = self.sim.now() + datetime.timedelta(seconds=max(0.0, timeout))
+        touch = None
+        if len(self.script) > 0 and self.script[0][0] <= target:
+            (target, touch) = self.script.pop(0)
+        self.sim.advance(min(target, self.end))
+        self.alarm_trigger.fire(self.alarms.due(self.sim.now()))
+        self.update_sensors()
+        events = [ event for event in pygame.event.get() if event.type != WAKEUP_EVENT ]
+        if not touch is None and target <= self.end:
+            event = self.touch(touch)
+            if not event is None:
+                events.append(event)
+        if self.sim.now() >= self.end:
+            self.keep_running = False
+        return events
+
+def load_script(entries, start, days):
+    """
+    Expand script entries ({ 'time': 'H:MM[:SS]', 'touch': name, 'day': n (optional) })
+    to a list of (datetime, name) within the simulated days.
+    """
+    result = []
+    for day in range(days):
+        date = start.date() + datetime.timedelta(days=day)
+        for entry in entries:
+            if 'day' in entry.keys() and entry['day'] != day:
+                continue
+            parts = [ int(p) for p in entry['time'].split(':') ] + [ 0 ]
+            t = datetime.datetime.combine(date, datetime.time(parts[0], parts[1], parts[2]))
+            if t >= start:
+                result.append((t, entry['touch']))
+    return result
+
+def benchmark(config='alarmclock.json', start=None, days=1, script=None, logger=None):
+    """
+    Run the alarm clock for days simulated days against an ioBroker stand-in.
+    Returns a dictionary with totals and values per simulated hour.
+    """
+    if start is None:
+        start = datetime.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    if script is None:
+        script = DEFAULT_SCRIPT
+    end = start + datetime.timedelta(days=days)
+    clock = SimulatedClock(start)
+    with open(config) as f:
+        settings = json.load(f)
+    values = dict([ (id, 20.0) for id in settings.get('temperatures', []) ])
+    values[settings.get('alarm_id', '0_userdata.0.og1.sz.alarm')] = '06:30'
+    standin = IoBrokerStandIn(values=values, logger=logger, clock=clock.time).start()
+
+    spawned = [ 0 ]
+    popen = subprocess.Popen
+    class CountingPopen(popen):
+        def __init__(self, *args, **kwargs):
+            spawned[0] += 1
+            popen.__init__(self, *args, **kwargs)
+    subprocess.Popen = CountingPopen
+    metrics.registry.reset()
+    try:
+        ui = SimulatedAlarmClock(clock, end, load_script(script, start, days), config=config, iobroker='{0}:{1}'.format(standin.host, standin.port), logger=logger, standin=standin)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        cpu_main = time.thread_time()
+        ui.run()
+        cpu_main = time.thread_time() - cpu_main
+        cpu = time.process_time() - cpu
+        wall = time.perf_counter() - wall
+    finally:
+        subprocess.Popen = popen
+        standin.stop()
+    pygame.quit()
+
+    hours = (clock.now() - start).total_seconds() / 3600
+    paths = collections.Counter([ path.partition('/')[0] for path in standin.request_log ])
+    result = {
+        'start': start.isoformat(),
+        'end': clock.now().isoformat(),
+        'hours': hours,
+        'wall': wall,
+        'speedup': hours * 3600 / max(wall, 1e-9),
+        'iterations': ui.iterations,
+        'renders': dict(ui.renders),
+        'flushes': ui.flush_count,
+        'flush_pixels': ui.flush_pixels_total,
+        'subprocesses': spawned[0],
+        'iobroker_requests': standin.requests,
+        'iobroker_paths': dict(paths),
+        'alarms': list(ui.alarm_trigger.latencies),
+        'touches': ui.touches,
+        'backlight_writes': ui.backlight.writes,
+        'backlight_fades': len(ui.backlight.fades),
+        'mixer_writes': ui.mixer.writes,
+        'player_commands': len(ui.player.history),
+        'preloads': len([ entry for entry in ui.player.history if entry[1] == 'preload' ]),
+        'alarm_audio': list(ui.audio_delays),
+        'state_changes': ui.state_store.changes,
+        'state_writes': ui.state_store.writes,
+        'cpu': cpu,
+        'cpu_main': cpu_main,
+    }
+    result['metrics'] = metrics.registry.snapshot()
+    result['per_hour'] = {
+        'renders': sum(ui.renders.values()) / hours,
+        'flushes': ui.flush_count / hours,
+        'subprocesses': spawned[0] / hours,
+        'iobroker_requests': standin.requests / hours,
+        'cpu': cpu / hours,
+        'cpu_main': cpu_main / hours,
+    }
+    return result
+
+if __name__ == '__main__':
+    import argparse
+
+    self = os.path.basename(sys.argv[0])
+    myName = os.path.splitext(self)[0]
+    log = logging.getLogger(myName)
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+    parser = argparse.ArgumentParser(description='headless time-warp benchmark of the alarm clock')
+    parser.add_argument('-d', '--debug', action='store_true', help='debug execution')
+    parser.add_argument('-c', '--config', default='alarmclock.json', help='config file')
+    parser.add_argument('--days', type=int, default=1, help='simulated days')
+    parser.add_argument('--start', default=None, help='simulation start (ISO date or date and time, default today 0:00)')
+    parser.add_argument('-s', '--script', default=None, help='JSON file with scripted touches')
+    parser.add_argument('-o', '--output', default=None, help='write the result to a JSON file')
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.debug:
+        log.setLevel(logging.DEBUG)
+    else:
+        log.setLevel(logging.WARNING)
+    start = None
+    if not args.start is None:
+        start = datetime.datetime.fromisoformat(args.start)
+    script = None
+    if not args.script is None:
+        with open(args.script) as f:
+            script = json.load(f)
+    result = benchmark(args.config, start, args.days, script, logger=log)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    print(json.dumps(result, indent=2))